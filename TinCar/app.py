@@ -1,9 +1,14 @@
+import json
 import os
 import sqlite3
+import zlib
+from datetime import datetime, timedelta, timezone
+from functools import wraps
 from time import time
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, make_response
 from flask_socketio import SocketIO
+from flask_socketio import disconnect as socket_disconnect, join_room
 from routes.auth import auth
 # Usar las funciones centralizadas de acceso a DB desde models
 from models import (
@@ -20,11 +25,14 @@ from models import (
     create_reservations_table,
     create_reviews_table,
     get_active_parkings,
+    get_parkings_by_ids,
     get_reservations_count_by_driver,
     get_rating_sum_for_driver,
     add_reservation,
     add_notification,
     get_notifications_by_user,
+    get_notifications_json_by_user,
+    update_notification_extra_data,
     mark_driver_arrived,
     finish_reservation,
     get_reservation_by_driver_and_parking,
@@ -32,8 +40,34 @@ from models import (
     get_reservation,
     add_review,
     notify_expired_reservations,
+    add_change_listener,
+    publish_change,
+    bump_resource_versions,
+    bump_live_reservation_versions,
+    get_resource_version,
+    get_resource_versions,
+    get_owner_active_reservations,
+    mark_all_notifications_read,
+    clear_all_notifications,
+    get_lease,
+    hold_reservation,
 )
-from utils.geocode import geocode_location
+from utils.geocode import geocode_location, fill_parking_region_async
+from utils.ranking import rank_parkings, estimate_eta_minutes
+from utils.spatial import decode_polyline, corridor_search
+from utils.parking_snapshot import get_parking_snapshot, publish_parking_snapshot_async
+from utils.tracking import location_store, parse_fixes
+from utils.live_tracking import TrackingHub
+from utils.long_poll import notification_waiters, MAX_TIMEOUT as LONG_POLL_MAX_TIMEOUT
+from utils.pubsub import create_bus, LocalBus, BusClientManager
+from utils.notification_retention import notification_retention
+from utils.notification_payloads import splice_json
+from utils.outbox import outbox_dispatcher
+from utils.pricing import price_reservation, timestamp_seconds, CHARGE_REFRESH_SECONDS
+from utils import clock
+from utils.no_show import no_show_policy, MAX_HOLD_MINUTES
+from utils.idempotency import idempotency_store, request_fingerprint, MAX_KEY_LENGTH as IDEMPOTENCY_MAX_KEY_LENGTH
+from scheduler import deadline_scheduler, SchedulerService, ChangePoller, DEADLINES_CHANNEL, LOCAL_BUS_RELOAD_INTERVAL, LEASE_NAME
 import requests
 import threading
 import time as _time
@@ -49,8 +83,167 @@ app = Flask(
 
 app.secret_key = 'clave-secreta'
 
+# Bus de eventos entre workers (TINCAR_BUS: 'local', 'unix[:dir]' o 'redis://...').
+# Con más de un worker SocketIO lo usa como message queue para que los emit lleguen
+# a clientes conectados a otros procesos.
+bus = create_bus()
+
 # Inicializar SocketIO
-socketio = SocketIO(app)
+if type(bus) is LocalBus:
+    socketio = SocketIO(app)
+else:
+    socketio = SocketIO(app, client_manager=BusClientManager(bus))
+
+# Seguimiento en vivo del conductor hacia el parqueadero (ver eventos SocketIO más abajo).
+# Las posiciones y los fines de seguimiento pasan por el bus: el conductor puede enviar
+# sus fixes a un worker distinto del que tiene el socket del arrendador.
+tracking_hub = TrackingHub(emit=socketio.emit, start_background_task=socketio.start_background_task,
+                           sleep=socketio.sleep, latest_position=location_store.latest)
+location_store.add_listener(
+    lambda driver_id, fix: bus.publish('driver_location', {'driver_id': driver_id, 'fix': list(fix)}))
+bus.subscribe('driver_location', lambda m: tracking_hub.on_location(m['driver_id'], tuple(m['fix'])))
+bus.subscribe('tracking_ended', lambda m: tracking_hub.end_reservation(m['reservation_id'], m['status']))
+
+
+def end_tracking(reservation_id, status):
+    """Termina el seguimiento en vivo de la reserva en todos los workers."""
+    bus.publish('tracking_ended', {'reservation_id': reservation_id, 'status': status})
+
+
+def user_room(user_id):
+    """Sala SocketIO privada de un usuario (se une al conectarse)."""
+    return f'user:{user_id}'
+
+
+def push_change_to_users(event, user_ids, payload):
+    """Reenvía los cambios publicados por models a las salas de los usuarios afectados."""
+    for user_id in user_ids:
+        socketio.emit(event, payload, to=user_room(user_id))
+
+
+add_change_listener(push_change_to_users)
+
+
+def wake_notification_waiters(event, user_ids, payload):
+    """Despierta los long-poll de /api/notifications/wait de los usuarios con notificaciones
+    nuevas, en todos los workers."""
+    if event == 'notification':
+        bus.publish('notifications', {'user_ids': list(user_ids)})
+
+
+add_change_listener(wake_notification_waiters)
+# Parqueadero creado, borrado, movido o con otra disponibilidad: republicar el snapshot
+# compartido (/nearby, /corridor) en segundo plano
+add_change_listener(lambda event, user_ids, payload: publish_parking_snapshot_async()
+                    if event == 'parking_updated' else None)
+# Las notificaciones con canales externos dejan entregas en el outbox: despertar al dispatcher
+add_change_listener(lambda event, user_ids, payload: outbox_dispatcher.wake() if event == 'notification' else None)
+bus.subscribe('notifications', lambda m: [notification_waiters.notify(uid) for uid in m['user_ids']])
+
+
+def refresh_deadlines(reservation_id):
+    """Los plazos de la reserva cambiaron (llegada, fin del tiempo): avisar al
+    proceso líder del scheduler, que puede ser otro (python -m scheduler)."""
+    bus.publish(DEADLINES_CHANNEL, {'reservation_id': reservation_id})
+
+
+add_change_listener(lambda event, user_ids, payload: refresh_deadlines(payload.get('reservation_id'))
+                    if event == 'reservation_updated' else None)
+bus.subscribe(DEADLINES_CHANNEL, lambda m: deadline_scheduler.refresh(m['reservation_id']))
+# Las reservas liberadas por no llegar (utils/no_show.py) no pasan por las rutas de cancelación
+add_change_listener(lambda event, user_ids, payload: end_tracking(payload['reservation_id'], 'cancelled')
+                    if event == 'reservation_updated' and payload.get('reason') == 'no_show' else None)
+
+
+def start_background_services():
+    """Trabajo de fondo (scheduler.py): plazos de las reservas y retención de notificaciones
+    sólo en el proceso líder, y entregas por email/SMS/push del outbox. Es seguro llamarlo
+    en cada worker (gunicorn.conf.py) o junto a `python -m scheduler`: el lease elige uno.
+    Las tablas ya deben existir (models.create_all_tables)."""
+    if type(bus) is LocalBus:
+        # Sin bus entre procesos el líder no ve las transiciones de los otros workers:
+        # las detecta consultando la DB (ChangePoller)
+        deadline_scheduler.reload_interval = LOCAL_BUS_RELOAD_INTERVAL
+        ChangePoller(deadline_scheduler, dispatcher=outbox_dispatcher).start()
+    service = SchedulerService(retention=notification_retention, dispatcher=outbox_dispatcher)
+    service.start()
+    return service
+
+
+def versioned_by(*resources, refresh_every=None):
+    """Decorador para los GET que los clientes consultan periódicamente: agrega un ETag
+    fuerte con la versión de `resources` del usuario y responde 304 sin ejecutar la
+    vista cuando If-None-Match coincide (una sola consulta por clave primaria).
+    Con refresh_every (segundos) el ETag cambia además en cada intervalo del reloj: para
+    respuestas con valores que avanzan con el tiempo (el cobro de las reservas)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if 'user_id' not in session:
+                return view(*args, **kwargs)
+            versions = get_resource_versions(session['user_id'], resources)
+            if versions is None:
+                return view(*args, **kwargs)
+            etag = f"{'+'.join(resources)}-{session['user_id']}-{'.'.join(map(str, versions))}"
+            if refresh_every:
+                etag += f"-t{int(clock.now() // refresh_every)}"
+            if request.query_string:
+                # Cada combinación de parámetros (cursor, filtros) es una representación distinta
+                etag += f"-{zlib.crc32(request.query_string):08x}"
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # El navegador debe revalidar siempre (recibe 304 si nada cambió)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def idempotent(view):
+    """Decorador para los POST que los clientes reintentan: con el header Idempotency-Key
+    la vista se ejecuta una sola vez por (usuario, clave) y los reintentos reciben la
+    respuesta guardada (header Idempotent-Replayed). Un duplicado que llega mientras la
+    original está en curso la espera. Las respuestas 5xx no se guardan: el reintento
+    vuelve a ejecutar."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or 'user_id' not in session:
+            return view(*args, **kwargs)
+        if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            return jsonify({'success': False, 'error': 'Idempotency-Key demasiado largo'}), 400
+        user_id = session['user_id']
+        fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+        state, stored = idempotency_store.begin(user_id, key, fingerprint)
+        if state == 'done':
+            response = app.response_class(stored[1], status=stored[0], mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        if state == 'mismatch':
+            return jsonify({'success': False, 'error': 'Idempotency-Key ya usado con otra petición'}), 422
+        if state == 'in_flight':
+            response = jsonify({'success': False, 'error': 'La petición original sigue en curso'})
+            response.status_code = 409
+            response.headers['Retry-After'] = '1'
+            return response
+        claim_token = stored
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.abort(user_id, key, claim_token)
+            raise
+        if response.status_code >= 500:
+            idempotency_store.abort(user_id, key, claim_token)
+        else:
+            idempotency_store.complete(user_id, key, claim_token, response.status_code,
+                                       response.get_data(as_text=True))
+        return response
+    return wrapper
 
 # Registrar blueprints
 app.register_blueprint(auth)
@@ -269,6 +462,9 @@ def create_parking():
         except Exception:
             full = None
         resp = {'success': True, 'parking': full or parking}
+        # Completar/corregir departamento y ciudad desde las coordenadas en segundo plano
+        if full and full.get('latitude') is not None and full.get('longitude') is not None:
+            fill_parking_region_async(full['id'])
         # indicar si la geocodificación falló y por eso faltan coordenadas
         if not full or full.get('latitude') is None or full.get('longitude') is None:
             resp['geocode_failed'] = True
@@ -306,6 +502,8 @@ def set_parking_active(parking_id):
             return {'error': 'forbidden'}, 403
         cur.execute('UPDATE parkings SET active = ? WHERE id = ?', (active_value, parking_id))
         conn.commit()
+        publish_change('parking_updated', [session['user_id']], {'parking_id': parking_id})
+        bump_live_reservation_versions(parking_id=parking_id)
         # fetch updated parking info to return
         cur.execute('SELECT id, name, address, latitude, longitude FROM parkings WHERE id = ?', (parking_id,))
         parking_info = cur.fetchone()
@@ -379,6 +577,13 @@ def parking_update(parking_id):
         cur.execute(f'UPDATE parkings SET {set_clause} WHERE id = ?', (*data.values(), parking_id))
         conn.commit()
         conn.close()
+        if any(k in data for k in ('latitude', 'longitude', 'department', 'city')):
+            fill_parking_region_async(parking_id)
+        if any(k in data for k in ('latitude', 'longitude', 'active')):
+            publish_change('parking_updated', [session['user_id']], {'parking_id': parking_id})
+        else:
+            bump_resource_versions([session['user_id']], 'parkings')
+        bump_live_reservation_versions(parking_id=parking_id)
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -419,6 +624,9 @@ def profile_update():
         cur.execute('UPDATE users SET name = ?, email = ?, phone = ? WHERE id = ?', (name, email, phone, user_id))
         conn.commit()
         conn.close()
+        # Las reservas vigentes muestran el nombre del conductor y del arrendador
+        bump_resource_versions([user_id], 'reservations')
+        bump_live_reservation_versions(owner_id=user_id)
         # Actualizar datos en la sesión
         session['name'] = name
         session['email'] = email
@@ -474,6 +682,7 @@ def cancel_reservation_route(reservation_id):
         result = cancel_reservation(reservation_id, session['user_id'])
         if not result:
             return jsonify({'success': False, 'error': 'No se pudo cancelar la reserva.'}), 500
+        end_tracking(reservation_id, 'cancelled')
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -559,6 +768,7 @@ def api_get_parking(parking_id):
 
 
 @app.route('/api/reservations', methods=['POST'])
+@idempotent
 def api_create_reservation():
     """API del conductor: crear una nueva reserva."""
     if 'user_id' not in session:
@@ -567,12 +777,24 @@ def api_create_reservation():
     data = request.get_json(silent=True) or {}
     parking_id = data.get('parking_id')
     duration_minutes = data.get('duration_minutes', 10)
-    eta_minutes = data.get('eta_minutes', 0)
+    eta_minutes = data.get('eta_minutes')
     
     if not parking_id:
         return jsonify({'success': False, 'error': 'Se requiere parking_id'}), 400
     
     try:
+        # Si el cliente no envía ETA pero sí su ubicación, calcularla en el servidor
+        if eta_minutes is None:
+            eta_minutes = 0
+            lat = data.get('latitude', data.get('lat'))
+            lon = data.get('longitude', data.get('lon'))
+            if lat is not None and lon is not None:
+                try:
+                    estimated = estimate_eta_minutes(float(lat), float(lon), get_parking(parking_id) or {})
+                    if estimated is not None:
+                        eta_minutes = estimated
+                except (TypeError, ValueError):
+                    pass
         # Verificar si ya existe una reserva activa para este parqueadero
         existing = get_reservation_by_driver_and_parking(session['user_id'], parking_id)
         if existing and existing.get('status') not in ['cancelled', 'completed']:
@@ -582,7 +804,6 @@ def api_create_reservation():
             notif_exists = any(n['type'] == 'active_reservation' and n['reservation_id'] == existing['id'] for n in notifications)
             if not notif_exists:
                 # Obtener nombre del garaje
-                from models import get_parking
                 parking = get_parking(parking_id)
                 parking_name = parking['name'] if parking and 'name' in parking else 'el garaje'
                 add_notification(
@@ -592,7 +813,7 @@ def api_create_reservation():
                     reservation_id=existing['id'],
                     owner_id=parking['owner_id'] if parking and 'owner_id' in parking else None,
                     eta=existing.get('eta_minutes', 0),
-                    extra_data=f'{{"parking_name": "{parking_name}", "duration": {existing.get("duration_minutes", 10)}}}'
+                    extra_data={'parking_name': parking_name, 'duration': existing.get('duration_minutes', 10)}
                 )
             return jsonify({'success': False, 'error': 'Ya tienes una reserva activa para este parqueadero', 'reservation': existing}), 400
         # Crear la reserva
@@ -604,6 +825,8 @@ def api_create_reservation():
         )
         if not reservation:
             return jsonify({'success': False, 'error': 'No se pudo crear la reserva'}), 500
+        # La nueva reserva define la geocerca de llegada automática del conductor
+        location_store.forget_target(session['user_id'])
         return jsonify({
             'success': True,
             'reservation': reservation
@@ -640,8 +863,10 @@ def api_get_driver_reservations():
 
 
 @app.route('/api/reservations/active/driver', methods=['GET'])
+@versioned_by('reservations', refresh_every=CHARGE_REFRESH_SECONDS)
 def api_get_active_reservations_driver():
-    """Devuelve las reservas activas (pending/arrived/active) del conductor logueado."""
+    """Devuelve las reservas activas (pending/arrived/active) del conductor logueado, con
+    el cobro a la fecha (charge, utils/pricing.py)."""
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'not authenticated'}), 401
     try:
@@ -650,7 +875,7 @@ def api_get_active_reservations_driver():
         cursor.execute('''
          SELECT r.id, r.status, r.duration_minutes, r.eta_minutes, r.created_at, r.driver_id,
              u.name as driver_name, r.parking_id, p.name as parking_name, p.address, p.occupied_since,
-             owner.name as owner_name
+             owner.name as owner_name, r.penalty_active
             FROM reservations r
             LEFT JOIN users u ON r.driver_id = u.id
             LEFT JOIN parkings p ON r.parking_id = p.id
@@ -698,7 +923,10 @@ def api_get_active_reservations_driver():
                     'parking_id': r['parking_id'],
                     'parking_name': r['parking_name'],
                     'address': r['address'],
-                    'owner_name': owner_name
+                    'owner_name': owner_name,
+                    'charge': price_reservation({'status': r['status'], 'duration_minutes': duration_minutes,
+                                                 'penalty_active': r['penalty_active'],
+                                                 'occupied_since': occupied_since})
                 })
             except Exception as e:
                 print(f"Error parsing row: {e}, row: {r}")
@@ -712,8 +940,13 @@ def api_get_active_reservations_driver():
 
 
 @app.route('/api/reservations/active/owner', methods=['GET'])
+@versioned_by('reservations', refresh_every=CHARGE_REFRESH_SECONDS)
 def api_get_active_reservations_owner():
-    """Devuelve las reservas activas para los parqueaderos del arrendador logueado."""
+    """Devuelve las reservas activas para los parqueaderos del arrendador logueado.
+
+    Como en /api/owner/snapshot, el plazo va como instante absoluto (deadline, UTC) y el
+    cliente calcula si ya venció; el cobro a la fecha (charge) lo calcula el servidor.
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'not authenticated'}), 401
     try:
@@ -721,7 +954,8 @@ def api_get_active_reservations_owner():
         cursor = conn.cursor()
         cursor.execute('''
          SELECT r.id, r.status, r.duration_minutes, r.eta_minutes, r.created_at, r.driver_id,
-             u.name as driver_name, r.parking_id, p.name as parking_name, p.address, p.occupied_since
+             u.name as driver_name, r.parking_id, p.name as parking_name, p.address, p.occupied_since,
+             r.penalty_active
             FROM reservations r
             LEFT JOIN users u ON r.driver_id = u.id
             LEFT JOIN parkings p ON r.parking_id = p.id
@@ -732,42 +966,24 @@ def api_get_active_reservations_owner():
         conn.close()
         out = []
         for r in rows:
-            try:
-                # calcular si la reserva ya expiró (occupied_since + duration <= now)
-                expired = False
-                try:
-                    if r.get('occupied_since') and r.get('duration_minutes'):
-                        import datetime
-                        occ = datetime.datetime.fromisoformat(r['occupied_since'])
-                        now = datetime.datetime.utcnow()
-                        secs = (now - occ).total_seconds()
-                        elapsed_min = int((secs + 59) // 60) if secs > 0 else 0
-                        expired = elapsed_min >= int(r.get('duration_minutes', 0))
-                except Exception:
-                    expired = False
-
-                out.append({
-                    'id': r['id'],
-                    'status': r['status'],
-                    'duration_minutes': r.get('duration_minutes', None) if hasattr(r, 'keys') else (r[2] if len(r) > 2 else None),
-                    'eta': r.get('eta_minutes', None) if hasattr(r, 'keys') else (r[3] if len(r) > 3 else None),
-                    'created_at': r['created_at'] if 'created_at' in r.keys() else (r[4] if len(r) > 4 else None),
-                    'driver_id': r['driver_id'],
-                    'driver_name': r['driver_name'],
-                    'parking_id': r['parking_id'],
-                    'parking_name': r['parking_name'],
-                    'address': r['address'],
-                    'occupied_since': r['occupied_since'] if 'occupied_since' in r.keys() else None,
-                    'expired': expired
-                })
-            except Exception:
-                out.append({
-                    'id': r[0], 'status': r[1], 'duration_minutes': r[2] if len(r) > 2 else None,
-                    'eta': r[3] if len(r) > 3 else None, 'created_at': r[4] if len(r) > 4 else None,
-                    'driver_id': r[5] if len(r) > 5 else None, 'driver_name': r[6] if len(r) > 6 else None,
-                    'parking_id': r[7] if len(r) > 7 else None, 'parking_name': r[8] if len(r) > 8 else None,
-                    'address': r[9] if len(r) > 9 else None
-                })
+            r = dict(r)
+            deadline_type, deadline = _reservation_deadline(r)
+            out.append({
+                'id': r['id'],
+                'status': r['status'],
+                'duration_minutes': r['duration_minutes'],
+                'eta': r['eta_minutes'],
+                'created_at': r['created_at'],
+                'driver_id': r['driver_id'],
+                'driver_name': r['driver_name'],
+                'parking_id': r['parking_id'],
+                'parking_name': r['parking_name'],
+                'address': r['address'],
+                'occupied_since': r['occupied_since'],
+                'deadline_type': deadline_type,
+                'deadline': deadline,
+                'charge': price_reservation(r)
+            })
         return jsonify({'success': True, 'reservations': out})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -819,6 +1035,9 @@ def api_update_user_profile():
         cur.execute('UPDATE users SET name = ?, email = ?, phone = ? WHERE id = ?', (name, email, phone, user_id))
         conn.commit()
         conn.close()
+        # Las reservas vigentes muestran el nombre del conductor y del arrendador
+        bump_resource_versions([user_id], 'reservations')
+        bump_live_reservation_versions(owner_id=user_id)
         # Actualizar datos en la sesión
         session['name'] = name
         session['email'] = email
@@ -850,6 +1069,7 @@ def api_reserve_parking(parking_id):
 
 
 @app.route('/api/reservations/<int:reservation_id>/finish', methods=['POST'])
+@idempotent
 def api_finish_reservation(reservation_id):
     """API para finalizar una reserva."""
     if 'user_id' not in session:
@@ -890,6 +1110,7 @@ def api_finish_reservation(reservation_id):
         # Finalizar la reserva y enviar notificaciones
         success = finish_reservation(reservation_id, session['user_id'])
         if success:
+            end_tracking(reservation_id, 'completed')
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'No se pudo finalizar la reserva'}), 500
@@ -916,13 +1137,38 @@ def api_mark_arrived(reservation_id):
             
         success = mark_driver_arrived(reservation_id)
         if success:
+            location_store.forget_target(session['user_id'])
+            end_tracking(reservation_id, 'active')
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'No se pudo registrar la llegada'}), 500
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/drivers/location', methods=['POST'])
+def api_driver_location():
+    """API del conductor: recibe uno o varios fixes GPS.
+
+    Payload JSON: { fixes: [{lat, lon, ts, accuracy}, ...] } o un único {lat, lon}.
+    Si el conductor entra en la geocerca de su parqueadero reservado, la reserva
+    pasa automáticamente a llegada (igual que /api/reservations/<id>/arrived).
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'not authenticated'}), 401
+    try:
+        fixes = parse_fixes(request.get_json(silent=True) or {})
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Fixes inválidos: {e}'}), 400
+    try:
+        arrived = location_store.ingest(session['user_id'], fixes)
+        if arrived:
+            end_tracking(arrived, 'active')
+        return jsonify({'success': True, 'accepted': len(fixes), 'arrived_reservation_id': arrived})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/reservations/<int:reservation_id>/cancel', methods=['POST'])
+@idempotent
 def api_cancel_reservation(reservation_id):
     """API pública: cancelar una reserva."""
     if 'user_id' not in session:
@@ -933,6 +1179,7 @@ def api_cancel_reservation(reservation_id):
         result = cancel_reservation(reservation_id, user_id)
         if not result:
             return jsonify({'success': False, 'error': 'No se pudo cancelar la reserva.'}), 500
+        end_tracking(reservation_id, 'cancelled')
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -947,6 +1194,7 @@ def request_extra_time(reservation_id):
         extra_minutes = data.get('extra_minutes', 0)
         if extra_minutes not in [10, 20, 30]:
             return jsonify({'success': False, 'error': 'Minutos inválidos'}), 400
+        extra_minutes = int(extra_minutes)  # 10.0 -> 10 (el payload de la notificación es int)
         
         # Obtener la reserva
         conn = get_connection()
@@ -1043,6 +1291,9 @@ def approve_extra_time(reservation_id):
     try:
         data = request.get_json() or {}
         extra_minutes = data.get('extra_minutes', 0)
+        if extra_minutes not in [10, 20, 30]:
+            return jsonify({'success': False, 'error': 'Minutos inválidos'}), 400
+        extra_minutes = int(extra_minutes)
         notification_id = data.get('notification_id', 0)
         
         conn = get_connection()
@@ -1073,6 +1324,9 @@ def approve_extra_time(reservation_id):
         # Hacer commit y cerrar ANTES de las operaciones de notificación
         conn.commit()
         conn.close()
+        bump_resource_versions([driver_id, owner_id], 'reservations')
+        # El fin del tiempo (y la multa, si aplica) se corre con la nueva duración
+        refresh_deadlines(reservation_id)
         
         # Eliminar notificación de solicitud de tiempo extra del arrendador
         from models import delete_notifications_for_reservation
@@ -1095,17 +1349,14 @@ def approve_extra_time(reservation_id):
             park_row = cur2.fetchone()
             parking_name = park_row[0] if park_row else 'el parqueadero'
             
+            conn2.close()
+
             # Actualizar el extra_data de la notificación vehicle_parked
-            import json
-            new_extra_data = json.dumps({
+            update_notification_extra_data(reservation_id, driver_id, 'vehicle_parked', {
                 'parking_name': parking_name,
                 'duration_minutes': new_duration,
                 'occupied_since': occupied_since
             })
-            cur2.execute('UPDATE notifications SET extra_data = ? WHERE reservation_id = ? AND user_id = ? AND type = ?', 
-                        (new_extra_data, reservation_id, driver_id, 'vehicle_parked'))
-            conn2.commit()
-            conn2.close()
         except Exception as e:
             print(f"Error actualizando notificación vehicle_parked: {e}")
         
@@ -1159,6 +1410,8 @@ def reject_extra_time(reservation_id):
         # Hacer commit y cerrar ANTES de las operaciones de notificación
         conn.commit()
         conn.close()
+        # La multa se calcula al leer (utils/pricing.py); sólo cambia penalty_active
+        bump_resource_versions([driver_id, owner_id], 'reservations')
         
         # Eliminar notificación de solicitud de tiempo extra del arrendador
         from models import delete_notifications_for_reservation
@@ -1221,6 +1474,28 @@ def clear_vehicle_parked(reservation_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/reservations/<int:reservation_id>/hold', methods=['POST'])
+def api_hold_reservation(reservation_id):
+    """Arrendador sigue esperando a un conductor atrasado: corre la liberación automática
+    de la reserva pendiente. Payload: { minutes } (1 a MAX_HOLD_MINUTES, por defecto 15)."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'not authenticated'}), 401
+    data = request.get_json(silent=True) or {}
+    try:
+        minutes = int(data.get('minutes', 15))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Minutos inválidos'}), 400
+    if not 1 <= minutes <= MAX_HOLD_MINUTES:
+        return jsonify({'success': False, 'error': f'Los minutos deben estar entre 1 y {MAX_HOLD_MINUTES}'}), 400
+    try:
+        release_at = hold_reservation(reservation_id, session['user_id'], minutes)
+        if release_at is None:
+            return jsonify({'success': False, 'error': 'La reserva no está pendiente en tus parqueaderos'}), 400
+        return jsonify({'success': True,
+                        'release_at': datetime.fromtimestamp(release_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/reservations/<int:reservation_id>/vehicle-not-arrived', methods=['POST'])
 def vehicle_not_arrived(reservation_id):
     """Arrendador indica que el conductor no ha llegado - el tiempo sigue corriendo."""
@@ -1244,6 +1519,7 @@ def vehicle_not_arrived(reservation_id):
                     ('read', reservation_id, 'at_vehicle'))
         conn.commit()
         conn.close()
+        bump_resource_versions([session['user_id']], 'notifications', 'notification_state')
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1272,32 +1548,96 @@ def get_reservation_details(reservation_id):
         # Agregar occupied_since a la respuesta
         if parking and len(parking) > 1:
             reservation['occupied_since'] = parking[1]
+
+        # Cobro a la fecha (o el guardado al finalizar)
+        charge = price_reservation(reservation)
+        reservation['penalty_amount'] = charge['penalty_amount']
         
         return jsonify({
             'success': True,
             'reservation': reservation,
-            'penalty_amount': reservation.get('penalty_amount', 0) or 0,
+            'charge': charge,
+            'penalty_amount': charge['penalty_amount'],
             'penalty_active': reservation.get('penalty_active', 0) or 0
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Máximo de notificaciones por página (parámetro limit de /api/notifications)
+NOTIFICATIONS_MAX_LIMIT = 200
+
+
 @app.route('/api/notifications')
+@versioned_by('notifications')
 def get_notifications():
-    """API para obtener las notificaciones del usuario."""
+    """API para obtener las notificaciones del usuario (de la más nueva a la más vieja).
+
+    Parámetros opcionales: since_id (sólo nuevas), before_id + limit (historial por
+    páginas), type (uno o varios tipos, repetido o separado por comas) y digest_id
+    (detalle de una entrada 'digest': las notificaciones que agrupa).
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'not authenticated'}), 401
         
     try:
-        notifications = get_notifications_by_user(session['user_id'])
-        return jsonify({
-            'success': True,
-            'notifications': notifications
-        })
+        since_id = request.args.get('since_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            limit = max(1, min(limit, NOTIFICATIONS_MAX_LIMIT))
+        types = [t for value in request.args.getlist('type') for t in value.split(',') if t]
+        digest_id = request.args.get('digest_id', type=int)
+        # Objetos ya serializados al escribir cada notificación: sólo se concatenan
+        notifications = get_notifications_json_by_user(session['user_id'], since_id=since_id,
+                                                       before_id=before_id, limit=limit, types=types or None,
+                                                       digest_id=digest_id)
+        # cursor: id más nuevo que el cliente conoce tras esta respuesta (próximo since_id);
+        # las páginas del historial (before_id) y el detalle de un digest no lo mueven
+        cursor = None
+        if before_id is None and digest_id is None:
+            cursor = max([since_id or 0] + [n[0] for n in notifications[:1]])
+        body = splice_json(
+            'notifications', [n[1] for n in notifications],
+            success=True,
+            cursor=cursor,
+            has_more=limit is not None and len(notifications) == limit,
+            # Cambia cuando notificaciones ya entregadas se modifican o eliminan: el
+            # cliente que sincroniza con since_id debe recargar la lista completa
+            state_version=get_resource_version(session['user_id'], 'notification_state'),
+        )
+        return app.response_class(body, mimetype='application/json')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/notifications/wait')
+def wait_notifications():
+    """Long-poll: responde en cuanto el usuario tiene notificaciones con id > since_id, o
+    con una lista vacía al cumplirse `timeout` segundos (máx. LONG_POLL_MAX_TIMEOUT).
+    Pensado como respaldo cuando el WebSocket no está disponible; con gunicorn requiere el
+    worker gevent de gunicorn.conf.py (con workers sync cada espera ocupa un worker)."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'not authenticated'}), 401
+    since_id = request.args.get('since_id', type=int)
+    if since_id is None:
+        return jsonify({'success': False, 'error': 'since_id es requerido'}), 400
+    timeout = request.args.get('timeout', default=LONG_POLL_MAX_TIMEOUT, type=float)
+    timeout = max(0.0, min(timeout, LONG_POLL_MAX_TIMEOUT))
+    user_id = session['user_id']
+    try:
+        notifications = notification_waiters.wait(
+            user_id, timeout, lambda: get_notifications_json_by_user(user_id, since_id=since_id))
+        if notifications is None:
+            response = jsonify({'success': False, 'error': 'Demasiadas conexiones en espera'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        body = splice_json('notifications', [n[1] for n in notifications], success=True,
+                           cursor=max([since_id] + [n[0] for n in notifications[:1]]))
+        return app.response_class(body, mimetype='application/json')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+
 @app.route('/api/notifications/mark-read', methods=['POST'])
 def mark_notifications_read():
     """API para marcar todas las notificaciones como leídas."""
@@ -1305,12 +1645,8 @@ def mark_notifications_read():
         return jsonify({'success': False, 'error': 'not authenticated'}), 401
         
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE notifications SET status = 'read' WHERE user_id = ? AND status = 'unread'",
-                      (session['user_id'],))
-        conn.commit()
-        conn.close()
+        mark_all_notifications_read(session['user_id'])
+        bump_resource_versions([session['user_id']], 'notifications', 'notification_state')
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -1323,16 +1659,10 @@ def clear_notifications():
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'not authenticated'}), 401
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        # Contar las notificaciones que se eliminarán (AHORA: todas las del usuario)
-        cursor.execute('SELECT COUNT(*) FROM notifications WHERE user_id = ?', (session['user_id'],))
-        to_delete = cursor.fetchone()[0]
-        # Eliminar todas las notificaciones del usuario (borrado permanente)
-        cursor.execute('DELETE FROM notifications WHERE user_id = ?', (session['user_id'],))
-        conn.commit()
-        conn.close()
-        return jsonify({'success': True, 'deleted': to_delete})
+        # Ocultar todas las notificaciones del usuario; el borrado físico se hace en segundo plano
+        clear_all_notifications(session['user_id'])
+        bump_resource_versions([session['user_id']], 'notifications', 'notification_state')
+        return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -1354,21 +1684,20 @@ def api_get_nearby_parkings():
         return jsonify({'success': False, 'error': 'Latitud y longitud deben ser números.'}), 400
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        # Buscar parqueaderos en un radio alrededor de la ubicación dada
-        cursor.execute('''
-            SELECT id, name, address, latitude, longitude, owner_id
-            FROM parkings
-            WHERE active = 1 AND latitude IS NOT NULL AND longitude IS NOT NULL
-            AND (6371000 * acos(
-                cos(radians(?)) * cos(radians(latitude)) *
-                cos(radians(longitude) - radians(?)) +
-                sin(radians(?)) * sin(radians(latitude))
-            )) <= ?
-        ''', (lat, lon, lat, radius))
-        parkings = cursor.fetchall()
-        conn.close()
+        # Prefiltro por radio sobre el snapshot compartido de coordenadas y ranking
+        # distancia/ETA sólo de los candidatos
+        snapshot = get_parking_snapshot()
+        positions, _dist = snapshot.nearby(lat, lon, radius)
+        details = get_parkings_by_ids([int(i) for i in snapshot.ids[positions]])
+        rows = {pid: p for pid, p in details.items() if p['active']}
+        ranked = rank_parkings([{'lat': lat, 'lon': lon}], list(rows.values()), k=len(rows) or 1,
+                               max_distance_m=radius)
+        parkings = []
+        for item in ranked[0]['parkings']:
+            p = rows[item['id']]
+            p['distance_m'] = item['distance_m']
+            p['eta_minutes'] = item['eta_minutes']
+            parkings.append(p)
         return jsonify([{
             'id': p['id'],
             'name': p['name'],
@@ -1376,12 +1705,115 @@ def api_get_nearby_parkings():
             'latitude': p['latitude'],
             'longitude': p['longitude'],
             'owner_id': p['owner_id'],
+            'distance_m': p['distance_m'],
+            'eta_minutes': p['eta_minutes'],
             'status': 'Libre'  # Asignar estado por defecto
         } for p in parkings])
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# Máximo de conductores aceptados en una sola petición de ranking
+RANK_MAX_DRIVERS = 1000
+
+
+@app.route('/api/parkings/rank', methods=['POST'])
+def api_rank_parkings():
+    """API pública: ranking por ETA de parqueaderos activos para un lote de conductores.
+
+    Payload JSON: { drivers: [{id, lat, lon}, ...], k: 5, max_distance_m: opcional }
+    """
+    data = request.get_json(silent=True) or {}
+    drivers = data.get('drivers')
+    if not isinstance(drivers, list) or not drivers:
+        return jsonify({'success': False, 'error': 'Se requiere una lista de conductores.'}), 400
+    if len(drivers) > RANK_MAX_DRIVERS:
+        return jsonify({'success': False, 'error': f'Máximo {RANK_MAX_DRIVERS} conductores por petición.'}), 400
+    try:
+        drivers = [{'id': d.get('id'), 'lat': float(d['lat']), 'lon': float(d['lon'])} for d in drivers]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Cada conductor debe tener lat y lon numéricos.'}), 400
+    try:
+        k = max(1, min(int(data.get('k', 5)), 50))
+        max_distance_m = data.get('max_distance_m')
+        max_distance_m = float(max_distance_m) if max_distance_m is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'k y max_distance_m deben ser números.'}), 400
+
+    try:
+        parkings = get_active_parkings()
+        ranked = rank_parkings(drivers, parkings, k=k, max_distance_m=max_distance_m)
+        return jsonify({'success': True, 'results': ranked})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# Límites del endpoint de corredor
+CORRIDOR_MAX_POINTS = 2000
+CORRIDOR_MAX_WIDTH_M = 5000
+
+
+@app.route('/api/parkings/corridor', methods=['POST'])
+def api_corridor_parkings():
+    """API pública: parqueaderos activos a lo largo de una ruta.
+
+    Payload JSON: { polyline: "<polilínea codificada>" o points: [[lat, lon], ...],
+    width_m: 300, limit: 100 }. Los resultados se ordenan por avance sobre la ruta.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('polyline'):
+            route = decode_polyline(str(data['polyline']), precision=int(data.get('precision', 5)))
+        else:
+            route = [(float(p[0]), float(p[1])) for p in (data.get('points') or [])]
+    except (IndexError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'Ruta inválida.'}), 400
+    if not route:
+        return jsonify({'success': False, 'error': 'Se requiere polyline o points.'}), 400
+    if len(route) > CORRIDOR_MAX_POINTS:
+        return jsonify({'success': False, 'error': f'Máximo {CORRIDOR_MAX_POINTS} puntos por ruta.'}), 400
+    try:
+        width_m = float(data.get('width_m', 300))
+        limit = max(1, min(int(data.get('limit', 100)), 500))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'width_m y limit deben ser números.'}), 400
+    if width_m <= 0 or width_m > CORRIDOR_MAX_WIDTH_M:
+        return jsonify({'success': False, 'error': f'width_m debe estar entre 0 y {CORRIDOR_MAX_WIDTH_M}.'}), 400
+
+    try:
+        index = get_parking_snapshot().index
+        positions, dist, along = corridor_search(index, route, width_m)
+        all_ids = [int(i) for i in index.ids[positions]]
+        result = []
+        # Filtrar antes de recortar: el snapshot puede tener hasta SNAPSHOT_MAX_AGE segundos
+        # y traer parqueaderos ya ocupados; se consultan por bloques hasta llenar limit.
+        for start in range(0, len(all_ids), limit):
+            ids = all_ids[start:start + limit]
+            details = get_parkings_by_ids(ids)
+            for pid, d, a in zip(ids, dist[start:start + limit], along[start:start + limit]):
+                p = details.get(pid)
+                if not p or not p['active']:
+                    continue
+                result.append({
+                    'id': p['id'],
+                    'name': p['name'],
+                    'address': p['address'],
+                    'latitude': p['latitude'],
+                    'longitude': p['longitude'],
+                    'owner_id': p['owner_id'],
+                    'distance_m': int(round(float(d))),
+                    'along_route_m': int(round(float(a))),
+                    'status': 'Libre'
+                })
+                if len(result) == limit:
+                    break
+            if len(result) == limit:
+                break
+        return jsonify({'success': True, 'parkings': result})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # === Rutas para pruebas y depuración ===
 @app.route('/debug/killall')
 def debug_kill_all():
@@ -1451,6 +1883,7 @@ def debug_populate():
 
 # API para obtener los parqueaderos del arrendador (dashboard)
 @app.route('/api/owner/parkings', methods=['GET'])
+@versioned_by('parkings')
 def api_owner_parkings():
     if 'user_id' not in session:
         return jsonify({'success': False, 'error': 'not authenticated'}), 401
@@ -1461,6 +1894,159 @@ def api_owner_parkings():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _parse_utc(value):
+    """Timestamp de la DB (CURRENT_TIMESTAMP o ISO con zona) como datetime UTC, o None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _reservation_deadline(reservation):
+    """Plazo vigente de la reserva: llegada (created_at + eta) mientras está pendiente, o
+    fin del tiempo reservado (occupied_since + duración) una vez guardado el vehículo."""
+    if reservation['status'] == 'pending':
+        start, minutes, kind = reservation['created_at'], reservation['eta_minutes'], 'arrival'
+    else:
+        start, minutes, kind = reservation['occupied_since'], reservation['duration_minutes'], 'end'
+    start = _parse_utc(start)
+    if start is None or minutes is None:
+        return None, None
+    deadline = start + timedelta(minutes=int(minutes))
+    return kind, deadline.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _reservation_release_at(reservation):
+    """Instante (UTC) en que se libera automáticamente una reserva pendiente si el
+    conductor no llega (utils/no_show.py), o None."""
+    if reservation['status'] != 'pending':
+        return None
+    release_at = no_show_policy.release_at(timestamp_seconds(reservation['created_at']), reservation['eta_minutes'],
+                                           timestamp_seconds(reservation['hold_until']))
+    if release_at is None:
+        return None
+    return datetime.fromtimestamp(release_at, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+@app.route('/api/owner/snapshot', methods=['GET'])
+@versioned_by('parkings', 'reservations', 'notifications', 'notification_state',
+              refresh_every=CHARGE_REFRESH_SECONDS)
+def api_owner_snapshot():
+    """Estado completo del dashboard del arrendador en una respuesta: parqueaderos,
+    reservas vigentes con su plazo y su cobro, notificaciones sin leer y contadores.
+
+    Los plazos van como instantes absolutos (UTC) y el cliente calcula el tiempo restante.
+    El cobro a la fecha (charge) avanza con el tiempo: el ETag cambia además cada
+    CHARGE_REFRESH_SECONDS para que el dashboard no muestre un monto viejo.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'error': 'not authenticated'}), 401
+    try:
+        owner_id = session['user_id']
+        parkings = get_parkings_by_owner(owner_id)
+        reservations = get_owner_active_reservations(owner_id)
+        for reservation in reservations:
+            reservation['deadline_type'], reservation['deadline'] = _reservation_deadline(reservation)
+            reservation['release_at'] = _reservation_release_at(reservation)
+            reservation['charge'] = price_reservation(reservation)
+        unread = get_notifications_json_by_user(owner_id, limit=NOTIFICATIONS_MAX_LIMIT, unread_only=True)
+        counters = {
+            'parkings': len(parkings),
+            'parkings_free': sum(1 for p in parkings if p['active']),
+            'parkings_occupied': sum(1 for p in parkings if p['occupied_since']),
+            'reservations_pending': sum(1 for r in reservations if r['status'] == 'pending'),
+            'reservations_in_progress': sum(1 for r in reservations if r['status'] != 'pending'),
+            # Tope NOTIFICATIONS_MAX_LIMIT
+            'unread_notifications': len(unread),
+        }
+        body = splice_json(
+            'notifications', [n[1] for n in unread],
+            success=True,
+            parkings=parkings,
+            reservations=reservations,
+            counters=counters,
+            # El cliente sincroniza su buzón si hay una notificación más nueva que su cursor
+            # o si cambió state_version (ver /api/notifications)
+            latest_notification_id=unread[0][0] if unread else None,
+            notifications_state_version=get_resource_version(owner_id, 'notification_state'),
+        )
+        return app.response_class(body, mimetype='application/json')
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/scheduler/metrics', methods=['GET'])
+def api_scheduler_metrics():
+    """Métricas del scheduler (duración de corridas, filas examinadas/procesadas, lag de
+    los plazos, errores y último traceback) tal como las publicó el líder en su lease: sirve
+    desde cualquier worker aunque el líder sea otro proceso. Requiere sesión con rol admin o
+    el header Authorization: Bearer $TINCAR_METRICS_TOKEN."""
+    token = os.environ.get('TINCAR_METRICS_TOKEN')
+    if session.get('role') != 'admin' and not (token and request.headers.get('Authorization') == f'Bearer {token}'):
+        return jsonify({'success': False, 'error': 'No autorizado'}), 403
+    try:
+        lease = get_lease(LEASE_NAME)
+        if lease is None:
+            return jsonify({'success': True, 'leader': None, 'metrics': None})
+        now = _time.time()
+        return jsonify({
+            'success': True,
+            'leader': lease['holder'] if lease['expires_at'] > now else None,
+            'token': lease['token'],
+            'heartbeat_age_s': round(now - lease['heartbeat_at'], 1),
+            'lease_expires_in_s': round(lease['expires_at'] - now, 1),
+            'metrics': json.loads(lease['metrics']) if lease.get('metrics') else None,
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# === Eventos SocketIO ===
+@socketio.on('connect')
+def socket_connect(auth=None):
+    """Sólo se aceptan conexiones de usuarios con sesión iniciada; cada conexión se une
+    a la sala privada de su usuario para recibir 'notification', 'reservation_updated'
+    y 'parking_updated'."""
+    if 'user_id' not in session:
+        return False
+    join_room(user_room(session['user_id']))
+
+
+@socketio.on('disconnect')
+def socket_disconnect_handler(*args):
+    tracking_hub.disconnect(request.sid)
+
+
+@socketio.on('track_reservation')
+def socket_track_reservation(data):
+    """El arrendador empieza a seguir al conductor de una reserva pendiente.
+    Payload: { reservation_id }. Los eventos llegan como 'driver_position' y
+    'tracking_ended'; el cliente debe confirmar (ack) cada uno."""
+    if 'user_id' not in session:
+        socket_disconnect()
+        return {'success': False, 'error': 'not authenticated'}
+    try:
+        reservation_id = int((data or {}).get('reservation_id'))
+    except (TypeError, ValueError):
+        return {'success': False, 'error': 'reservation_id inválido'}
+    ok, error = tracking_hub.subscribe(request.sid, reservation_id, session['user_id'])
+    return {'success': ok, 'error': error}
+
+
+@socketio.on('untrack_reservation')
+def socket_untrack_reservation(data):
+    try:
+        tracking_hub.unsubscribe(request.sid, int((data or {}).get('reservation_id')))
+    except (TypeError, ValueError):
+        pass
+    return {'success': True}
+
+
 if __name__ == '__main__':
     # ============================================================
     # APIS REST PARA PERFIL DEL CONDUCTOR
@@ -1539,14 +2125,14 @@ if __name__ == '__main__':
                 if document_verified == 'verificado' or license_verified == 'verificado':
                     add_notification(
                         user_id,
-                        'verification_approved',
-                        'Tus documentos han sido verificados correctamente'
+                        message='Tus documentos han sido verificados correctamente',
+                        type='verification_approved'
                     )
                 elif document_verified == 'rechazado' or license_verified == 'rechazado':
                     add_notification(
                         user_id,
-                        'verification_rejected',
-                        'Algunos documentos fueron rechazados. Por favor revisa tu perfil.'
+                        message='Algunos documentos fueron rechazados. Por favor revisa tu perfil.',
+                        type='verification_rejected'
                     )
                 
                 return jsonify({'message': 'Estado de verificación actualizado'}), 200
@@ -1737,24 +2323,9 @@ if __name__ == '__main__':
     # ============================================================
 
     # Crear tablas necesarias al iniciar
-    from models import create_notifications_table
-    create_users_table()
-    create_parkings_table()
-    create_reservations_table()
-    create_reviews_table()
-    create_notifications_table()
-    # Start background thread to check for expired reservations
-    def _expiration_worker():
-        from models import notify_expired_reservations
-        while True:
-            try:
-                notify_expired_reservations()
-            except Exception:
-                pass
-            _time.sleep(30)
-
-    t = threading.Thread(target=_expiration_worker, daemon=True)
-    t.start()
+    from models import create_all_tables
+    create_all_tables()
+    start_background_services()
 
     # Start SocketIO server; bind to 0.0.0.0 so it's reachable from host
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,23 @@
+# Configuración que gunicorn carga por defecto desde el directorio de trabajo (ver Dockerfile).
+
+# Worker cooperativo: cada long-poll de /api/notifications/wait y cada conexión SocketIO
+# es una green thread, no un worker bloqueado. gevent hace el monkey-patching de
+# threading/time/socket al arrancar el worker.
+worker_class = 'gevent'
+worker_connections = 1000
+# Muy por encima de utils.long_poll.MAX_TIMEOUT, para no matar workers a mitad de una espera.
+timeout = 60
+
+
+def on_starting(server):
+    # Tablas y migraciones una sola vez, en el proceso maestro antes de crear los workers
+    from models import create_all_tables
+    create_all_tables()
+
+
+def post_worker_init(worker):
+    # Cada worker se postula como líder del scheduler; sólo uno corre los plazos y la
+    # retención y otro lo reemplaza si muere (ver scheduler.SchedulerService). También se
+    # puede correr aparte con `python -m scheduler`.
+    from app import start_background_services
+    start_background_services()
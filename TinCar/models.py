@@ -1,12 +1,60 @@
 import os
 import sqlite3
 import json
+import time
+import uuid
+from datetime import datetime
+
+from utils import clock
+from utils.pricing import timestamp_seconds, price_reservation
+from utils.no_show import no_show_policy
+from utils.notification_payloads import (
+    DIGEST_WINDOW_SECONDS,
+    sanitize_payload,
+    encode_payload,
+    render_fragment,
+    notification_json,
+    digest_message,
+)
 
 # Usar una ruta absoluta al archivo de base de datos dentro del paquete `TinCar`
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, 'database', 'tincar.db')
 
 
+# Oyentes de cambios (app.py los reenvía por SocketIO a los usuarios afectados).
+# Se llaman después del commit con (evento, ids de usuario, payload).
+_change_listeners = []
+
+
+def add_change_listener(fn):
+    """Registra fn(event, user_ids, payload) para los cambios publicados con publish_change."""
+    _change_listeners.append(fn)
+
+
+# Recurso cuya versión (ETag) cambia con cada evento publicado.
+_EVENT_RESOURCES = {
+    'notification': 'notifications',
+    'reservation_updated': 'reservations',
+    'parking_updated': 'parkings',
+}
+
+
+def publish_change(event, user_ids, payload):
+    """Avisa a los oyentes que algo cambió para los usuarios dados. Los errores se
+    registran y no interrumpen la escritura que ya se hizo."""
+    user_ids = sorted({u for u in user_ids if u})
+    if not user_ids:
+        return
+    if event in _EVENT_RESOURCES:
+        bump_resource_versions(user_ids, _EVENT_RESOURCES[event])
+    for fn in list(_change_listeners):
+        try:
+            fn(event, user_ids, payload)
+        except Exception as e:
+            print(f"[models] error publicando cambio {event}: {e}")
+
+
 def ensure_db_dir():
     """Asegura que el directorio para la DB exista."""
     db_dir = os.path.dirname(DB_PATH)
@@ -139,6 +187,8 @@ def create_parkings_table():
             cursor.execute("ALTER TABLE parkings ADD COLUMN occupied_since TEXT")
         except Exception:
             pass
+    # Parqueaderos de un arrendador (dashboard y /api/owner/snapshot)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_parkings_owner ON parkings (owner_id)')
     conn.commit()
     conn.close()
 
@@ -153,6 +203,7 @@ def add_parking(owner_id, name, phone=None, email=None, address=None, department
     ''', (owner_id, name, phone, email, address, department, city, housing_type, size, features, image_path, latitude, longitude, active))
     conn.commit()
     last_id = cursor.lastrowid
+    publish_change('parking_updated', [owner_id], {'parking_id': last_id})
     # Recuperar el registro insertado y devolverlo como dict
     cursor.execute('SELECT id, owner_id, name, phone, email, address, department, city, housing_type, size, features, image_path, active, created_at FROM parkings WHERE id = ?', (last_id,))
     row = cursor.fetchone()
@@ -193,6 +244,32 @@ def get_parkings_by_owner(owner_id):
     return parkings
 
 
+def get_owner_active_reservations(owner_id):
+    """Reservas vigentes (pending/arrived/active) en los parqueaderos del arrendador, con
+    los datos del parqueadero y del conductor que el dashboard necesita."""
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT r.id, r.status, r.duration_minutes, r.eta_minutes, r.created_at, r.penalty_active,
+               r.driver_id, u.name, u.phone, u.email, r.parking_id, p.name, p.address, p.occupied_since,
+               r.hold_until
+        FROM parkings p
+        CROSS JOIN reservations r ON r.parking_id = p.id
+        LEFT JOIN users u ON u.id = r.driver_id
+        WHERE p.owner_id = ? AND r.status IN ('pending', 'arrived', 'active')
+        ORDER BY r.created_at DESC
+    ''', (owner_id,)).fetchall()
+    conn.close()
+    return [
+        {
+            'id': r[0], 'status': r[1], 'duration_minutes': r[2], 'eta_minutes': r[3], 'created_at': r[4],
+            'penalty_active': r[5] or 0, 'driver_id': r[6], 'driver_name': r[7], 'driver_phone': r[8],
+            'driver_email': r[9], 'parking_id': r[10], 'parking_name': r[11], 'address': r[12],
+            'occupied_since': r[13], 'hold_until': r[14]
+        }
+        for r in rows
+    ]
+
+
 def get_parking(parking_id):
     conn = get_connection()
     cursor = conn.cursor()
@@ -222,16 +299,29 @@ def update_parking(parking_id, **fields):
     cursor = conn.cursor()
     cursor.execute(f'UPDATE parkings SET {set_clause} WHERE id = ?', params)
     conn.commit()
+    cursor.execute('SELECT owner_id FROM parkings WHERE id = ?', (parking_id,))
+    row = cursor.fetchone()
+    owner_id = row[0] if row else None
     conn.close()
+    if any(k in keys for k in ('active', 'occupied_since', 'latitude', 'longitude')):
+        publish_change('parking_updated', [owner_id], {'parking_id': parking_id})
+    else:
+        bump_resource_versions([owner_id], 'parkings')
+    bump_live_reservation_versions(parking_id=parking_id)
     return True
 
 
 def delete_parking(parking_id):
     conn = get_connection()
     cursor = conn.cursor()
+    cursor.execute('SELECT owner_id FROM parkings WHERE id = ?', (parking_id,))
+    row = cursor.fetchone()
+    bump_live_reservation_versions(parking_id=parking_id)
     cursor.execute('DELETE FROM parkings WHERE id = ?', (parking_id,))
     conn.commit()
     conn.close()
+    if row:
+        publish_change('parking_updated', [row[0]], {'parking_id': parking_id})
     return True
 
 def add_user(name, email, password, phone, role):
@@ -297,6 +387,23 @@ def create_reservations_table():
             cursor.execute('ALTER TABLE reservations ADD COLUMN penalty_amount INTEGER DEFAULT 0')
         except Exception:
             pass
+    # Cobro final, guardado una sola vez al finalizar (utils/pricing.py)
+    for column in ('elapsed_minutes', 'total_amount'):
+        if column not in existing:
+            try:
+                cursor.execute(f'ALTER TABLE reservations ADD COLUMN {column} INTEGER')
+            except Exception:
+                pass
+    # Liberación de reservas sin llegada (utils/no_show.py): prórroga del arrendador y
+    # motivo de la cancelación automática
+    for column, column_type in (('hold_until', 'TIMESTAMP'), ('cancel_reason', 'TEXT')):
+        if column not in existing:
+            try:
+                cursor.execute(f'ALTER TABLE reservations ADD COLUMN {column} {column_type}')
+            except Exception:
+                pass
+    # Reservas vigentes por parqueadero (reservas activas del arrendador)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reservations_parking_status ON reservations (parking_id, status)')
     conn.commit()
     conn.close()
 
@@ -339,10 +446,400 @@ def create_notifications_table():
             FOREIGN KEY(owner_id) REFERENCES users(id)
         )
     ''')
+    # Paginación por cursor (since_id / before_id) sobre las notificaciones de un usuario
+    # Notificación ya serializada (utils/notification_payloads.render_fragment) para
+    # responder /api/notifications sin volver a codificar cada fila
+    cursor.execute("PRAGMA table_info(notifications)")
+    cols = [r[1] for r in cursor.fetchall()]
+    if 'payload_json' not in cols:
+        cursor.execute('ALTER TABLE notifications ADD COLUMN payload_json TEXT')
+    # Entrada 'digest' que agrupa a esta notificación (oculta del buzón, visible al desplegar)
+    if 'digest_id' not in cols:
+        cursor.execute('ALTER TABLE notifications ADD COLUMN digest_id INTEGER')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications (user_id, id)')
+    # Retención (utils/notification_retention.py): reemplazo por reserva y TTL por tipo
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_notifications_reservation_type
+                      ON notifications (reservation_id, type, user_id, id)''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_type_created ON notifications (type, created_at)')
+    # Marcas por usuario: ids <= read_through_id se consideran leídas y ids <= cleared_through_id
+    # ocultas (se borran físicamente después con purge_cleared_notifications)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_watermarks (
+            user_id INTEGER PRIMARY KEY,
+            read_through_id INTEGER NOT NULL DEFAULT 0,
+            cleared_through_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Grupo abierto por (usuario, tipo) para el agrupado en escritura: ventana actual, primera
+    # notificación del grupo y la entrada visible que lo representa en el buzón
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_digests (
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            window_start TEXT NOT NULL,
+            first_id INTEGER NOT NULL,
+            visible_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            reservation_ids TEXT NOT NULL,
+            PRIMARY KEY (user_id, type)
+        )
+    ''')
+    # Outbox de entregas fuera de la app (email/SMS/push): se escribe en la misma transacción
+    # que la notificación y lo consume utils/outbox.py. Tiempos en epoch (segundos).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            notification_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_until REAL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            latency_ms REAL,
+            last_error TEXT
+        )
+    ''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_notification_outbox_due
+                      ON notification_outbox (status, next_attempt_at)''')
+    conn.commit()
+    conn.close()
+
+
+def create_driver_locations_table():
+    """Última posición conocida de cada conductor (una fila por conductor)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS driver_locations (
+            driver_id INTEGER PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            accuracy REAL,
+            recorded_at REAL NOT NULL,
+            FOREIGN KEY(driver_id) REFERENCES users(id)
+        )
+    ''')
     conn.commit()
     conn.close()
 
 
+def create_resource_versions_table():
+    """Contador de versión por usuario y recurso ('notifications', 'reservations',
+    'parkings'); se incrementa en cada escritura relevante y se usa como ETag.
+    'notification_state' sólo cambia cuando notificaciones ya entregadas se modifican
+    o eliminan: indica a la sincronización incremental que debe recargar todo."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resource_versions (
+            user_id INTEGER NOT NULL,
+            resource TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, resource)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+
+def create_leases_table():
+    """Leases con heartbeat para elegir un único proceso líder (p.ej. el scheduler).
+    token es el token de fencing: aumenta cada vez que el lease cambia de dueño."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            token INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            acquired_at REAL NOT NULL,
+            metrics TEXT
+        )
+    ''')
+    # Métricas que publica el dueño del lease (JSON), para leerlas desde cualquier worker
+    cursor.execute("PRAGMA table_info(leases)")
+    if 'metrics' not in [c[1] for c in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE leases ADD COLUMN metrics TEXT')
+    conn.commit()
+    conn.close()
+
+
+def create_idempotency_keys_table():
+    """Respuestas guardadas por Idempotency-Key (utils/idempotency.py). Sin rowid: la
+    clave primaria (usuario, clave) es la tabla. status_code NULL = petición en curso, y
+    expires_at es entonces el vencimiento de su lock; claim_token identifica a la petición
+    que la tomó (si su lock vence y otra la toma, la primera ya no puede completarla)."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            request_hash BLOB NOT NULL,
+            status_code INTEGER,
+            response TEXT,
+            expires_at REAL NOT NULL,
+            claim_token TEXT,
+            PRIMARY KEY (user_id, key)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("PRAGMA table_info(idempotency_keys)")
+    if 'claim_token' not in [c[1] for c in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE idempotency_keys ADD COLUMN claim_token TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)')
+    conn.commit()
+    conn.close()
+
+
+def create_all_tables():
+    """Crea las tablas y aplica las migraciones de columnas de todas ellas. Se llama una
+    vez al arrancar: gunicorn (on_starting en gunicorn.conf.py), `python app.py` y
+    `python -m scheduler`."""
+    create_users_table()
+    create_parkings_table()
+    create_reservations_table()
+    create_reviews_table()
+    create_notifications_table()
+    create_driver_locations_table()
+    create_resource_versions_table()
+    create_leases_table()
+    create_idempotency_keys_table()
+
+
+def claim_idempotency_key(user_id, key, request_hash, lock_seconds):
+    """Reserva la clave para ejecutar la petición. Devuelve ('acquired', claim_token) si quedó
+    en curso a nuestro nombre (no existía, venció, o su lock venció porque el worker murió),
+    ('done', (status_code, response)) si ya hay respuesta guardada, ('in_flight', None)
+    si otra petición la está ejecutando y ('mismatch', None) si la clave se usó con otra
+    petición."""
+    now = time.time()
+    conn = get_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('''
+            SELECT request_hash, status_code, response, expires_at FROM idempotency_keys
+            WHERE user_id = ? AND key = ?
+        ''', (user_id, key)).fetchone()
+        if row is None or row['expires_at'] <= now:
+            claim_token = uuid.uuid4().hex
+            conn.execute('''
+                INSERT OR REPLACE INTO idempotency_keys (user_id, key, request_hash, status_code, response, expires_at,
+                                                         claim_token)
+                VALUES (?, ?, ?, NULL, NULL, ?, ?)
+            ''', (user_id, key, request_hash, now + lock_seconds, claim_token))
+            conn.commit()
+            return 'acquired', claim_token
+        conn.rollback()
+        if bytes(row['request_hash']) != request_hash:
+            return 'mismatch', None
+        if row['status_code'] is None:
+            return 'in_flight', None
+        return 'done', (row['status_code'], row['response'])
+    finally:
+        conn.close()
+
+
+def complete_idempotency_key(user_id, key, claim_token, status_code, response, ttl_seconds):
+    """Guarda la respuesta de la petición en curso; los reintentos la reciben hasta que vence.
+    No hace nada si la clave ya la tomó otra petición (claim_token distinto)."""
+    conn = get_connection()
+    try:
+        conn.execute('''
+            UPDATE idempotency_keys SET status_code = ?, response = ?, expires_at = ?
+            WHERE user_id = ? AND key = ? AND status_code IS NULL AND claim_token = ?
+        ''', (status_code, response, time.time() + ttl_seconds, user_id, key, claim_token))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def abort_idempotency_key(user_id, key, claim_token):
+    """Libera la clave de una petición que falló sin respuesta definitiva: el reintento la ejecuta."""
+    conn = get_connection()
+    try:
+        conn.execute('''
+            DELETE FROM idempotency_keys
+            WHERE user_id = ? AND key = ? AND status_code IS NULL AND claim_token = ?
+        ''', (user_id, key, claim_token))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def purge_expired_idempotency_keys(batch_size=500, max_batches=20):
+    """Borra en lotes las claves vencidas; devuelve cuántas."""
+    deleted = 0
+    conn = get_connection()
+    try:
+        for _ in range(max_batches):
+            cursor = conn.execute('''
+                DELETE FROM idempotency_keys WHERE (user_id, key) IN (
+                    SELECT user_id, key FROM idempotency_keys WHERE expires_at <= ? LIMIT ?)
+            ''', (time.time(), batch_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+    finally:
+        conn.close()
+    return deleted
+
+
+def bump_resource_versions(user_ids, *resources):
+    """Incrementa la versión de cada recurso para cada usuario. Debe llamarse después del
+    commit de la escritura, para que una versión nueva nunca acompañe datos viejos."""
+    user_ids = sorted({u for u in user_ids if u})
+    if not user_ids:
+        return
+    try:
+        conn = get_connection()
+        conn.executemany('''
+            INSERT INTO resource_versions (user_id, resource, version) VALUES (?, ?, 1)
+            ON CONFLICT(user_id, resource) DO UPDATE SET version = version + 1
+        ''', [(u, r) for u in user_ids for r in resources])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"[models] error incrementando versión de {', '.join(resources)}: {e}")
+
+
+def bump_live_reservation_versions(parking_id=None, owner_id=None):
+    """Las reservas vigentes (/api/reservations/active/*) muestran datos del parqueadero y
+    del arrendador: al cambiar el parqueadero parking_id, o el perfil del arrendador
+    owner_id, sube la versión 'reservations' de sus conductores y del arrendador."""
+    try:
+        conn = get_connection()
+        rows = conn.execute('''
+            SELECT r.driver_id, p.owner_id FROM reservations r JOIN parkings p ON r.parking_id = p.id
+            WHERE r.status IN ('pending', 'arrived', 'active') AND (p.id = ? OR p.owner_id = ?)
+        ''', (parking_id, owner_id)).fetchall()
+        conn.close()
+    except Exception as e:
+        print(f"[models] error buscando reservas vigentes: {e}")
+        return
+    bump_resource_versions([u for row in rows for u in row], 'reservations')
+
+
+def get_change_watermark():
+    """(suma de las versiones 'reservations', último id de notifications): cambia con cada
+    escritura de reservas y cada notificación nueva, venga del proceso que venga."""
+    conn = get_connection()
+    row = conn.execute('''
+        SELECT (SELECT COALESCE(SUM(version), 0) FROM resource_versions WHERE resource = 'reservations'),
+               (SELECT COALESCE(MAX(id), 0) FROM notifications)
+    ''').fetchone()
+    conn.close()
+    return tuple(row)
+
+
+def get_resource_version(user_id, resource):
+    """Versión actual de `resource` para el usuario (0 si nunca cambió), o None si la
+    tabla no está disponible."""
+    try:
+        conn = get_connection()
+        row = conn.execute('SELECT version FROM resource_versions WHERE user_id = ? AND resource = ?',
+                           (user_id, resource)).fetchone()
+        conn.close()
+    except Exception:
+        return None
+    return row[0] if row else 0
+
+
+def get_resource_versions(user_id, resources):
+    """Como get_resource_version para varios recursos en una consulta: lista de versiones
+    en el orden de `resources`, o None si la tabla no está disponible."""
+    try:
+        conn = get_connection()
+        rows = conn.execute(f'''
+            SELECT resource, version FROM resource_versions
+            WHERE user_id = ? AND resource IN ({','.join('?' for _ in resources)})
+        ''', [user_id] + list(resources)).fetchall()
+        conn.close()
+    except Exception:
+        return None
+    versions = {r[0]: r[1] for r in rows}
+    return [versions.get(resource, 0) for resource in resources]
+
+
+def upsert_driver_locations(rows):
+    """Guarda en lote las posiciones (driver_id, latitude, longitude, accuracy, recorded_at)."""
+    if not rows:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO driver_locations (driver_id, latitude, longitude, accuracy, recorded_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(driver_id) DO UPDATE SET
+            latitude = excluded.latitude,
+            longitude = excluded.longitude,
+            accuracy = excluded.accuracy,
+            recorded_at = excluded.recorded_at
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def get_pending_reservation_target(driver_id):
+    """Reserva 'pending' más reciente del conductor con las coordenadas de su parqueadero.
+    Devuelve {'reservation_id', 'parking_id', 'latitude', 'longitude'} o None."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT r.id, r.parking_id, p.latitude, p.longitude
+        FROM reservations r
+        JOIN parkings p ON r.parking_id = p.id
+        WHERE r.driver_id = ? AND r.status = 'pending'
+        ORDER BY r.created_at DESC, r.id DESC LIMIT 1
+    ''', (driver_id,))
+    r = cursor.fetchone()
+    conn.close()
+    if not r or r[2] is None or r[3] is None:
+        return None
+    return {'reservation_id': r[0], 'parking_id': r[1], 'latitude': float(r[2]), 'longitude': float(r[3])}
+
+
+def get_tracking_target(reservation_id, owner_id):
+    """Datos para seguir en vivo una reserva 'pending' de un parqueadero del arrendador.
+    Devuelve {'driver_id', 'parking_id', 'latitude', 'longitude', 'city'} o None."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT r.driver_id, r.parking_id, p.latitude, p.longitude, p.city
+        FROM reservations r
+        JOIN parkings p ON r.parking_id = p.id
+        WHERE r.id = ? AND p.owner_id = ? AND r.status = 'pending'
+    ''', (reservation_id, owner_id))
+    r = cursor.fetchone()
+    conn.close()
+    if not r or r[2] is None or r[3] is None:
+        return None
+    return {'driver_id': r[0], 'parking_id': r[1], 'latitude': float(r[2]), 'longitude': float(r[3]), 'city': r[4]}
+
+
+def get_reservation_statuses(reservation_ids):
+    """Devuelve un dict reservation_id -> status para los ids dados."""
+    ids = list(reservation_ids)
+    out = {}
+    if not ids:
+        return out
+    conn = get_connection()
+    cursor = conn.cursor()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        cursor.execute(f'SELECT id, status FROM reservations WHERE id IN ({placeholders})', chunk)
+        out.update({r[0]: r[1] for r in cursor.fetchall()})
+    conn.close()
+    return out
+
+
 def add_reservation(driver_id, parking_id, status='pending', duration_minutes=10, eta_minutes=0):
     """Crea una reserva; duration_minutes y eta_minutes son opcionales.
     Devuelve el registro creado."""
@@ -360,15 +857,18 @@ def add_reservation(driver_id, parking_id, status='pending', duration_minutes=10
     parking_name = parking_row[1] if parking_row else "el parqueadero"
     
     # Intentar insertar incluyendo las nuevas columnas (si existen)
+    # created_at explícito (formato CURRENT_TIMESTAMP) según utils/clock.py
+    created_at = clock.db_timestamp()
     try:
-        cursor.execute('INSERT INTO reservations (driver_id, parking_id, status, duration_minutes, eta_minutes) VALUES (?, ?, ?, ?, ?)', 
-                      (driver_id, parking_id, status, duration_minutes, eta_minutes))
+        cursor.execute('INSERT INTO reservations (driver_id, parking_id, status, duration_minutes, eta_minutes, created_at) VALUES (?, ?, ?, ?, ?, ?)', 
+                      (driver_id, parking_id, status, duration_minutes, eta_minutes, created_at))
     except Exception:
         # Si la tabla no tiene las columnas nuevas, caer atrás a la inserción antigua
-        cursor.execute('INSERT INTO reservations (driver_id, parking_id, status) VALUES (?, ?, ?)', 
-                      (driver_id, parking_id, status))
+        cursor.execute('INSERT INTO reservations (driver_id, parking_id, status, created_at) VALUES (?, ?, ?, ?)', 
+                      (driver_id, parking_id, status, created_at))
     conn.commit()
     last_id = cursor.lastrowid
+    publish_change('reservation_updated', [driver_id, owner_id], {'reservation_id': last_id, 'status': status})
 
     try:
         # Notificación para el arrendador ÚNICAMENTE
@@ -429,26 +929,248 @@ def add_reservation(driver_id, parking_id, status='pending', duration_minutes=10
     return out
 
 
+# Canales externos por tipo de notificación (adaptadores en utils/outbox.py).
+OUTBOX_CHANNELS = {
+    'eta_expired': ('email', 'sms'),
+    'reservation_completed': ('email',),
+}
+
+
 def add_notification(user_id, message, type, reservation_id=None, owner_id=None, eta=None, extra_data=None):
+    # extra_data se ajusta al esquema del tipo (utils/notification_payloads.py); los campos
+    # inválidos se descartan: el cambio que origina la notificación ya está guardado
+    extra_data = sanitize_payload(type, extra_data)
+    # Mismo formato que CURRENT_TIMESTAMP, para poder guardarlo también en el fragmento
+    created_at = clock.db_timestamp()
+    fragment = render_fragment(message, type, created_at, reservation_id, owner_id, eta, extra_data)
     conn = get_connection()
     cursor = conn.cursor()
-    # Convertir extra_data a JSON string si es un diccionario
-    if extra_data and isinstance(extra_data, dict):
-        extra_data = json.dumps(extra_data)
+    if type in DIGEST_WINDOW_SECONDS:
+        # Serializar con otros escritores: el grupo se lee y actualiza en la misma transacción
+        cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute('''
+        INSERT INTO notifications (user_id, message, type, reservation_id, owner_id, eta, extra_data,
+                                   created_at, payload_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, message, type, reservation_id, owner_id, eta, encode_payload(extra_data),
+          created_at, fragment))
+    notification_id = cursor.lastrowid
+    if type in OUTBOX_CHANNELS:
+        # Misma transacción: si la notificación existe, su entrega externa también
+        payload = json.dumps({'message': message, 'type': type, 'reservation_id': reservation_id,
+                              'extra_data': extra_data})
+        now = time.time()
+        cursor.executemany('''
+            INSERT INTO notification_outbox (notification_id, user_id, channel, payload, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(notification_id, user_id, channel, payload, now, now) for channel in OUTBOX_CHANNELS[type]])
+    visible_id, visible_type = notification_id, type
+    if type in DIGEST_WINDOW_SECONDS:
+        visible_id = _digest_notification(cursor, user_id, type, notification_id, reservation_id, created_at)
+        if visible_id != notification_id:
+            visible_type = 'digest'
+    conn.commit()
+    conn.close()
+    publish_change('notification', [user_id], {'id': visible_id, 'type': visible_type, 'reservation_id': reservation_id})
+
+
+def _digest_notification(cursor, user_id, type, notification_id, reservation_id, created_at):
+    """Agrupa la notificación recién insertada con las anteriores del mismo tipo dentro de la
+    ventana. Devuelve el id que queda visible en el buzón (la propia notificación o la
+    nueva entrada 'digest').
+
+    Cada actualización del grupo inserta una entrada 'digest' nueva (id mayor, así la ve la
+    sincronización incremental por since_id) y borra la anterior; extra_data.replaces indica
+    al cliente qué id dejar de mostrar."""
+    cursor.execute('''
+        SELECT window_start, first_id, visible_id, count, reservation_ids FROM notification_digests
+        WHERE user_id = ? AND type = ?
+    ''', (user_id, type))
+    state = cursor.fetchone()
+    if state is not None and state[3] == 1 and cursor.execute(
+            'SELECT 1 FROM notifications WHERE id = ?', (state[2],)).fetchone() is None:
+        # La única notificación visible del grupo se borró (sin digest no pasa por
+        # _sync_digests): la nueva abre una ventana en lugar de agrupar con filas borradas
+        state = None
+    window = DIGEST_WINDOW_SECONDS[type]
+    if state is None or (datetime.fromisoformat(created_at) - datetime.fromisoformat(state[0])).total_seconds() > window:
+        # Primera notificación de una ventana nueva: se muestra tal cual
+        cursor.execute('''
+            INSERT INTO notification_digests (user_id, type, window_start, first_id, visible_id, count, reservation_ids)
+            VALUES (?, ?, ?, ?, ?, 1, ?)
+            ON CONFLICT(user_id, type) DO UPDATE SET window_start = excluded.window_start,
+                first_id = excluded.first_id, visible_id = excluded.visible_id, count = 1,
+                reservation_ids = excluded.reservation_ids
+        ''', (user_id, type, created_at, notification_id, notification_id,
+              json.dumps([reservation_id] if reservation_id else [])))
+        return notification_id
+
+    window_start, first_id, previous_id, count = state[0], state[1], state[2], state[3] + 1
+    reservation_ids = json.loads(state[4])
+    if reservation_id and reservation_id not in reservation_ids:
+        reservation_ids.append(reservation_id)
+    message = digest_message(type, count)
+    extra_data = {'digest_type': type, 'count': count, 'reservation_ids': reservation_ids,
+                  'replaces': [previous_id], 'window_start': window_start}
     cursor.execute('''
-        INSERT INTO notifications (user_id, message, type, reservation_id, owner_id, eta, extra_data)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, message, type, reservation_id, owner_id, eta, extra_data))
+        INSERT INTO notifications (user_id, message, type, extra_data, created_at, payload_json)
+        VALUES (?, ?, 'digest', ?, ?, ?)
+    ''', (user_id, message, encode_payload(extra_data), created_at,
+          render_fragment(message, 'digest', created_at, None, None, None, extra_data)))
+    digest_id = cursor.lastrowid
+    # Las notificaciones del grupo quedan ocultas bajo la nueva entrada (detalle con digest_id)
+    cursor.execute('''
+        UPDATE notifications SET digest_id = ?
+        WHERE user_id = ? AND type = ? AND id >= ? AND id <= ?
+    ''', (digest_id, user_id, type, first_id, notification_id))
+    if count > 2:
+        cursor.execute("DELETE FROM notifications WHERE id = ? AND type = 'digest'", (previous_id,))
+    cursor.execute('''
+        UPDATE notification_digests SET visible_id = ?, count = ?, reservation_ids = ?
+        WHERE user_id = ? AND type = ?
+    ''', (digest_id, count, json.dumps(reservation_ids), user_id, type))
+    return digest_id
+
+
+# Digest afectado por el borrado de una fila: el suyo si es 'digest', o el que la agrupa
+_DIGEST_OF_ROW_SQL = "CASE WHEN type = 'digest' THEN id ELSE digest_id END"
+
+
+def _sync_digests(cursor, digest_ids):
+    """Ajusta las entradas 'digest' tras borrar notificaciones agrupadas o el propio digest
+    (misma transacción que el borrado).
+
+    - digest borrado: sus notificaciones vuelven al buzón (digest_id NULL),
+    - queda una sola notificación: vuelve al buzón y se borra el digest,
+    - quedan varias: se reescriben el contador, reservation_ids y el mensaje.
+    El grupo abierto de notification_digests se ajusta igual (o se cierra)."""
+    for digest_id in {d for d in digest_ids if d is not None}:
+        digest = cursor.execute("SELECT extra_data, created_at FROM notifications WHERE id = ? AND type = 'digest'",
+                                (digest_id,)).fetchone()
+        members = cursor.execute('SELECT id, reservation_id FROM notifications WHERE digest_id = ? ORDER BY id',
+                                 (digest_id,)).fetchall()
+        if digest is None or len(members) <= 1:
+            cursor.execute('UPDATE notifications SET digest_id = NULL WHERE digest_id = ?', (digest_id,))
+            cursor.execute("DELETE FROM notifications WHERE id = ? AND type = 'digest'", (digest_id,))
+            if digest is not None and members:
+                cursor.execute('''
+                    UPDATE notification_digests SET visible_id = ?, count = 1, reservation_ids = ?
+                    WHERE visible_id = ?
+                ''', (members[0][0], json.dumps([members[0][1]] if members[0][1] else []), digest_id))
+            else:
+                cursor.execute('DELETE FROM notification_digests WHERE visible_id = ?', (digest_id,))
+            continue
+        extra_data = json.loads(digest[0])
+        reservation_ids = []
+        for _, reservation_id in members:
+            if reservation_id and reservation_id not in reservation_ids:
+                reservation_ids.append(reservation_id)
+        extra_data['count'] = len(members)
+        extra_data['reservation_ids'] = reservation_ids
+        message = digest_message(extra_data['digest_type'], len(members))
+        cursor.execute('UPDATE notifications SET message = ?, extra_data = ?, payload_json = ? WHERE id = ?', (
+            message, encode_payload(extra_data),
+            render_fragment(message, 'digest', digest[1], None, None, None, extra_data), digest_id))
+        cursor.execute('UPDATE notification_digests SET count = ?, reservation_ids = ? WHERE visible_id = ?',
+                       (len(members), json.dumps(reservation_ids), digest_id))
+
+
+def claim_outbox_batch(limit, lease_seconds):
+    """Reserva hasta `limit` entregas vencidas (pendientes, o en envío con el lease expirado
+    porque su worker murió) y las devuelve como dicts. El lease evita que otro proceso
+    las tome mientras se envían."""
+    now = time.time()
+    conn = get_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute('''
+            SELECT o.id, o.notification_id, o.user_id, o.channel, o.payload, o.attempts, o.created_at,
+                   u.name, u.email, u.phone
+            FROM notification_outbox o LEFT JOIN users u ON u.id = o.user_id
+            WHERE o.status = 'pending' AND o.next_attempt_at <= ?
+            UNION ALL
+            SELECT o.id, o.notification_id, o.user_id, o.channel, o.payload, o.attempts, o.created_at,
+                   u.name, u.email, u.phone
+            FROM notification_outbox o LEFT JOIN users u ON u.id = o.user_id
+            WHERE o.status = 'sending' AND o.claimed_until < ?
+            LIMIT ?
+        ''', (now, now, limit)).fetchall()
+        conn.executemany('''
+            UPDATE notification_outbox SET status = 'sending', claimed_until = ?, attempts = attempts + 1
+            WHERE id = ?
+        ''', [(now + lease_seconds, r[0]) for r in rows])
+        conn.commit()
+    finally:
+        conn.close()
+    return [
+        {
+            'id': r[0], 'notification_id': r[1], 'user_id': r[2], 'channel': r[3],
+            'payload': json.loads(r[4]), 'attempts': r[5] + 1, 'created_at': r[6],
+            'recipient': {'name': r[7], 'email': r[8], 'phone': r[9]}
+        }
+        for r in rows
+    ]
+
+
+def complete_outbox_delivery(outbox_id, latency_ms):
+    conn = get_connection()
+    conn.execute('''
+        UPDATE notification_outbox SET status = 'sent', sent_at = ?, latency_ms = ?, claimed_until = NULL,
+            last_error = NULL
+        WHERE id = ?
+    ''', (time.time(), latency_ms, outbox_id))
+    conn.commit()
+    conn.close()
+
+
+def fail_outbox_delivery(outbox_id, error, retry_at=None):
+    """Registra un intento fallido: vuelve a 'pending' para retry_at o queda 'failed' si es None."""
+    conn = get_connection()
+    conn.execute('''
+        UPDATE notification_outbox SET status = ?, next_attempt_at = COALESCE(?, next_attempt_at),
+            claimed_until = NULL, last_error = ?
+        WHERE id = ?
+    ''', ('pending' if retry_at is not None else 'failed', retry_at, str(error)[:500], outbox_id))
+    conn.commit()
+    conn.close()
+
+
+def get_outbox_counts():
+    """Entregas por estado ({'pending': n, 'sending': n, 'sent': n, 'failed': n})."""
+    conn = get_connection()
+    rows = conn.execute('SELECT status, COUNT(*) FROM notification_outbox GROUP BY status').fetchall()
+    conn.close()
+    return {r[0]: r[1] for r in rows}
+
+
+def update_notification_extra_data(reservation_id, user_id, type, extra_data):
+    """Reemplaza extra_data (y el fragmento serializado) de las notificaciones `type` del
+    usuario para la reserva."""
+    extra_data = sanitize_payload(type, extra_data)
+    conn = get_connection()
+    rows = conn.execute('''
+        SELECT id, message, created_at, owner_id, eta FROM notifications
+        WHERE reservation_id = ? AND user_id = ? AND type = ?
+    ''', (reservation_id, user_id, type)).fetchall()
+    conn.executemany('UPDATE notifications SET extra_data = ?, payload_json = ? WHERE id = ?', [
+        (encode_payload(extra_data),
+         render_fragment(r[1], type, r[2], reservation_id, r[3], r[4], extra_data), r[0])
+        for r in rows
+    ])
     conn.commit()
     conn.close()
+    if rows:
+        bump_resource_versions([user_id], 'notifications', 'notification_state')
 
 
-def delete_notifications_for_reservation(reservation_id, types_to_remove=None, user_id=None):
+def delete_notifications_for_reservation(reservation_id, types_to_remove=None, user_id=None, fence=None):
     """Elimina notificaciones asociadas a una reserva.
 
     - reservation_id: id de la reserva cuyas notificaciones se eliminarán.
     - types_to_remove: lista opcional de tipos a eliminar; si es None se eliminan todas las notifs para esa reserva.
     - user_id: si se pasa, limitar la eliminación a ese usuario.
+    - fence: (nombre, token) del lease del scheduler; se verifica en la misma transacción
+      del borrado y, si ya no es el vigente, no se borra nada y se devuelve False.
     """
     conn = get_connection()
     cursor = conn.cursor()
@@ -469,42 +1191,283 @@ def delete_notifications_for_reservation(reservation_id, types_to_remove=None, u
             else:
                 sql = "DELETE FROM notifications WHERE reservation_id = ?"
                 params = (reservation_id,)
+        cursor.execute('BEGIN IMMEDIATE')
+        if not _lease_held(cursor, fence):
+            conn.rollback()
+            return False
+        # Usuarios afectados y digests que agrupan las filas (mismo filtro que el DELETE)
+        cursor.execute(sql.replace('DELETE FROM', f'SELECT user_id, {_DIGEST_OF_ROW_SQL} FROM', 1), params)
+        rows = cursor.fetchall()
+        affected = list({r[0] for r in rows})
         cursor.execute(sql, params)
+        _sync_digests(cursor, [r[1] for r in rows])
         conn.commit()
     except Exception:
         # No fallar si algo va mal; el proceso principal debe continuar
-        pass
+        affected = []
     finally:
         conn.close()
+    bump_resource_versions(affected, 'notifications', 'notification_state')
+    return True
 
 
-def get_notifications_by_user(user_id):
+def _query_notifications(user_id, since_id=None, before_id=None, limit=None, types=None, unread_only=False,
+                         digest_id=None):
+    """Filas (id, status, payload_json, columnas...) de las notificaciones visibles del
+    usuario, de la más nueva a la más vieja, con el status ya derivado de read_through_id.
+    Las agrupadas en una entrada 'digest' sólo aparecen al pedir su digest_id."""
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, message, type, status, created_at, reservation_id, owner_id, eta, extra_data 
-        FROM notifications 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC
-    ''', (user_id,))
+    read_through, cleared_through = _get_notification_watermarks(cursor, user_id)
+    where = ['user_id = ?', 'id > ?']
+    params = [user_id, cleared_through]
+    if digest_id is None:
+        where.append('digest_id IS NULL')
+    else:
+        where.append('digest_id = ?')
+        params.append(digest_id)
+    if unread_only:
+        where += ['id > ?', "status = 'unread'"]
+        params.append(read_through)
+    if since_id is not None:
+        where.append('id > ?')
+        params.append(since_id)
+    if before_id is not None:
+        where.append('id < ?')
+        params.append(before_id)
+    if types:
+        where.append(f"type IN ({','.join('?' for _ in types)})")
+        params.extend(types)
+    sql = f'''
+        SELECT id, status, payload_json, message, type, created_at, reservation_id, owner_id, eta, extra_data
+        FROM notifications
+        WHERE {' AND '.join(where)}
+        ORDER BY id DESC
+    '''
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    cursor.execute(sql, params)
     rows = cursor.fetchall()
     conn.close()
+    return [(row[0], 'read' if row[0] <= read_through else row[1], row) for row in rows]
+
+
+def _legacy_extra_data(raw):
+    # Filas anteriores al esquema tipado: extra_data puede ser JSON mal formado
+    try:
+        return json.loads(raw) if raw else None
+    except ValueError:
+        return None
+
+
+def get_notifications_by_user(user_id, since_id=None, before_id=None, limit=None, types=None):
+    """Notificaciones visibles del usuario de la más nueva a la más vieja (por id); el
+    estado 'read' se deriva de su marca read_through_id.
+
+    - since_id: sólo las posteriores a ese id (sincronización incremental).
+    - before_id: sólo las anteriores a ese id (paginación del historial junto con limit).
+    - types: lista opcional de tipos a incluir.
+    """
     return [
         {
             'id': row[0],
-            'message': row[1],
-            'type': row[2],
-            'status': row[3],
-            'created_at': row[4],
-            'reservation_id': row[5],
-            'owner_id': row[6],
-            'eta': row[7],
-            'extra_data': row[8]
+            'message': row[3],
+            'type': row[4],
+            'status': status,
+            'created_at': row[5],
+            'reservation_id': row[6],
+            'owner_id': row[7],
+            'eta': row[8],
+            'extra_data': _legacy_extra_data(row[9])
         }
-        for row in rows
+        for _, status, row in _query_notifications(user_id, since_id, before_id, limit, types)
     ]
 
 
+def get_notifications_json_by_user(user_id, since_id=None, before_id=None, limit=None, types=None,
+                                   unread_only=False, digest_id=None):
+    """Como get_notifications_by_user pero devuelve (id, objeto JSON ya codificado) por
+    notificación, armado desde el fragmento guardado al escribirla."""
+    result = []
+    for notification_id, status, row in _query_notifications(user_id, since_id, before_id, limit, types,
+                                                              unread_only, digest_id):
+        fragment = row[2]
+        if fragment is None:
+            fragment = render_fragment(row[3], row[4], row[5], row[6], row[7], row[8],
+                                       _legacy_extra_data(row[9]))
+        result.append((notification_id, notification_json(notification_id, status, fragment)))
+    return result
+
+
+def _get_notification_watermarks(cursor, user_id):
+    cursor.execute('SELECT read_through_id, cleared_through_id FROM notification_watermarks WHERE user_id = ?',
+                   (user_id,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def mark_all_notifications_read(user_id):
+    """Marca como leídas todas las notificaciones actuales del usuario moviendo su marca
+    read_through_id (una sola fila escrita sin importar el tamaño del buzón)."""
+    conn = get_connection()
+    conn.execute('''
+        INSERT INTO notification_watermarks (user_id, read_through_id)
+        VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM notifications))
+        ON CONFLICT(user_id) DO UPDATE SET read_through_id = excluded.read_through_id
+    ''', (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def clear_all_notifications(user_id):
+    """Oculta todas las notificaciones actuales del usuario moviendo su marca
+    cleared_through_id; el borrado físico lo hace purge_cleared_notifications."""
+    conn = get_connection()
+    conn.execute('''
+        INSERT INTO notification_watermarks (user_id, read_through_id, cleared_through_id)
+        VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM notifications), (SELECT COALESCE(MAX(id), 0) FROM notifications))
+        ON CONFLICT(user_id) DO UPDATE SET cleared_through_id = excluded.cleared_through_id,
+            read_through_id = MAX(read_through_id, excluded.read_through_id)
+    ''', (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def purge_cleared_notifications(batch_size=500, max_batches=20):
+    """Borra físicamente, por lotes cortos, las notificaciones que quedaron bajo la marca
+    cleared_through_id de su usuario. Devuelve cuántas filas borró."""
+    total = 0
+    conn = get_connection()
+    try:
+        for _ in range(max_batches):
+            conn.execute('BEGIN IMMEDIATE')
+            # CROSS JOIN fija el orden: recorrer las marcas y buscar por el índice (user_id, id)
+            rows = conn.execute('''
+                SELECT n.id, CASE WHEN n.type = 'digest' THEN n.id ELSE n.digest_id END
+                FROM notification_watermarks w
+                CROSS JOIN notifications n ON n.user_id = w.user_id AND n.id <= w.cleared_through_id
+                WHERE w.cleared_through_id > 0
+                LIMIT ?
+            ''', (batch_size,)).fetchall()
+            conn.executemany('DELETE FROM notifications WHERE id = ?', [(r[0],) for r in rows])
+            _sync_digests(conn.cursor(), [r[1] for r in rows])
+            conn.commit()  # liberar el lock de escritura entre lotes
+            total += len(rows)
+            if len(rows) < batch_size:
+                break
+    finally:
+        conn.close()
+    return total
+
+
+def _delete_notification_batches(select_sql, params, batch_size, max_batches):
+    """Borra por lotes las notificaciones que devuelve select_sql (columnas id, user_id;
+    recibe LIMIT ? como último parámetro). Cada lote va en su propia transacción.
+
+    Devuelve (borradas, lotes, usuarios afectados, quedan_pendientes)."""
+    deleted = batches = 0
+    affected = set()
+    pending = False
+    conn = get_connection()
+    try:
+        for _ in range(max_batches):
+            rows = conn.execute(select_sql, list(params) + [batch_size]).fetchall()
+            if not rows:
+                pending = False
+                break
+            ids = [r[0] for r in rows]
+            conn.execute('BEGIN IMMEDIATE')
+            digest_ids = [r[0] for r in conn.execute(
+                f"SELECT {_DIGEST_OF_ROW_SQL} FROM notifications WHERE id IN ({','.join('?' for _ in ids)})", ids)]
+            conn.executemany('DELETE FROM notifications WHERE id = ?', [(i,) for i in ids])
+            _sync_digests(conn.cursor(), digest_ids)
+            conn.commit()
+            deleted += len(rows)
+            batches += 1
+            affected.update(r[1] for r in rows)
+            pending = len(rows) == batch_size
+            if not pending:
+                break
+    finally:
+        conn.close()
+    # Son notificaciones ya entregadas: los clientes deben resincronizar
+    bump_resource_versions(affected, 'notifications', 'notification_state')
+    return deleted, batches, affected, pending
+
+
+# Notificaciones de reservas en curso: el flujo de llegada y finalización las lee (p. ej.
+# driver_arrived en el dashboard del arrendador) y el barrido de vencimientos usa eta_expired
+# para no avisar dos veces, así que ni el TTL ni el tope por usuario las borran.
+_LIVE_RESERVATION_FILTER = '''NOT EXISTS (
+    SELECT 1 FROM reservations r
+    WHERE r.id = n.reservation_id AND r.status IN ('pending', 'arrived', 'active'))'''
+
+
+def delete_superseded_notifications(batch_size=500, max_batches=20):
+    """Borra las notificaciones reemplazadas por otra más nueva del mismo
+    (reservation_id, type, user_id): sólo se conserva la última de cada grupo."""
+    return _delete_notification_batches('''
+        SELECT n.id, n.user_id FROM (
+            SELECT reservation_id, type, user_id, MAX(id) AS newest FROM notifications
+            WHERE reservation_id IS NOT NULL
+            GROUP BY reservation_id, type, user_id
+            HAVING COUNT(*) > 1
+        ) g
+        CROSS JOIN notifications n
+            ON n.reservation_id = g.reservation_id AND n.type = g.type
+            AND n.user_id = g.user_id AND n.id < g.newest
+        LIMIT ?
+    ''', (), batch_size, max_batches)
+
+
+def delete_expired_notifications(ttl_days_by_type, default_ttl_days, batch_size=500, max_batches=20):
+    """Borra las notificaciones más viejas que el TTL (en días) de su tipo; los tipos que no
+    están en ttl_days_by_type usan default_ttl_days. Un TTL None conserva el tipo indefinidamente.
+    Las de reservas en curso se conservan hasta que la reserva termine."""
+    deleted = batches = 0
+    affected = set()
+    pending = False
+    groups = [([t], ttl) for t, ttl in ttl_days_by_type.items()]
+    groups.append((None, default_ttl_days))
+    known = list(ttl_days_by_type)
+    for types, ttl in groups:
+        if ttl is None or batches >= max_batches:
+            continue
+        if types is not None:
+            where, params = 'n.type = ?', types
+        elif known:
+            where, params = f"n.type NOT IN ({','.join('?' for _ in known)})", known
+        else:
+            where, params = '1', []
+        cutoff = clock.db_timestamp(clock.now() - ttl * 86400)
+        d, b, users, more = _delete_notification_batches(f'''
+            SELECT n.id, n.user_id FROM notifications n
+            WHERE {where} AND n.created_at < ? AND {_LIVE_RESERVATION_FILTER}
+            LIMIT ?
+        ''', list(params) + [cutoff], batch_size, max_batches - batches)
+        deleted += d
+        batches += b
+        affected |= users
+        pending = pending or more
+    return deleted, batches, affected, pending
+
+
+def delete_overflow_notifications(max_per_user, batch_size=500, max_batches=20):
+    """Conserva como máximo max_per_user notificaciones (las más nuevas) por usuario, más las
+    de reservas en curso."""
+    return _delete_notification_batches(f'''
+        SELECT n.id, n.user_id FROM (
+            SELECT user_id FROM notifications GROUP BY user_id HAVING COUNT(*) > ?
+        ) u
+        CROSS JOIN notifications n ON n.user_id = u.user_id
+        WHERE n.id < (SELECT id FROM notifications WHERE user_id = u.user_id
+                      ORDER BY id DESC LIMIT 1 OFFSET ?)
+            AND {_LIVE_RESERVATION_FILTER}
+        LIMIT ?
+    ''', (max_per_user, max_per_user - 1), batch_size, max_batches)
+
+
 def get_reservations_count_by_driver(driver_id):
     conn = get_connection()
     cursor = conn.cursor()
@@ -557,7 +1520,7 @@ def get_reservation(id):
     conn = get_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute('SELECT id, driver_id, parking_id, status, duration_minutes, eta_minutes, created_at, penalty_active, penalty_start, penalty_amount FROM reservations WHERE id = ?', (id,))
+        cursor.execute('SELECT id, driver_id, parking_id, status, duration_minutes, eta_minutes, created_at, penalty_active, penalty_start, penalty_amount, elapsed_minutes, total_amount FROM reservations WHERE id = ?', (id,))
         r = cursor.fetchone()
     except Exception:
         cursor.execute('SELECT id, driver_id, parking_id, status, created_at FROM reservations WHERE id = ?', (id,))
@@ -568,14 +1531,16 @@ def get_reservation(id):
     # Normalizar salida: incluir duration_minutes y eta_minutes si existen
     out = {'id': r[0], 'driver_id': r[1], 'parking_id': r[2], 'status': r[3]}
     try:
-        # Si la consulta devolvió duration/eta/penalty
-        if len(r) >= 10:
+        # Si la consulta devolvió duration/eta/penalty (y el cobro final)
+        if len(r) >= 12:
             out['duration_minutes'] = r[4]
             out['eta_minutes'] = r[5]
             out['created_at'] = r[6]
             out['penalty_active'] = r[7]
             out['penalty_start'] = r[8]
             out['penalty_amount'] = r[9]
+            out['elapsed_minutes'] = r[10]
+            out['total_amount'] = r[11]
         elif len(r) >= 6:
             out['duration_minutes'] = r[4]
             out['eta_minutes'] = r[5]
@@ -611,6 +1576,8 @@ def cancel_reservation(reservation_id, cancelled_by_id):
     # Actualizar el estado de la reserva
     cursor.execute('UPDATE reservations SET status = ? WHERE id = ?', ('cancelled', reservation_id))
     conn.commit()
+    publish_change('reservation_updated', [reservation['driver_id'], owner_id],
+                   {'reservation_id': reservation_id, 'status': 'cancelled'})
     
     # Reactivar el parqueadero
     try:
@@ -634,7 +1601,7 @@ def cancel_reservation(reservation_id, cancelled_by_id):
                     type='reservation_cancelled',
                     reservation_id=reservation_id,
                     owner_id=owner_id,
-                    extra_data=f'{{"cancelled_by": "driver", "driver_id": {reservation["driver_id"]}}}'
+                    extra_data={'cancelled_by': 'driver', 'driver_id': reservation['driver_id']}
                 )
             # Notificación de confirmación para el conductor
             add_notification(
@@ -643,7 +1610,7 @@ def cancel_reservation(reservation_id, cancelled_by_id):
                 type='reservation_cancelled',
                 reservation_id=reservation_id,
                 owner_id=owner_id,
-                extra_data=f'{{"cancelled_by": "self", "parking_name": "{parking_name}"}}'
+                extra_data={'cancelled_by': 'self', 'parking_name': parking_name}
             )
         else:
             # El arrendador canceló
@@ -653,7 +1620,7 @@ def cancel_reservation(reservation_id, cancelled_by_id):
                 type='reservation_cancelled',
                 reservation_id=reservation_id,
                 owner_id=owner_id,
-                extra_data=f'{{"cancelled_by": "owner", "parking_name": "{parking_name}"}}'
+                extra_data={'cancelled_by': 'owner', 'parking_name': parking_name}
             )
             if owner_id:
                 add_notification(
@@ -662,7 +1629,7 @@ def cancel_reservation(reservation_id, cancelled_by_id):
                     type='reservation_cancelled',
                     reservation_id=reservation_id,
                     owner_id=owner_id,
-                    extra_data=f'{{"cancelled_by": "self", "driver_id": {reservation["driver_id"]}}}'
+                    extra_data={'cancelled_by': 'self', 'driver_id': reservation['driver_id']}
                 )
     except Exception as e:
         print(f"Error creando notificaciones de cancelación: {e}")
@@ -704,13 +1671,45 @@ def get_active_parkings():
     return parkings
 
 
+def get_parking_snapshot_rows():
+    """Devuelve tuplas (id, latitude, longitude, active) de los parqueaderos con coordenadas."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, latitude, longitude, active FROM parkings WHERE latitude IS NOT NULL AND longitude IS NOT NULL')
+    rows = [(r[0], float(r[1]), float(r[2]), bool(r[3])) for r in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def get_parkings_by_ids(parking_ids):
+    """Devuelve un dict id -> parqueadero (campos públicos) para los ids dados."""
+    ids = list(parking_ids)
+    out = {}
+    if not ids:
+        return out
+    conn = get_connection()
+    cursor = conn.cursor()
+    # SQLite limita el número de parámetros por consulta; consultar por lotes
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        placeholders = ','.join('?' for _ in chunk)
+        cursor.execute(f'SELECT id, owner_id, name, address, department, city, latitude, longitude, active FROM parkings WHERE id IN ({placeholders})', chunk)
+        for r in cursor.fetchall():
+            out[r[0]] = {
+                'id': r[0], 'owner_id': r[1], 'name': r[2], 'address': r[3], 'department': r[4], 'city': r[5],
+                'latitude': r[6], 'longitude': r[7], 'active': bool(r[8])
+            }
+    conn.close()
+    return out
+
+
 def finish_reservation(reservation_id, finished_by_id):
-    """Marca una reserva como 'completed', calcula tiempo usado/importe, registra calificación opcional
-    y envía notificaciones apropiadas.
+    """Marca una reserva como 'completed', calcula y guarda tiempo usado/importe, registra calificación
+    opcional y envía notificaciones apropiadas.
 
-    Asunciones razonables: si no existe una tarifa por minuto en la DB, usamos una tarifa por defecto
-    de 100 unidades por minuto. La función acepta que el arrendador finalice la reserva y opcionalmente
-    envíe una calificación (la calificación se debe haber registrado previamente usando add_review).
+    El importe sale de utils/pricing.py (tarifa por minuto más la multa si aplica). La función
+    acepta que el arrendador finalice la reserva y opcionalmente envíe una calificación (la
+    calificación se debe haber registrado previamente usando add_review).
     """
     conn = get_connection()
     cursor = conn.cursor()
@@ -736,49 +1735,25 @@ def finish_reservation(reservation_id, finished_by_id):
     driver_row = cursor.fetchone()
     driver_name = driver_row[0] if driver_row else "El conductor"
     
-    cursor.execute('SELECT owner_id, name FROM parkings WHERE id = ?', (reservation['parking_id'],))
+    cursor.execute('SELECT owner_id, name, occupied_since FROM parkings WHERE id = ?', (reservation['parking_id'],))
     parking_row = cursor.fetchone()
     owner_id = parking_row[0] if parking_row else None
     parking_name = parking_row[1] if parking_row else "el parqueadero"
     
-    # Calcular tiempo usado y total a cobrar (si es posible)
-    elapsed_minutes = None
-    total_amount = None
-    try:
-        # Obtener occupied_since desde parkings
-        cursor.execute('SELECT occupied_since FROM parkings WHERE id = ?', (reservation['parking_id'],))
-        park_row = cursor.fetchone()
-        occupied_since = park_row[0] if park_row else None
-        if occupied_since:
-            try:
-                import datetime
-                occ = datetime.datetime.fromisoformat(occupied_since)
-                now = datetime.datetime.utcnow()
-                secs = (now - occ).total_seconds()
-                elapsed_minutes = int((secs + 59) // 60) if secs > 0 else 0
-            except Exception:
-                elapsed_minutes = None
-    except Exception:
-        elapsed_minutes = None
-
-    # tarifa por minuto por defecto (asunción): 100
-    rate_per_minute = 100
-    if elapsed_minutes is None:
-        # fallback a la duración planificada
-        elapsed_minutes = reservation.get('duration_minutes', None) or 0
-    try:
-        total_amount = int(elapsed_minutes) * int(rate_per_minute)
-    except Exception:
-        total_amount = None
-
-    # Agregar penalización si existe
-    penalty_amount = reservation.get('penalty_amount', 0) or 0
-    if total_amount is not None:
-        total_amount += penalty_amount
+    # Tiempo usado y total a cobrar con la tarifa y multa vigentes (utils/pricing.py); es
+    # el único momento en que se guarda el cobro
+    charge = price_reservation(dict(reservation, occupied_since=parking_row[2] if parking_row else None))
+    elapsed_minutes = charge['elapsed_minutes']
+    total_amount = charge['total']
 
     # Actualizar el estado de la reserva
-    cursor.execute('UPDATE reservations SET status = ? WHERE id = ?', ('completed', reservation_id))
+    cursor.execute('''
+        UPDATE reservations SET status = 'completed', elapsed_minutes = ?, penalty_amount = ?, total_amount = ?
+        WHERE id = ?
+    ''', (elapsed_minutes, charge['penalty_amount'], total_amount, reservation_id))
     conn.commit()
+    publish_change('reservation_updated', [reservation['driver_id'], owner_id],
+                   {'reservation_id': reservation_id, 'status': 'completed'})
 
     # Reactivar el parqueadero
     try:
@@ -802,7 +1777,8 @@ def finish_reservation(reservation_id, finished_by_id):
                     type='reservation_completed',
                     reservation_id=reservation_id,
                     owner_id=owner_id,
-                    extra_data=f'{{"completed_by": "driver", "driver_id": {reservation["driver_id"]}, "elapsed_minutes": {elapsed_minutes}, "amount": {total_amount}}}'
+                    extra_data={'completed_by': 'driver', 'driver_id': reservation['driver_id'],
+                                'elapsed_minutes': elapsed_minutes, 'amount': total_amount}
                 )
             # Notificación de confirmación para el conductor
             add_notification(
@@ -811,7 +1787,8 @@ def finish_reservation(reservation_id, finished_by_id):
                 type='reservation_completed',
                 reservation_id=reservation_id,
                 owner_id=owner_id,
-                extra_data=f'{{"completed_by": "self", "parking_name": "{parking_name}", "elapsed_minutes": {elapsed_minutes}, "amount": {total_amount}}}'
+                extra_data={'completed_by': 'self', 'parking_name': parking_name,
+                            'elapsed_minutes': elapsed_minutes, 'amount': total_amount}
             )
         else:
             # El arrendador finalizó
@@ -821,7 +1798,8 @@ def finish_reservation(reservation_id, finished_by_id):
                 type='reservation_completed',
                 reservation_id=reservation_id,
                 owner_id=owner_id,
-                extra_data=f'{{"completed_by": "owner", "parking_name": "{parking_name}", "elapsed_minutes": {elapsed_minutes}, "amount": {total_amount}}}'
+                extra_data={'completed_by': 'owner', 'parking_name': parking_name,
+                            'elapsed_minutes': elapsed_minutes, 'amount': total_amount}
             )
             if owner_id:
                 add_notification(
@@ -830,7 +1808,8 @@ def finish_reservation(reservation_id, finished_by_id):
                     type='reservation_completed',
                     reservation_id=reservation_id,
                     owner_id=owner_id,
-                    extra_data=f'{{"completed_by": "self", "driver_id": {reservation["driver_id"]}, "elapsed_minutes": {elapsed_minutes}, "amount": {total_amount}}}'
+                    extra_data={'completed_by': 'self', 'driver_id': reservation['driver_id'],
+                                'elapsed_minutes': elapsed_minutes, 'amount': total_amount}
                 )
         # Si quien finalizó es el arrendador y se envió una calificación por POST, el controlador del endpoint
         # debe haber llamado a add_review separadamente; aquí no lo forzamos para no mezclar responsabilidades.
@@ -861,9 +1840,15 @@ def mark_driver_arrived(reservation_id):
     owner_id = parking_row[0] if parking_row else None
     parking_name = parking_row[1] if parking_row else "el parqueadero"
     
-    # Actualizar el estado de la reserva a 'active' (conductor ocupando el sitio)
-    cursor.execute('UPDATE reservations SET status = ? WHERE id = ?', ('active', reservation_id))
+    # Actualizar el estado de la reserva a 'active' (conductor ocupando el sitio). Sólo
+    # desde 'pending': la liberación automática pudo cancelarla mientras tanto
+    cursor.execute("UPDATE reservations SET status = ? WHERE id = ? AND status = 'pending'", ('active', reservation_id))
+    if cursor.rowcount == 0:
+        conn.close()
+        return False
     conn.commit()
+    publish_change('reservation_updated', [reservation['driver_id'], owner_id],
+                   {'reservation_id': reservation_id, 'status': 'active'})
 
     try:
         # Limpiar notificaciones de INTERFAZ 1 al pasar a INTERFAZ 2
@@ -873,9 +1858,8 @@ def mark_driver_arrived(reservation_id):
         except Exception:
             pass
         # Registrar occupied_since en el parking (timer inicia ahora)
-        import datetime
         # Guardar con zona UTC explícita para que JS y Python parseen correctamente
-        occupied_ts = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).isoformat()
+        occupied_ts = clock.iso_timestamp()
         try:
             update_parking(reservation['parking_id'], occupied_since=occupied_ts, active=0)
         except Exception:
@@ -918,199 +1902,445 @@ def mark_driver_arrived(reservation_id):
     return True
 
 
-def notify_expired_reservations():
-    """Busca reservas con status 'active' cuyo tiempo desde occupied_since
-    excede duration_minutes y envía notificaciones (una sola vez) tanto al
-    arrendador como al conductor indicando que el tiempo finalizó y que el
-    arrendador puede finalizar el servicio.
-    
-    También busca reservas con status 'pending' cuyo tiempo de ETA ha expirado
-    y notifica al conductor que no ha llegado al parqueadero.
+def acquire_lease(name, holder, ttl):
+    """Toma (o conserva) el lease `name` para `holder` durante ttl segundos. Devuelve el
+    token de fencing, que aumenta cada vez que el lease cambia de dueño, o None si otro
+    proceso lo tiene vigente."""
+    now = time.time()
+    conn = get_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT holder, token, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+        if row and row['holder'] != holder and row['expires_at'] > now:
+            conn.rollback()
+            return None
+        token = 1 if row is None else row['token'] + (row['holder'] != holder)
+        conn.execute('''
+            INSERT INTO leases (name, holder, token, expires_at, heartbeat_at, acquired_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, token = excluded.token,
+                expires_at = excluded.expires_at, heartbeat_at = excluded.heartbeat_at,
+                acquired_at = CASE WHEN leases.holder = excluded.holder THEN leases.acquired_at
+                                   ELSE excluded.acquired_at END
+        ''', (name, holder, token, now + ttl, now, now))
+        conn.commit()
+        return token
+    finally:
+        conn.close()
 
-    Esta función está pensada para ejecutarse periódicamente desde el servidor
-    (ej. hilo background) o invocarse desde un endpoint de verificación.
-    """
+
+def renew_lease(name, holder, token, ttl):
+    """Heartbeat: extiende el lease si sigue siendo de holder con el mismo token."""
+    now = time.time()
     conn = get_connection()
-    cursor = conn.cursor()
     try:
-        # 1. Verificar reservas pendientes cuyo ETA ha expirado
-        import datetime
-        cursor.execute('''
-            SELECT r.id, r.driver_id, r.parking_id, r.eta_minutes, r.created_at,
-                   p.name as parking_name, p.owner_id
-            FROM reservations r
-            LEFT JOIN parkings p ON r.parking_id = p.id
-            WHERE r.status = 'pending'
-        ''')
-        pending_rows = cursor.fetchall()
-        
-        for r in pending_rows:
-            try:
-                reservation_id = r['id'] if 'id' in r.keys() else r[0]
-                driver_id = r['driver_id'] if 'driver_id' in r.keys() else r[1]
-                parking_id = r['parking_id'] if 'parking_id' in r.keys() else r[2]
-                eta_minutes = r['eta_minutes'] if 'eta_minutes' in r.keys() and r['eta_minutes'] is not None else (r[3] if len(r) > 3 else None)
-                created_at = r['created_at'] if 'created_at' in r.keys() else (r[4] if len(r) > 4 else None)
-                parking_name = r['parking_name'] if 'parking_name' in r.keys() else (r[5] if len(r) > 5 else 'el parqueadero')
-                owner_id = r['owner_id'] if 'owner_id' in r.keys() else (r[6] if len(r) > 6 else None)
-                
-                if not created_at or eta_minutes is None:
-                    continue
-                
-                try:
-                    created_dt = datetime.datetime.fromisoformat(created_at)
-                except Exception:
-                    continue
-                
-                now = datetime.datetime.utcnow()
-                elapsed_secs = (now - created_dt).total_seconds()
-                eta_secs = int(eta_minutes) * 60
-                
-                # Si el tiempo de ETA ha expirado
-                if elapsed_secs >= eta_secs:
-                    # Evitar notificar repetidamente
-                    cursor.execute('SELECT COUNT(*) FROM notifications WHERE reservation_id = ? AND type = ?', (reservation_id, 'eta_expired'))
-                    exists = cursor.fetchone()[0]
-                    if exists and exists > 0:
-                        continue
-                    
-                    # Obtener nombre del conductor para la notificación del arrendador
-                    cursor.execute('SELECT name FROM users WHERE id = ?', (driver_id,))
-                    driver_row = cursor.fetchone()
-                    driver_name = driver_row[0] if driver_row else 'El conductor'
-                    
-                    # Notificación para el conductor (no llegó a tiempo)
-                    add_notification(
-                        user_id=driver_id,
-                        message=f"No has llegado al parqueadero {parking_name}",
-                        type='eta_expired',
-                        reservation_id=reservation_id,
-                        owner_id=owner_id,
-                        extra_data={'parking_name': parking_name, 'parking_id': parking_id, 'eta_minutes': eta_minutes}
-                    )
-                    
-                    # Notificación para el arrendador (conductor no llegó a tiempo)
-                    if owner_id:
-                        add_notification(
-                            user_id=owner_id,
-                            message=f"El conductor no llegó al garaje en el tiempo estimulado.",
-                            type='reservation_expired',
-                            reservation_id=reservation_id,
-                            owner_id=owner_id,
-                            extra_data={'driver_id': driver_id, 'driver_name': driver_name, 'parking_name': parking_name}
-                        )
-            except Exception:
-                continue
-        
-        # 2. Seleccionar reservas activas con occupied_since
-        cursor.execute('''
-            SELECT r.id, r.driver_id, r.parking_id, r.duration_minutes, u.name as driver_name,
-                   p.owner_id, p.name as parking_name, p.occupied_since
-            FROM reservations r
-            LEFT JOIN users u ON r.driver_id = u.id
-            LEFT JOIN parkings p ON r.parking_id = p.id
-            WHERE r.status = 'active' AND p.occupied_since IS NOT NULL
-        ''')
-        rows = cursor.fetchall()
-        import datetime
-        for r in rows:
-            try:
-                occ = r['occupied_since'] if 'occupied_since' in r.keys() else (r[7] if len(r) > 7 else None)
-                if not occ:
-                    continue
-                try:
-                    occ_dt = datetime.datetime.fromisoformat(occ)
-                except Exception:
-                    # Skip if date unparsable
-                    continue
-                now = datetime.datetime.utcnow()
-                elapsed_secs = (now - occ_dt).total_seconds()
-                elapsed_min = int((elapsed_secs + 59) // 60) if elapsed_secs > 0 else 0
-                desired = r['duration_minutes'] if 'duration_minutes' in r.keys() and r['duration_minutes'] is not None else (r[3] if len(r) > 3 else None)
-                if desired is None:
-                    continue
-                if elapsed_min >= int(desired):
-                    reservation_id = r['id'] if 'id' in r.keys() else r[0]
-                    owner_id = r['owner_id'] if 'owner_id' in r.keys() else r[5]
-                    driver_id = r['driver_id'] if 'driver_id' in r.keys() else r[1]
-                    parking_name = r['parking_name'] if 'parking_name' in r.keys() else (r[6] if len(r) > 6 else 'el parqueadero')
-                    driver_name = r['driver_name'] if 'driver_name' in r.keys() else (r[4] if len(r) > 4 else 'El conductor')
-                    # Evitar notificar repetidamente: buscar notificación previa de tipo 'reservation_expired'
-                    cursor.execute('SELECT COUNT(*) FROM notifications WHERE reservation_id = ? AND type = ?', (reservation_id, 'reservation_expired'))
-                    exists = cursor.fetchone()[0]
-                    if exists and exists > 0:
-                        continue
-                    # Limpiar notificaciones previas que puedan confundir (p.ej. parking_occupied)
-                    try:
-                        delete_notifications_for_reservation(reservation_id, types_to_remove=['parking_occupied'])
-                    except Exception:
-                        pass
-                    
-                    # NO enviar más notificaciones de "reservation_expired" 
-                    # El arrendador ya tiene la notificación de "driver_arrived" que le muestra el tiempo restante
-                    # El conductor ya tiene la notificación de "vehicle_parked" con el contador
-                    # Cuando el arrendador haga click en "Confirmar", ahí se abre el modal de finalización
-            except Exception:
-                continue
-        
-        # 3. Calcular penalizaciones para reservas con penalty_active=1
-        # La multa solo comienza DESPUÉS de que expire duration_minutes
-        cursor.execute('''
-            SELECT r.id, r.duration_minutes, p.occupied_since
+        cursor = conn.execute('''
+            UPDATE leases SET expires_at = ?, heartbeat_at = ?
+            WHERE name = ? AND holder = ? AND token = ?
+        ''', (now + ttl, now, name, holder, token))
+        conn.commit()
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+
+def publish_lease_metrics(name, holder, token, metrics):
+    """Guarda las métricas (dict) del dueño del lease; se ignora si ya no lo es."""
+    conn = get_connection()
+    try:
+        conn.execute('UPDATE leases SET metrics = ? WHERE name = ? AND holder = ? AND token = ?',
+                     (json.dumps(metrics), name, holder, token))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def release_lease(name, holder, token):
+    """Libera el lease para que otro proceso lo tome sin esperar a que venza."""
+    conn = get_connection()
+    try:
+        conn.execute('UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ? AND token = ?',
+                     (name, holder, token))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_lease(name):
+    conn = get_connection()
+    try:
+        row = conn.execute('SELECT * FROM leases WHERE name = ?', (name,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def _lease_held(cursor, fence):
+    """Fencing: True si fence (nombre, token) sigue siendo el token vigente del lease. Se
+    consulta dentro de la transacción de la escritura; sin fence no se verifica nada."""
+    if fence is None:
+        return True
+    row = cursor.execute('SELECT token FROM leases WHERE name = ?', (fence[0],)).fetchone()
+    return row is not None and row[0] == fence[1]
+
+
+def get_reservation_deadline_rows(reservation_id=None):
+    """Reservas con plazos por vencer: pendientes (llegada y liberación si no llega) y
+    activas con el vehículo ya guardado (fin del tiempo). eta_notified indica si ya se avisó
+    el ETA vencido. Con reservation_id sólo esa reserva; la lista queda vacía si ya no tiene
+    plazos (finalizada, cancelada...)."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        sql = '''
+            SELECT r.id, r.status, r.eta_minutes, r.created_at, r.duration_minutes, r.hold_until,
+                   p.occupied_since,
+                   EXISTS (SELECT 1 FROM notifications n
+                           WHERE n.reservation_id = r.id AND n.type = 'eta_expired') AS eta_notified
             FROM reservations r
             LEFT JOIN parkings p ON r.parking_id = p.id
-            WHERE r.penalty_active = 1 AND r.status = 'active' AND p.occupied_since IS NOT NULL
-        ''')
-        penalty_rows = cursor.fetchall()
-        
-        for r in penalty_rows:
-            try:
-                reservation_id = r['id'] if 'id' in r.keys() else r[0]
-                duration_minutes = r['duration_minutes'] if 'duration_minutes' in r.keys() else (r[1] if len(r) > 1 else 0)
-                occupied_since = r['occupied_since'] if 'occupied_since' in r.keys() else (r[2] if len(r) > 2 else None)
-                
-                if not occupied_since or not duration_minutes:
-                    continue
-                
-                try:
-                    occupied_dt = datetime.datetime.fromisoformat(occupied_since)
-                except Exception:
-                    continue
-                
-                now = datetime.datetime.utcnow()
-                elapsed_secs = (now - occupied_dt).total_seconds()
-                elapsed_minutes = int(elapsed_secs // 60)
-                
-                # Calcular cuántos minutos han pasado DESPUÉS del tiempo permitido
-                overtime_minutes = elapsed_minutes - duration_minutes
-                
-                # Solo cobrar multa si ya se excedió el tiempo
-                if overtime_minutes > 0:
-                    # Calcular penalización: $500 por cada 5 minutos completos de EXCESO
-                    penalty_periods = overtime_minutes // 5
-                    new_penalty = penalty_periods * 500
-                    
-                    # Actualizar penalty_amount
-                    cursor.execute('''
-                        UPDATE reservations
-                        SET penalty_amount = ?
-                        WHERE id = ?
-                    ''', (new_penalty, reservation_id))
-                    conn.commit()
-                else:
-                    # Si aún no se ha excedido, la multa es 0
-                    cursor.execute('''
-                        UPDATE reservations
-                        SET penalty_amount = 0
-                        WHERE id = ?
-                    ''', (reservation_id,))
-                    conn.commit()
-            except Exception:
-                continue
+            WHERE (r.status = 'pending' OR (r.status = 'active' AND p.occupied_since IS NOT NULL))
+        '''
+        params = ()
+        if reservation_id is not None:
+            sql += ' AND r.id = ?'
+            params = (reservation_id,)
+        cursor.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def reservation_deadlines(row, policy=None):
+    """Plazos (tipo, timestamp epoch) de una fila de get_reservation_deadline_rows:
+    'eta' (llegada, si aún no se avisó) y 'release' (liberación según la política de
+    utils/no_show.py) de las pendientes y 'duration' (fin del tiempo reservado) de las
+    activas. La multa no tiene plazos: se calcula al leer (utils/pricing.py)."""
+    if row['status'] == 'pending':
+        created = timestamp_seconds(row['created_at'])
+        if created is None or row['eta_minutes'] is None:
+            return []
+        deadlines = [] if row['eta_notified'] else [('eta', created + int(row['eta_minutes']) * 60)]
+        release_at = (policy or no_show_policy).release_at(created, row['eta_minutes'],
+                                                           timestamp_seconds(row['hold_until']))
+        if release_at is not None:
+            deadlines.append(('release', release_at))
+        return deadlines
+    occupied = timestamp_seconds(row['occupied_since'])
+    if occupied is None or row['duration_minutes'] is None:
+        return []
+    return [('duration', occupied + int(row['duration_minutes']) * 60)]
+
+
+def expire_reservation_eta(reservation_id, fence=None):
+    """Notifica (una sola vez) al conductor que no llegó a tiempo y al arrendador que la
+    reserva venció. Devuelve True si se enviaron notificaciones. El fencing y las dos
+    notificaciones van en la misma transacción: con fence (nombre, token) no se escribe
+    nada si el lease ya cambió de dueño."""
+    now = clock.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if not _lease_held(cursor, fence):
+            conn.rollback()
+            return False
+        expired, created = _expire_etas(cursor, now, clock.db_timestamp(now), reservation_id)
+        conn.commit()
     except Exception:
-        pass
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _publish_notifications(created)
+    return bool(expired)
+
+
+def expire_reservation_duration(reservation_id, fence=None):
+    """Fin del tiempo reservado: sólo limpia notificaciones que puedan confundir
+    (p.ej. parking_occupied). No se envían notificaciones nuevas: el arrendador ya tiene
+    "driver_arrived" con el tiempo restante y el conductor "vehicle_parked" con el
+    contador; al confirmar, el arrendador abre el modal de finalización. Devuelve False si
+    el lease de fence ya no es nuestro (verificado en la transacción del borrado)."""
+    return delete_notifications_for_reservation(reservation_id, types_to_remove=['parking_occupied'],
+                                                fence=fence)
+
+
+# Timestamp de la DB (CURRENT_TIMESTAMP o ISO con zona) como segundos epoch en SQL.
+_EPOCH_SQL = "((julianday({}) - 2440587.5) * 86400.0)"
+# Igual pero exacto en segundos enteros (julianday redondea): para created_at y hold_until,
+# que no tienen fracciones, y así coincidir con el plazo que calcula el scheduler.
+_EPOCH_SECONDS_SQL = "CAST(strftime('%s', {}) AS INTEGER)"
+
+
+def _insert_notifications_select(cursor, source, specs, created_at, now):
+    """Inserta con INSERT ... SELECT una notificación por fila de la tabla `source` (que
+    tiene reservation_id y owner_id) para cada (tipo, columna del usuario, SQL del mensaje,
+    SQL de extra_data, WHERE) de specs, con sus entregas del outbox, dentro de la
+    transacción del llamador. payload_json es el mismo fragmento que arma render_fragment,
+    sin llaves. Devuelve (id, user_id, type, reservation_id) de las creadas."""
+    first_id = cursor.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM notifications').fetchone()[0]
+    for type, user_column, message_sql, extra_sql, where in specs:
+        cursor.execute(f'''
+            INSERT INTO notifications (user_id, message, type, reservation_id, owner_id, extra_data,
+                                       created_at, payload_json)
+            SELECT user_id, message, ?, reservation_id, owner_id, extra, created_at,
+                   substr(fragment, 2, length(fragment) - 2)
+            FROM (
+                SELECT *, json_object('message', message, 'type', ?, 'created_at', created_at,
+                                      'reservation_id', reservation_id, 'owner_id', owner_id,
+                                      'eta', NULL, 'extra_data', json(extra)) AS fragment
+                FROM (SELECT {user_column} AS user_id, {message_sql} AS message, {extra_sql} AS extra,
+                             ? AS created_at, reservation_id, owner_id
+                      FROM {source} {where})
+            )
+            ORDER BY reservation_id
+        ''', (type, type, created_at))
+    # Entregas externas de las notificaciones nuevas, en la misma transacción
+    for type in {spec[0] for spec in specs}:
+        cursor.executemany('''
+            INSERT INTO notification_outbox (notification_id, user_id, channel, payload, next_attempt_at, created_at)
+            SELECT id, user_id, ?, json_object('message', message, 'type', type,
+                                               'reservation_id', reservation_id, 'extra_data', json(extra_data)),
+                   ?, ?
+            FROM notifications WHERE id >= ? AND type = ?
+        ''', [(channel, now, now, first_id, type) for channel in OUTBOX_CHANNELS.get(type, ())])
+    return cursor.execute('SELECT id, user_id, type, reservation_id FROM notifications WHERE id >= ?',
+                          (first_id,)).fetchall()
+
+
+def _release_no_shows(cursor, now, created_at, policy, reservation_id=None):
+    """Cancela las reservas pendientes cuyo plazo de liberación (utils/no_show.py) venció y
+    reactiva sus parqueaderos, dentro de la transacción del llamador: borra los avisos
+    previos de esas reservas y notifica al conductor y al arrendador. Devuelve
+    (liberadas, notificaciones creadas, usuarios con avisos borrados); publicar con
+    _publish_no_show_release después del commit."""
+    if not policy.enabled:
+        return [], [], []
+    release_sql, params = policy.release_sql(_EPOCH_SECONDS_SQL.format('r.created_at'), 'r.eta_minutes',
+                                             _EPOCH_SECONDS_SQL.format('r.hold_until'))
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS no_show (
+            reservation_id INTEGER PRIMARY KEY, driver_id INTEGER, owner_id INTEGER,
+            parking_id INTEGER, parking_name TEXT, driver_name TEXT)
+    ''')
+    cursor.execute('DELETE FROM temp.no_show')
+    cursor.execute(f'''
+        INSERT INTO temp.no_show
+        SELECT r.id, r.driver_id, p.owner_id, r.parking_id,
+               COALESCE(p.name, 'el parqueadero'), COALESCE(u.name, 'El conductor')
+        FROM reservations r
+        LEFT JOIN parkings p ON r.parking_id = p.id
+        LEFT JOIN users u ON r.driver_id = u.id
+        WHERE r.status = 'pending' AND r.eta_minutes IS NOT NULL AND {release_sql} <= ?
+              {'AND r.id = ?' if reservation_id is not None else ''}
+    ''', params + [now] + ([reservation_id] if reservation_id is not None else []))
+    released = cursor.execute('SELECT reservation_id, driver_id, owner_id, parking_id FROM temp.no_show').fetchall()
+    if not released:
+        return [], [], []
+    cursor.execute('''
+        UPDATE reservations SET status = 'cancelled', cancel_reason = 'no_show'
+        WHERE id IN (SELECT reservation_id FROM temp.no_show)
+    ''')
+    # El parqueadero vuelve a estar disponible si no tiene otra reserva vigente
+    cursor.execute('''
+        UPDATE parkings SET active = 1, occupied_since = NULL
+        WHERE id IN (SELECT parking_id FROM temp.no_show)
+          AND NOT EXISTS (SELECT 1 FROM reservations r WHERE r.parking_id = parkings.id
+                          AND r.status IN ('pending', 'arrived', 'active'))
+    ''')
+    cleared = cursor.execute(f'''
+        SELECT user_id, {_DIGEST_OF_ROW_SQL} FROM notifications
+        WHERE reservation_id IN (SELECT reservation_id FROM temp.no_show)
+    ''').fetchall()
+    cleared_users = list({r[0] for r in cleared})
+    cursor.execute('DELETE FROM notifications WHERE reservation_id IN (SELECT reservation_id FROM temp.no_show)')
+    _sync_digests(cursor, [r[1] for r in cleared])
+    created = _insert_notifications_select(cursor, 'temp.no_show', (
+        ('reservation_cancelled', 'driver_id',
+         "'Tu reserva en ' || parking_name || ' se canceló porque no llegaste a tiempo.'",
+         "json_object('cancelled_by', 'no_show', 'parking_name', parking_name)", ''),
+        ('reservation_cancelled', 'owner_id',
+         "driver_name || ' no llegó: ' || parking_name || ' vuelve a estar disponible.'",
+         "json_object('cancelled_by', 'no_show', 'driver_id', driver_id, 'parking_name', parking_name)",
+         'WHERE owner_id IS NOT NULL'),
+    ), created_at, now)
+    return [dict(r) for r in released], created, cleared_users
+
+
+def _publish_notifications(created):
+    """Publica las notificaciones de _insert_notifications_select, después del commit."""
+    for notification_id, user_id, type, reservation_id in created:
+        publish_change('notification', [user_id], {'id': notification_id, 'type': type, 'reservation_id': reservation_id})
+
+
+def _publish_no_show_release(released, created, cleared_users):
+    bump_resource_versions(cleared_users, 'notifications', 'notification_state')
+    for r in released:
+        publish_change('reservation_updated', [r['driver_id'], r['owner_id']],
+                       {'reservation_id': r['reservation_id'], 'status': 'cancelled', 'reason': 'no_show'})
+        publish_change('parking_updated', [r['owner_id']], {'parking_id': r['parking_id']})
+    _publish_notifications(created)
+
+
+def _expire_etas(cursor, now, created_at, reservation_id=None):
+    """Avisa, dentro de la transacción del llamador, las reservas pendientes con el ETA
+    vencido que aún no se notificaron: eta_expired al conductor y reservation_expired al
+    arrendador. Devuelve (reservas avisadas, notificaciones creadas); publicar con
+    _publish_notifications después del commit."""
+    cursor.execute('''
+        CREATE TEMP TABLE IF NOT EXISTS expired_eta (
+            reservation_id INTEGER PRIMARY KEY, driver_id INTEGER, owner_id INTEGER,
+            parking_id INTEGER, eta_minutes INTEGER, parking_name TEXT, driver_name TEXT)
+    ''')
+    cursor.execute('DELETE FROM temp.expired_eta')
+    cursor.execute(f'''
+        INSERT INTO temp.expired_eta
+        SELECT r.id, r.driver_id, p.owner_id, r.parking_id, r.eta_minutes,
+               COALESCE(p.name, 'el parqueadero'), COALESCE(u.name, 'El conductor')
+        FROM reservations r
+        LEFT JOIN parkings p ON r.parking_id = p.id
+        LEFT JOIN users u ON r.driver_id = u.id
+        WHERE r.status = 'pending' AND r.eta_minutes IS NOT NULL
+          AND {_EPOCH_SECONDS_SQL.format('r.created_at')} + r.eta_minutes * 60 <= ?
+          AND NOT EXISTS (SELECT 1 FROM notifications n
+                          WHERE n.reservation_id = r.id AND n.type = 'eta_expired')
+          {'AND r.id = ?' if reservation_id is not None else ''}
+    ''', [now] + ([reservation_id] if reservation_id is not None else []))
+    expired = cursor.rowcount
+    if not expired:
+        return 0, []
+    # Conductor: no llegó a tiempo. Arrendador: el conductor no llegó
+    created = _insert_notifications_select(cursor, 'temp.expired_eta', (
+        ('eta_expired', 'driver_id', "'No has llegado al parqueadero ' || parking_name",
+         "json_object('parking_name', parking_name, 'parking_id', parking_id, 'eta_minutes', eta_minutes)", ''),
+        ('reservation_expired', 'owner_id', "'El conductor no llegó al garaje en el tiempo estimulado.'",
+         "json_object('driver_id', driver_id, 'driver_name', driver_name, 'parking_name', parking_name)",
+         'WHERE owner_id IS NOT NULL'),
+    ), created_at, now)
+    return expired, created
+
+
+def release_no_show_reservation(reservation_id, fence=None, policy=None):
+    """Libera la reserva si sigue pendiente y venció su plazo de liberación: cancelación,
+    parqueadero disponible y notificaciones en una sola transacción. Devuelve True si se
+    liberó. Con fence (nombre, token) no hace nada si el lease ya cambió de dueño."""
+    now = clock.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if not _lease_held(cursor, fence):
+            conn.rollback()
+            return False
+        released, created, cleared_users = _release_no_shows(cursor, now, clock.db_timestamp(now),
+                                                             policy or no_show_policy, reservation_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    _publish_no_show_release(released, created, cleared_users)
+    return bool(released)
+
+
+def hold_reservation(reservation_id, owner_id, minutes, policy=None):
+    """Prórroga del arrendador para una reserva pendiente: la liberación automática se
+    corre `minutes` minutos desde el plazo vigente (o desde ahora, si ya venció). Devuelve
+    el nuevo plazo (epoch), o None si la reserva no es del arrendador o ya no está pendiente."""
+    policy = policy or no_show_policy
+    now = clock.now()
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        row = cursor.execute('''
+            SELECT r.status, r.driver_id, r.created_at, r.eta_minutes, r.hold_until, p.owner_id
+            FROM reservations r JOIN parkings p ON r.parking_id = p.id WHERE r.id = ?
+        ''', (reservation_id,)).fetchone()
+        if not row or row['owner_id'] != owner_id or row['status'] != 'pending':
+            conn.rollback()
+            return None
+        current = policy.release_at(timestamp_seconds(row['created_at']), row['eta_minutes'],
+                                    timestamp_seconds(row['hold_until']))
+        hold_until = max(now, current if current is not None else now) + minutes * 60
+        cursor.execute('UPDATE reservations SET hold_until = ? WHERE id = ?',
+                       (clock.db_timestamp(hold_until), reservation_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
+    publish_change('reservation_updated', [row['driver_id'], owner_id],
+                   {'reservation_id': reservation_id, 'status': 'pending'})
+    return hold_until
+
+
+def notify_expired_reservations(now=None, fence=None, policy=None):
+    """Barrido completo de plazos vencidos con sentencias por conjunto, en una sola
+    transacción: liberación de las reservas sin llegada (utils/no_show.py), notificaciones
+    únicas de ETA vencido (INSERT ... SELECT ... WHERE NOT EXISTS, con sus entregas del
+    outbox) y limpieza de las reservas que pasaron su tiempo. Las multas no se escriben: se
+    calculan al leer (utils/pricing.py).
+
+    El servidor procesa cada plazo en su momento con scheduler.DeadlineScheduler; el barrido
+    se usa para ponerse al día al arrancar (o invocarse a mano). Devuelve, por categoría
+    ('release', 'eta', 'duration'), las reservas examinadas y las procesadas, o None si fence
+    (nombre, token) ya no es el token vigente del lease."""
+    now = clock.now() if now is None else now
+    created_at = clock.db_timestamp(now)
+    conn = get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        if not _lease_held(cursor, fence):
+            conn.rollback()
+            return None
+        pending_examined, active_examined = cursor.execute('''
+            SELECT COALESCE(SUM(r.status = 'pending'), 0),
+                   COALESCE(SUM(r.status = 'active' AND p.occupied_since IS NOT NULL), 0)
+            FROM reservations r LEFT JOIN parkings p ON r.parking_id = p.id
+            WHERE r.status IN ('pending', 'active')
+        ''').fetchone()
+        # 1. Reservas pendientes sin llegada pasada la gracia: se cancelan y se libera el parqueadero
+        released, release_created, release_cleared = _release_no_shows(cursor, now, created_at,
+                                                                       policy or no_show_policy)
+        # 2. Reservas pendientes con el ETA vencido que aún no se notificaron
+        expired, created = _expire_etas(cursor, now, created_at)
+
+        # 3. Reservas activas que pasaron su tiempo: limpiar avisos que puedan confundir
+        overdue_sql = f'''
+            SELECT r.id FROM reservations r JOIN parkings p ON r.parking_id = p.id
+            WHERE r.status = 'active' AND p.occupied_since IS NOT NULL AND r.duration_minutes IS NOT NULL
+              AND {_EPOCH_SQL.format('p.occupied_since')} + r.duration_minutes * 60 <= ?
+        '''
+        cleared_users = [r[0] for r in cursor.execute(f'''
+            SELECT DISTINCT user_id FROM notifications
+            WHERE type = 'parking_occupied' AND reservation_id IN ({overdue_sql})
+        ''', (now,)).fetchall()]
+        cursor.execute(f'''
+            DELETE FROM notifications WHERE type = 'parking_occupied' AND reservation_id IN ({overdue_sql})
+        ''', (now,))
+        cleared = cursor.rowcount
+        overdue = cursor.execute(f'SELECT COUNT(*) FROM ({overdue_sql})', (now,)).fetchone()[0]
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    _publish_no_show_release(released, release_created, release_cleared)
+    bump_resource_versions(cleared_users, 'notifications', 'notification_state')
+    _publish_notifications(created)
+    return {
+        'release': {'examined': pending_examined, 'acted': len(released), 'notifications': len(release_created)},
+        'eta': {'examined': pending_examined - len(released), 'acted': expired, 'notifications': len(created)},
+        'duration': {'examined': active_examined, 'acted': overdue, 'cleared': cleared},
+    }
 
 
 # ============================================================
@@ -0,0 +1,523 @@
+import heapq
+import itertools
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from models import (
+    acquire_lease,
+    renew_lease,
+    release_lease,
+    publish_lease_metrics,
+    notify_expired_reservations,
+    get_reservation_deadline_rows,
+    reservation_deadlines,
+    expire_reservation_eta,
+    expire_reservation_duration,
+    release_no_show_reservation,
+    purge_expired_idempotency_keys,
+    get_change_watermark,
+)
+from utils import clock
+from utils.scheduler_metrics import SchedulerMetrics, log_event
+
+# Recarga completa desde la DB cada tanto: recoge cambios hechos por otros procesos o
+# transiciones que no pasaron por refresh(). Es el único despertar sin plazos pendientes.
+RELOAD_INTERVAL = 600.0
+# Se compacta el heap cuando las entradas obsoletas superan esta fracción.
+COMPACT_RATIO = 0.5
+
+KINDS = ('eta', 'release', 'duration')
+
+# Elección de líder: el lease vence LEASE_TTL segundos después del último heartbeat.
+LEASE_NAME = 'scheduler'
+LEASE_TTL = 15.0
+HEARTBEAT_INTERVAL = 5.0
+# Segundos entre pasadas de retención de notificaciones.
+RETENTION_INTERVAL = 30.0
+# Canal del bus por el que los workers web avisan cambios de plazos al scheduler.
+DEADLINES_CHANNEL = 'reservation_deadlines'
+# Recarga del proceso independiente cuando el bus no cruza procesos (TINCAR_BUS=local).
+LOCAL_BUS_RELOAD_INTERVAL = 15.0
+# Con el bus local, cada cuántos segundos se consulta la marca de cambios de la DB (ChangePoller).
+LOCAL_BUS_POLL_INTERVAL = 1.0
+
+
+class DeadlineScheduler:
+    """Plazos de las reservas en un min-heap (timestamp, seq, tipo, reserva).
+
+    El hilo duerme hasta el plazo más cercano (o hasta que refresh() avise de un cambio) y
+    dispara sólo lo vencido: O(log n) por plazo en lugar de recorrer todas las reservas
+    abiertas. Reprogramar una reserva no busca en el heap: se guarda el seq vigente de cada
+    (tipo, reserva) y las entradas con otro seq se descartan al salir.
+
+    Los plazos se comparan con utils/clock.py; con un VirtualClock el hilo no sabe cuándo
+    avanza el reloj: se arranca con start(background=False) y quien avanza el reloj llama a
+    run_pending() (scripts/simulate_reservations.py).
+    """
+
+    def __init__(self, reload_interval=RELOAD_INTERVAL, metrics=None):
+        self.reload_interval = reload_interval
+        self.metrics = metrics or SchedulerMetrics()
+        self._heap = []
+        self._live = {}  # (tipo, reserva) -> seq de la entrada vigente
+        self._seq = itertools.count()
+        self._dirty = set()
+        self._cond = threading.Condition()
+        self._running = False
+        self._generation = 0
+        # (nombre, token) del lease del líder: las escrituras lo verifican (fencing)
+        self.fence = None
+        self.handlers = {
+            'eta': self._fire_eta,
+            'release': self._fire_release,
+            'duration': self._fire_duration,
+        }
+
+    # --- programación -------------------------------------------------------------
+
+    def _push(self, kind, reservation_id, due):
+        seq = next(self._seq)
+        self._live[(kind, reservation_id)] = seq
+        heapq.heappush(self._heap, (due, seq, kind, reservation_id))
+
+    def _replace(self, reservation_id, deadlines):
+        for kind in KINDS:
+            self._live.pop((kind, reservation_id), None)
+        for kind, due in deadlines:
+            self._push(kind, reservation_id, due)
+
+    def schedule(self, kind, reservation_id, due):
+        """Programa (o reprograma) un plazo de la reserva."""
+        with self._cond:
+            self._push(kind, reservation_id, due)
+            self._cond.notify()
+
+    def refresh(self, reservation_id):
+        """La reserva cambió (creada, llegada, finalizada, tiempo extra...): el hilo del
+        scheduler relee sus plazos de la DB antes de seguir durmiendo."""
+        if reservation_id is None:
+            return
+        with self._cond:
+            if not self._running:
+                return
+            self._dirty.add(reservation_id)
+            self._cond.notify()
+
+    def load(self):
+        """Reemplaza todos los plazos por los de las reservas abiertas en la DB."""
+        started = time.monotonic()
+        rows = get_reservation_deadline_rows()
+        with self._cond:
+            self._heap = []
+            self._live = {}
+            for row in rows:
+                for kind, due in reservation_deadlines(row):
+                    self._push(kind, row['id'], due)
+            loaded = len(self._live)
+            self._cond.notify()
+        self.metrics.record_run('load', (time.monotonic() - started) * 1000, examined=len(rows), acted=loaded)
+
+    def _apply_refreshes(self, reservation_ids):
+        started = time.monotonic()
+        for reservation_id in reservation_ids:
+            rows = get_reservation_deadline_rows(reservation_id)
+            deadlines = reservation_deadlines(rows[0]) if rows else []
+            with self._cond:
+                self._replace(reservation_id, deadlines)
+        self.metrics.record_run('refresh', (time.monotonic() - started) * 1000, examined=len(reservation_ids))
+
+    def _compact(self):
+        if len(self._heap) > 64 and len(self._live) < len(self._heap) * COMPACT_RATIO:
+            self._heap = [entry for entry in self._heap
+                          if self._live.get((entry[2], entry[3])) == entry[1]]
+            heapq.heapify(self._heap)
+
+    def pending(self):
+        """Cantidad de plazos programados."""
+        with self._cond:
+            return len(self._live)
+
+    def next_deadline(self):
+        """(timestamp, tipo, reserva) del próximo plazo vigente, o None."""
+        with self._cond:
+            live = [(due, kind, reservation_id) for due, seq, kind, reservation_id in self._heap
+                    if self._live.get((kind, reservation_id)) == seq]
+        return min(live) if live else None
+
+    # --- ejecución ----------------------------------------------------------------
+
+    def _pop_due(self, now):
+        """Saca los plazos vencidos (descartando los obsoletos). Llamar con el lock."""
+        due_entries = []
+        while self._heap and self._heap[0][0] <= now:
+            due, seq, kind, reservation_id = heapq.heappop(self._heap)
+            if self._live.get((kind, reservation_id)) == seq:
+                del self._live[(kind, reservation_id)]
+                due_entries.append((due, kind, reservation_id))
+        return due_entries
+
+    def _fire(self, due, kind, reservation_id):
+        started = time.monotonic()
+        # Lag: desde el vencimiento hasta que se empezó a procesar
+        lag_ms = max(0.0, (clock.now() - due) * 1000)
+        acted, error = False, None
+        try:
+            acted = bool(self.handlers[kind](reservation_id))
+        except Exception as e:
+            error = str(e)
+            self.metrics.record_error(f'{kind}:{reservation_id}', kind)
+        duration_ms = (time.monotonic() - started) * 1000
+        self.metrics.record_job(kind, lag_ms, acted, duration_ms)
+        log_event('scheduler', 'deadline', kind=kind, reservation_id=reservation_id, lag_ms=round(lag_ms, 1),
+                  duration_ms=round(duration_ms, 1), acted=acted, error=error)
+
+    def run_pending(self, now=None):
+        """Procesa los cambios avisados y dispara los plazos vencidos; devuelve cuántos."""
+        with self._cond:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self._apply_refreshes(dirty)
+        with self._cond:
+            due_entries = self._pop_due(clock.now() if now is None else now)
+            self._compact()
+        for entry in due_entries:
+            self._fire(*entry)
+        return len(due_entries)
+
+    def _seconds_until_next(self):
+        """Segundos hasta el próximo plazo (acotado por la recarga). Llamar con el lock."""
+        timeout = self.reload_interval
+        while self._heap:
+            due, seq, kind, reservation_id = self._heap[0]
+            if self._live.get((kind, reservation_id)) == seq:
+                timeout = min(timeout, due - clock.now())
+                break
+            heapq.heappop(self._heap)
+        return max(0.0, timeout)
+
+    @property
+    def running(self):
+        return self._running
+
+    def run_forever(self, generation):
+        next_reload = time.monotonic() + self.reload_interval
+        while self._generation == generation:
+            try:
+                if time.monotonic() >= next_reload:
+                    self.load()
+                    next_reload = time.monotonic() + self.reload_interval
+                self.run_pending()
+            except Exception as e:
+                self.metrics.record_error('loop')
+                log_event('scheduler', 'error', where='loop', error=str(e))
+            with self._cond:
+                if not self._dirty and self._generation == generation:
+                    timeout = min(self._seconds_until_next(), max(0.0, next_reload - time.monotonic()))
+                    if timeout > 0:
+                        self._cond.wait(timeout)
+
+    def start(self, fence=None, background=True):
+        """Se pone al día con un barrido por conjunto (lo vencido mientras no corría), carga
+        los plazos de la DB y arranca el hilo. fence es el (nombre, token) del lease con el
+        que se hacen las escrituras. Con background=False no hay hilo: el llamador dispara
+        los plazos con run_pending() (p.ej. al avanzar un VirtualClock)."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._generation += 1
+            generation = self._generation
+            self.fence = fence
+        self.sweep()
+        try:
+            self.load()
+        except Exception as e:
+            self.metrics.record_error('load')
+            log_event('scheduler', 'error', where='load', error=str(e))
+        if background:
+            threading.Thread(target=self.run_forever, args=(generation,), daemon=True).start()
+
+    def sweep(self):
+        """Barrido por conjunto de lo ya vencido (notify_expired_reservations), medido."""
+        started = time.monotonic()
+        try:
+            result = notify_expired_reservations(fence=self.fence)
+        except Exception as e:
+            self.metrics.record_error('sweep')
+            log_event('scheduler', 'error', where='sweep', error=str(e))
+            return None
+        duration_ms = (time.monotonic() - started) * 1000
+        if result is not None:
+            self.metrics.record_run('sweep', duration_ms,
+                                    examined=sum(c['examined'] for c in result.values()),
+                                    acted=sum(c['acted'] for c in result.values()), **result)
+        log_event('scheduler', 'sweep', duration_ms=round(duration_ms, 1), fenced_out=result is None,
+                  **(result or {}))
+        return result
+
+    def status(self):
+        """Plazos programados y el próximo vencimiento."""
+        upcoming = self.next_deadline()
+        return {'running': self._running, 'pending': self.pending(),
+                'next_deadline': None if upcoming is None else
+                {'kind': upcoming[1], 'reservation_id': upcoming[2],
+                 'in_s': round(upcoming[0] - clock.now(), 1)}}
+
+    def stop(self):
+        """Detiene el hilo y descarta los plazos (p.ej. al perder el liderazgo)."""
+        with self._cond:
+            self._running = False
+            self._generation += 1
+            self._heap = []
+            self._live = {}
+            self._dirty = set()
+            self._cond.notify()
+
+    # --- manejadores ----------------------------------------------------------------
+
+    def _fire_eta(self, reservation_id):
+        return expire_reservation_eta(reservation_id, fence=self.fence)
+
+    def _fire_release(self, reservation_id):
+        return release_no_show_reservation(reservation_id, fence=self.fence)
+
+    def _fire_duration(self, reservation_id):
+        return expire_reservation_duration(reservation_id, fence=self.fence)
+
+
+class LeaderLease:
+    """Lease `name` en la tabla leases: acquire() lo toma si está libre o vencido y
+    renew() es el heartbeat. held() además exige un heartbeat exitoso reciente, para que un
+    proceso que no logra escribir en la DB deje de actuar antes de que otro lo reemplace."""
+
+    def __init__(self, name=LEASE_NAME, ttl=LEASE_TTL, holder=None):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.token = None
+        self._valid_until = 0.0
+
+    def heartbeat(self):
+        """Renueva el lease si es nuestro o intenta tomarlo; devuelve si somos líderes."""
+        started = time.monotonic()
+        try:
+            if self.token is not None and renew_lease(self.name, self.holder, self.token, self.ttl):
+                token = self.token
+            else:
+                token = acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            log_event('scheduler', 'error', where='lease', error=str(e))
+            return self.held()
+        self.token = token
+        # Margen de un tercio del TTL frente al vencimiento que ven los demás procesos
+        self._valid_until = started + self.ttl * 2 / 3 if token is not None else 0.0
+        return token is not None
+
+    def held(self):
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    def fence(self):
+        return (self.name, self.token)
+
+    def release(self):
+        if self.token is not None:
+            try:
+                release_lease(self.name, self.holder, self.token)
+            except Exception as e:
+                log_event('scheduler', 'error', where='lease', error=str(e))
+        self.token = None
+        self._valid_until = 0.0
+
+
+class SchedulerService:
+    """Trabajo de fondo del sistema: plazos de las reservas (DeadlineScheduler), retención
+    de notificaciones y entregas del outbox.
+
+    Puede correr en varios procesos (workers, réplicas): sólo el que tiene el lease corre
+    los plazos y la retención; los demás esperan y lo reemplazan si deja de renovarlo. El
+    outbox corre en todos porque sus entregas ya se reservan con leases por fila.
+    """
+
+    def __init__(self, scheduler=None, lease=None, retention=None, dispatcher=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, retention_interval=RETENTION_INTERVAL):
+        self.scheduler = scheduler or deadline_scheduler
+        self.lease = lease or LeaderLease()
+        self.retention = retention
+        self.dispatcher = dispatcher
+        self.heartbeat_interval = heartbeat_interval
+        self.retention_interval = retention_interval
+        self._stop = threading.Event()
+        self.stats = {'elections': 0, 'demotions': 0}
+
+    @property
+    def metrics(self):
+        return self.scheduler.metrics
+
+    def _tick(self):
+        leader = self.lease.heartbeat() and self.lease.held()
+        if leader and not self.scheduler.running:
+            self.stats['elections'] += 1
+            log_event('scheduler', 'elected', holder=self.lease.holder, token=self.lease.token)
+            self.scheduler.start(fence=self.lease.fence())
+        elif not leader and self.scheduler.running:
+            self.stats['demotions'] += 1
+            log_event('scheduler', 'demoted', holder=self.lease.holder)
+            self.scheduler.stop()
+        if leader:
+            try:
+                publish_lease_metrics(self.lease.name, self.lease.holder, self.lease.token, self.snapshot())
+            except Exception as e:
+                log_event('scheduler', 'error', where='publish_metrics', error=str(e))
+        return leader
+
+    def snapshot(self):
+        """Métricas del proceso: las publica el líder en su fila de leases en cada heartbeat."""
+        snapshot = self.metrics.snapshot()
+        snapshot.update(self.scheduler.status())
+        snapshot.update(holder=self.lease.holder, token=self.lease.token, **self.stats)
+        if self.retention is not None:
+            snapshot['retention'] = {key: value for key, value in self.retention.stats.items() if key != 'last_run'}
+        if self.dispatcher is not None:
+            snapshot['outbox'] = dict(self.dispatcher.stats, latency_ms=self.dispatcher.latency_summary())
+        return snapshot
+
+    def _retention_loop(self):
+        while not self._stop.wait(self.retention_interval):
+            if not self.lease.held():
+                continue
+            self._run_retention()
+            self._purge_idempotency_keys()
+
+    def _run_retention(self):
+        try:
+            progress = self.retention.run_once()
+        except Exception as e:
+            self.metrics.record_error('retention')
+            log_event('retention', 'error', error=str(e))
+            return
+        deleted = sum(progress['deleted'].values())
+        self.metrics.record_run('retention', progress['duration_ms'], acted=deleted,
+                                pending=progress['pending'])
+        if deleted or progress['pending']:
+            log_event('retention', 'run', **progress)
+
+    def _purge_idempotency_keys(self):
+        """Respuestas guardadas por Idempotency-Key ya vencidas (utils/idempotency.py)."""
+        started = time.monotonic()
+        try:
+            purged = purge_expired_idempotency_keys()
+        except Exception as e:
+            self.metrics.record_error('idempotency_purge')
+            log_event('retention', 'error', where='idempotency_purge', error=str(e))
+            return
+        self.metrics.record_run('idempotency_purge', (time.monotonic() - started) * 1000, acted=purged)
+
+    def run_forever(self):
+        """Bucle de heartbeat/elección (bloquea hasta shutdown())."""
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        if self.retention is not None:
+            threading.Thread(target=self._retention_loop, daemon=True).start()
+        while not self._stop.is_set():
+            self._tick()
+            self._stop.wait(self.heartbeat_interval)
+
+    def start(self):
+        threading.Thread(target=self.run_forever, daemon=True).start()
+
+    def shutdown(self):
+        self._stop.set()
+        self.scheduler.stop()
+        self.lease.release()
+
+
+class ChangePoller:
+    """Reemplazo del bus cuando no cruza procesos (TINCAR_BUS=local): consulta cada
+    `interval` segundos models.get_change_watermark() y, si cambió, recarga los plazos
+    (reservas) o despierta al outbox (notificaciones nuevas). Una consulta barata por
+    segundo en lugar de esperar LOCAL_BUS_RELOAD_INTERVAL sin enterarse de nada."""
+
+    def __init__(self, scheduler, dispatcher=None, interval=LOCAL_BUS_POLL_INTERVAL):
+        self.scheduler = scheduler
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self._mark = None
+        self._stop = threading.Event()
+
+    def poll(self):
+        mark = get_change_watermark()
+        previous, self._mark = self._mark, mark
+        if previous is None:
+            return
+        if mark[0] != previous[0] and self.scheduler.running:
+            self.scheduler.load()
+        if mark[1] != previous[1] and self.dispatcher is not None:
+            self.dispatcher.wake()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.scheduler.metrics.record_error('change_poll')
+                log_event('scheduler', 'error', where='change_poll', error=str(e))
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# Instancia del proceso (la arranca SchedulerService, en app.py o con python -m scheduler)
+deadline_scheduler = DeadlineScheduler()
+
+
+def main():
+    """Proceso de fondo independiente de los workers web (gunicorn no ejecuta el bloque
+    __main__ de app.py). Se pueden levantar varios: uno es líder y los demás quedan de
+    reserva. Con TINCAR_BUS entre procesos (unix/redis) recibe al instante los cambios de
+    reservas y notificaciones; con el bus local no recibe ningún evento de los workers web
+    y los detecta consultando la DB cada LOCAL_BUS_POLL_INTERVAL (ChangePoller)."""
+    from models import add_change_listener, create_all_tables
+    from utils.notification_retention import notification_retention
+    from utils.outbox import outbox_dispatcher
+    from utils.parking_snapshot import publish_parking_snapshot_async
+    from utils.pubsub import create_bus, LocalBus
+
+    create_all_tables()
+    bus = create_bus()
+    poller = None
+    if type(bus) is LocalBus:
+        log_event('scheduler', 'warning', bus='local',
+                  detail='TINCAR_BUS=local no cruza procesos: este scheduler no recibe los cambios '
+                         'de los workers web; se consultará la DB cada '
+                         f'{LOCAL_BUS_POLL_INTERVAL:g}s. Usar TINCAR_BUS=unix o redis://')
+        deadline_scheduler.reload_interval = LOCAL_BUS_RELOAD_INTERVAL
+        poller = ChangePoller(deadline_scheduler, dispatcher=outbox_dispatcher)
+        poller.start()
+    bus.subscribe(DEADLINES_CHANNEL, lambda m: deadline_scheduler.refresh(m['reservation_id']))
+    bus.subscribe('notifications', lambda m: outbox_dispatcher.wake())
+    # Las liberaciones por no llegar reactivan parqueaderos: republicar el snapshot
+    add_change_listener(lambda event, user_ids, payload: publish_parking_snapshot_async()
+                        if event == 'parking_updated' else None)
+    service = SchedulerService(retention=notification_retention, dispatcher=outbox_dispatcher)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        service.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if poller is not None:
+            poller.stop()
+        service.shutdown()
+        bus.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+// Sincronización incremental del buzón: la primera carga trae la lista completa y las
+// siguientes sólo piden las notificaciones nuevas (since_id). Si el servidor indica que
+// notificaciones ya entregadas cambiaron (state_version distinto), se recarga todo.
+// detail(digestId) trae las notificaciones agrupadas en una entrada 'digest'.
+window.TincarNotifications = (function () {
+  let items = [];
+  let cursor = null;
+  let stateVersion = null;
+
+  function sync(full) {
+    const incremental = !full && cursor !== null;
+    const url = incremental ? `/api/notifications?since_id=${cursor}` : '/api/notifications';
+    return fetch(url)
+      .then(response => response.json())
+      .then(data => {
+        if (!data.success) return data;
+        if (incremental && data.state_version !== stateVersion) return sync(true);
+        if (incremental) {
+          // Las entradas 'digest' nuevas reemplazan a las notificaciones que agrupan
+          const replaced = new Set(data.notifications.flatMap(
+            n => (n.type === 'digest' && n.extra_data && n.extra_data.replaces) || []));
+          items = data.notifications.concat(items.filter(n => !replaced.has(n.id)));
+        } else {
+          items = data.notifications;
+        }
+        cursor = data.cursor;
+        stateVersion = data.state_version;
+        return { success: true, notifications: items };
+      });
+  }
+
+  // Forzar recarga completa en la próxima sincronización (p.ej. tras marcar como leídas)
+  function reset() {
+    cursor = null;
+  }
+
+  // Long-poll de respaldo cuando el socket no está disponible: el servidor retiene la
+  // petición hasta que hay notificaciones nuevas (o timeoutSec). Resuelve true si las hay.
+  function waitForNew(timeoutSec) {
+    // Ante errores o rechazo (503 por exceso de esperas) esperar antes de reintentar
+    const backoff = () => new Promise(resolve => setTimeout(() => resolve(false), 5000));
+    if (cursor === null) return sync().then(() => true).catch(backoff);
+    return fetch(`/api/notifications/wait?since_id=${cursor}&timeout=${timeoutSec || 20}`)
+      .then(response => response.json())
+      .then(data => (data.success ? data.notifications.length > 0 : backoff()))
+      .catch(backoff);
+  }
+
+  // true si el buzón local está desactualizado respecto a lo que informa el servidor
+  // (p.ej. /api/owner/snapshot): hay notificaciones más nuevas o cambió state_version
+  function isStale(latestId, serverStateVersion) {
+    if (cursor === null) return true;
+    return (latestId || 0) > cursor || serverStateVersion !== stateVersion;
+  }
+
+  function detail(digestId) {
+    return fetch(`/api/notifications?digest_id=${digestId}`)
+      .then(response => response.json())
+      .then(data => (data.success ? data.notifications : []));
+  }
+
+  return { sync, reset, waitForNew, isStale, detail };
+})();
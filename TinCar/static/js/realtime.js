@@ -0,0 +1,45 @@
+// Conexión SocketIO compartida por la página. El servidor empuja a la sala del usuario
+// los eventos 'notification', 'reservation_updated' y 'parking_updated'; si el socket
+// no está conectado se vuelve a un polling lento.
+window.TincarRealtime = (function () {
+  const FALLBACK_POLL_MS = 30000;
+  const socket = (typeof io !== 'undefined') ? io() : null;
+
+  function connected() {
+    return !!(socket && socket.connected);
+  }
+
+  // Llama a refresh() cuando llega alguno de los eventos (agrupando ráfagas) y al
+  // (re)conectar para recuperar lo perdido. Mientras no haya socket usa longPoll()
+  // (promesa que resuelve true si hubo cambios) o, si no se pasa, un polling cada fallbackMs.
+  function onPush(events, refresh, fallbackMs, longPoll) {
+    let timer = null;
+    const schedule = () => {
+      if (timer) return;
+      timer = setTimeout(() => { timer = null; refresh(); }, 150);
+    };
+    if (socket) {
+      events.forEach(ev => socket.on(ev, schedule));
+      socket.on('connect', schedule);
+    }
+    if (!longPoll) {
+      setInterval(() => { if (!connected()) refresh(); }, fallbackMs || FALLBACK_POLL_MS);
+      return;
+    }
+    let polling = false;
+    const loop = () => {
+      if (polling || connected()) return;  // se reanuda en 'disconnect'
+      polling = true;
+      longPoll().then(changed => {
+        polling = false;
+        if (changed) refresh();
+        loop();
+      });
+    };
+    if (socket) socket.on('disconnect', loop);
+    // Dar tiempo a la conexión inicial antes de empezar el long-poll
+    setTimeout(loop, 3000);
+  }
+
+  return { socket, connected, onPush };
+})();
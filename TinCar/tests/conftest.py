@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos de TinCar se importan sin paquete (models, app, utils.*), como en app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Base de datos vacía en un directorio temporal, con todas las tablas."""
+    monkeypatch.setattr(models, 'DB_PATH', str(tmp_path / 'tincar.db'))
+    models.create_all_tables()
+    return models.DB_PATH
+
+
+@pytest.fixture
+def seeded(db):
+    """Conductor (1), arrendador (2), segundo conductor (3) y dos parqueaderos del arrendador."""
+    conn = models.get_connection()
+    conn.executemany('INSERT INTO users (name, email, password, phone, role) VALUES (?, ?, ?, ?, ?)', [
+        ('Conductor', 'conductor@tincar.co', 'x', '3000000001', 'conductor'),
+        ('Arrendador', 'arrendador@tincar.co', 'x', '3000000002', 'arrendador'),
+        ('Conductor 2', 'conductor2@tincar.co', 'x', '3000000003', 'conductor'),
+    ])
+    conn.executemany('''
+        INSERT INTO parkings (owner_id, name, department, city, latitude, longitude, active)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [
+        (2, 'Garaje Laureles', 'Antioquia', 'Medellín', 6.2442, -75.5812, 1),
+        (2, 'Garaje Poblado', 'Antioquia', 'Medellín', 6.2088, -75.5673, 1),
+    ])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def make_reservation(seeded):
+    """make_reservation(driver_id, parking_id, status=...) -> id de la reserva creada."""
+    def make(driver_id, parking_id, status='pending', duration_minutes=60, eta_minutes=10):
+        conn = models.get_connection()
+        cursor = conn.execute('''
+            INSERT INTO reservations (driver_id, parking_id, status, duration_minutes, eta_minutes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (driver_id, parking_id, status, duration_minutes, eta_minutes))
+        conn.commit()
+        conn.close()
+        return cursor.lastrowid
+    return make
+
+
+@pytest.fixture
+def flask_app(seeded):
+    import app as tincar_app
+    tincar_app.app.config['TESTING'] = True
+    return tincar_app.app
+
+
+@pytest.fixture
+def login(flask_app):
+    """login(user_id, role) -> cliente de prueba con la sesión iniciada."""
+    def make_client(user_id, role='conductor'):
+        client = flask_app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['role'] = role
+        return client
+    return make_client
@@ -0,0 +1,69 @@
+import pytest
+
+import models
+from utils import clock
+from utils.pricing import CHARGE_REFRESH_SECONDS
+
+
+@pytest.fixture
+def virtual_clock():
+    previous = clock.set_clock(clock.VirtualClock())
+    yield clock.get_clock()
+    clock.set_clock(previous)
+
+
+def revalidate(client, url, response):
+    return client.get(url, headers={'If-None-Match': response.headers['ETag']})
+
+
+def test_unchanged_resource_answers_304(login, make_reservation):
+    make_reservation(1, 1)
+    driver = login(1)
+    first = driver.get('/api/reservations/active/driver')
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+    second = revalidate(driver, '/api/reservations/active/driver', first)
+    assert second.status_code == 304
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert second.get_data() == b''
+
+
+def test_reservation_change_invalidates_only_affected_users(login, make_reservation):
+    reservation_id = make_reservation(1, 1)
+    driver, other = login(1), login(3)
+    cached = driver.get('/api/reservations/active/driver')
+    other_cached = other.get('/api/reservations/active/driver')
+    models.publish_change('reservation_updated', [1], {'reservation_id': reservation_id})
+    assert revalidate(driver, '/api/reservations/active/driver', cached).status_code == 200
+    assert revalidate(other, '/api/reservations/active/driver', other_cached).status_code == 304
+
+
+def test_parking_edit_invalidates_the_driver_reservation(login, make_reservation):
+    make_reservation(1, 1)
+    driver, owner = login(1), login(2, 'arrendador')
+    cached = driver.get('/api/reservations/active/driver')
+    assert owner.post('/parkings/1/update', data={'name': 'Garaje Estadio'}).status_code == 200
+    fresh = revalidate(driver, '/api/reservations/active/driver', cached)
+    assert fresh.status_code == 200
+    assert fresh.get_json()['reservations'][0]['parking_name'] == 'Garaje Estadio'
+
+
+def test_query_string_is_part_of_the_etag(login, seeded):
+    models.add_notification(1, 'Reserva cancelada', 'reservation_cancelled')
+    driver = login(1)
+    everything = driver.get('/api/notifications')
+    filtered = driver.get('/api/notifications?type=eta_expired')
+    assert everything.headers['ETag'] != filtered.headers['ETag']
+    assert revalidate(driver, '/api/notifications?type=eta_expired', everything).status_code == 200
+
+
+def test_charge_is_revalidated_every_refresh_interval(login, make_reservation, virtual_clock):
+    make_reservation(1, 1, status='active')
+    models.update_parking(1, occupied_since=clock.iso_timestamp())
+    driver = login(1)
+    cached = driver.get('/api/reservations/active/driver')
+    assert cached.get_json()['reservations'][0]['charge']['elapsed_minutes'] == 0
+    virtual_clock.advance(CHARGE_REFRESH_SECONDS)
+    fresh = revalidate(driver, '/api/reservations/active/driver', cached)
+    assert fresh.status_code == 200
+    assert fresh.get_json()['reservations'][0]['charge']['elapsed_minutes'] == 1
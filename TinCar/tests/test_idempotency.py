@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+import models
+from utils.idempotency import idempotency_store, request_fingerprint
+
+BODY = json.dumps({'parking_id': 1, 'duration_minutes': 30, 'eta_minutes': 10})
+
+
+def create_reservation(client, key, body=BODY):
+    return client.post('/api/reservations', data=body, content_type='application/json',
+                       headers={'Idempotency-Key': key})
+
+
+def reservation_count():
+    conn = models.get_connection()
+    count = conn.execute('SELECT COUNT(*) FROM reservations').fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_retry_replays_the_stored_response(login):
+    driver = login(1)
+    first = create_reservation(driver, 'k-1')
+    assert first.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+    retry = create_reservation(driver, 'k-1')
+    assert retry.status_code == first.status_code
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert reservation_count() == 1
+
+
+def test_keys_are_scoped_per_user(login):
+    assert create_reservation(login(1), 'k-1').status_code == 200
+    other = create_reservation(login(3), 'k-1', json.dumps({'parking_id': 2, 'eta_minutes': 5}))
+    assert 'Idempotent-Replayed' not in other.headers
+    assert reservation_count() == 2
+
+
+def test_same_key_with_another_request_is_rejected(login):
+    driver = login(1)
+    create_reservation(driver, 'k-1')
+    mismatch = create_reservation(driver, 'k-1', json.dumps({'parking_id': 2, 'eta_minutes': 5}))
+    assert mismatch.status_code == 422
+    assert reservation_count() == 1
+
+
+def test_duplicate_of_an_in_flight_request_gets_409(login, monkeypatch):
+    monkeypatch.setattr(idempotency_store, 'wait_timeout', 0)
+    # La original sigue en curso en otro worker
+    fingerprint = request_fingerprint('POST', '/api/reservations', BODY.encode())
+    state, _ = models.claim_idempotency_key(1, 'k-1', fingerprint, 30)
+    assert state == 'acquired'
+    duplicate = create_reservation(login(1), 'k-1')
+    assert duplicate.status_code == 409
+    assert duplicate.headers['Retry-After'] == '1'
+    assert reservation_count() == 0
+
+
+def test_aborted_request_can_be_retried(login, seeded):
+    fingerprint = request_fingerprint('POST', '/api/reservations', BODY.encode())
+    _, claim_token = models.claim_idempotency_key(1, 'k-1', fingerprint, 30)
+    models.abort_idempotency_key(1, 'k-1', claim_token)
+    assert create_reservation(login(1), 'k-1').status_code == 200
+    assert reservation_count() == 1
+
+
+def test_stale_claim_cannot_complete_a_retaken_key(seeded):
+    fingerprint = b'0' * 16
+    _, stale_token = models.claim_idempotency_key(1, 'k-1', fingerprint, 0)
+    # El lock venció: otro worker toma la clave
+    state, token = models.claim_idempotency_key(1, 'k-1', fingerprint, 30)
+    assert state == 'acquired' and token != stale_token
+    models.complete_idempotency_key(1, 'k-1', stale_token, 200, '{"stale": true}', 60)
+    assert models.claim_idempotency_key(1, 'k-1', fingerprint, 30)[0] == 'in_flight'
+    models.complete_idempotency_key(1, 'k-1', token, 200, '{"ok": true}', 60)
+    assert models.claim_idempotency_key(1, 'k-1', fingerprint, 30) == ('done', (200, '{"ok": true}'))
+
+
+@pytest.mark.parametrize('key', ['', None])
+def test_without_key_every_request_runs(login, key):
+    driver = login(1)
+    headers = {} if key is None else {'Idempotency-Key': key}
+    driver.post('/api/reservations', data=BODY, content_type='application/json', headers=headers)
+    second = driver.post('/api/reservations', data=BODY, content_type='application/json', headers=headers)
+    assert 'Idempotent-Replayed' not in second.headers
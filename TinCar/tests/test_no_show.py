@@ -0,0 +1,49 @@
+import sqlite3
+
+from utils.no_show import GracePolicy
+
+CREATED = 1_772_366_400.0
+
+
+def test_grace_grows_with_the_eta_up_to_the_cap():
+    policy = GracePolicy(grace_minutes=10, eta_ratio=0.5, max_grace_minutes=30)
+    assert policy.grace_for(0) == 10
+    assert policy.grace_for(10) == 15
+    assert policy.grace_for(100) == 30
+    assert policy.grace_for(None) == 10
+
+
+def test_release_at_is_eta_plus_grace():
+    policy = GracePolicy(grace_minutes=10, eta_ratio=0.5, max_grace_minutes=30)
+    assert policy.release_at(CREATED, 10) == CREATED + (10 + 15) * 60
+
+
+def test_hold_until_replaces_the_computed_deadline():
+    policy = GracePolicy()
+    assert policy.release_at(CREATED, 10, hold_until=CREATED + 3600) == CREATED + 3600
+
+
+def test_disabled_policy_never_releases():
+    policy = GracePolicy(grace_minutes=None)
+    assert not policy.enabled
+    assert policy.release_at(CREATED, 10) is None
+
+
+def test_from_env_overrides_and_ignores_invalid_json(monkeypatch):
+    monkeypatch.setenv('TINCAR_NO_SHOW_POLICY', '{"grace_minutes": 5, "unknown": 1}')
+    policy = GracePolicy.from_env()
+    assert policy.grace_minutes == 5
+    assert not hasattr(policy, 'unknown')
+    monkeypatch.setenv('TINCAR_NO_SHOW_POLICY', 'no es json')
+    assert GracePolicy.from_env().grace_minutes == GracePolicy().grace_minutes
+
+
+def test_release_sql_matches_release_at():
+    policy = GracePolicy(grace_minutes=10, eta_ratio=0.5, max_grace_minutes=30)
+    sql, params = policy.release_sql('created', 'eta', 'hold')
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE r (created REAL, eta INTEGER, hold REAL)')
+    cases = [(CREATED, 0, None), (CREATED, 10, None), (CREATED, 90, None), (CREATED, 10, CREATED + 600)]
+    conn.executemany('INSERT INTO r VALUES (?, ?, ?)', cases)
+    computed = [row[0] for row in conn.execute(f'SELECT {sql} FROM r ORDER BY rowid', params)]
+    assert computed == [policy.release_at(created, eta, hold) for created, eta, hold in cases]
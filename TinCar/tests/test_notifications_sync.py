@@ -0,0 +1,129 @@
+import pytest
+
+import models
+
+
+@pytest.fixture
+def inbox(seeded):
+    """Cinco notificaciones del conductor (1), alternando tipos; devuelve sus ids."""
+    for i in range(5):
+        if i % 2:
+            models.add_notification(1, f'ETA vencido {i}', 'eta_expired', reservation_id=i + 1)
+        else:
+            models.add_notification(1, f'Reserva cancelada {i}', 'reservation_cancelled', reservation_id=i + 1)
+    conn = models.get_connection()
+    ids = [r[0] for r in conn.execute('SELECT id FROM notifications WHERE user_id = 1 ORDER BY id')]
+    conn.close()
+    return ids
+
+
+def ids_of(response):
+    return [n['id'] for n in response.get_json()['notifications']]
+
+
+def test_full_sync_is_newest_first_with_cursor(login, inbox):
+    data = login(1).get('/api/notifications').get_json()
+    assert [n['id'] for n in data['notifications']] == inbox[::-1]
+    assert data['cursor'] == inbox[-1]
+    assert data['has_more'] is False
+
+
+def test_since_id_returns_only_newer(login, inbox):
+    driver = login(1)
+    response = driver.get(f'/api/notifications?since_id={inbox[1]}')
+    assert ids_of(response) == inbox[:1:-1]
+    assert response.get_json()['cursor'] == inbox[-1]
+
+
+def test_since_latest_is_empty_and_keeps_the_cursor(login, inbox):
+    data = login(1).get(f'/api/notifications?since_id={inbox[-1]}').get_json()
+    assert data['notifications'] == []
+    assert data['cursor'] == inbox[-1]
+
+
+def test_since_id_zero_is_a_full_sync(login, inbox):
+    assert ids_of(login(1).get('/api/notifications?since_id=0')) == inbox[::-1]
+
+
+def test_before_id_pages_history_without_moving_the_cursor(login, inbox):
+    driver = login(1)
+    page = driver.get(f'/api/notifications?before_id={inbox[3]}&limit=2').get_json()
+    assert [n['id'] for n in page['notifications']] == [inbox[2], inbox[1]]
+    assert page['has_more'] is True
+    assert page['cursor'] is None
+    last = driver.get(f'/api/notifications?before_id={inbox[1]}&limit=2').get_json()
+    assert [n['id'] for n in last['notifications']] == [inbox[0]]
+    assert last['has_more'] is False
+    assert ids_of(driver.get(f'/api/notifications?before_id={inbox[0]}')) == []
+
+
+def test_type_filter_accepts_repeated_and_comma_separated(login, inbox):
+    driver = login(1)
+    assert ids_of(driver.get('/api/notifications?type=eta_expired')) == [inbox[3], inbox[1]]
+    both = [inbox[::-1]] * 2
+    assert [ids_of(driver.get('/api/notifications?type=eta_expired,reservation_cancelled')),
+            ids_of(driver.get('/api/notifications?type=eta_expired&type=reservation_cancelled'))] == both
+    assert ids_of(driver.get(f'/api/notifications?type=reservation_cancelled&since_id={inbox[2]}')) == [inbox[4]]
+
+
+def test_limit_is_capped(login, inbox):
+    data = login(1).get('/api/notifications?limit=0').get_json()
+    assert len(data['notifications']) == 1
+    assert data['has_more'] is True
+
+
+def new_reservation(reservation_id):
+    models.add_notification(2, f'Nueva reserva {reservation_id}', 'new_reservation',
+                            reservation_id=reservation_id, extra_data={'driver_id': 1})
+
+
+def test_grouped_notifications_sync_as_one_digest(login, seeded):
+    for reservation_id in (1, 2, 3):
+        new_reservation(reservation_id)
+    data = login(2, 'arrendador').get('/api/notifications').get_json()
+    assert len(data['notifications']) == 1
+    digest = data['notifications'][0]
+    assert digest['type'] == 'digest'
+    assert digest['extra_data']['count'] == 3
+    assert digest['extra_data']['reservation_ids'] == [1, 2, 3]
+    assert data['cursor'] == digest['id']
+
+
+def test_deleting_a_grouped_notification_updates_the_digest(login, seeded):
+    for reservation_id in (1, 2, 3):
+        new_reservation(reservation_id)
+    owner = login(2, 'arrendador')
+    before = owner.get('/api/notifications').get_json()
+    models.delete_notifications_for_reservation(2)
+    after = owner.get('/api/notifications').get_json()
+    # Una notificación ya entregada cambió: el cliente con since_id debe recargar todo
+    assert after['state_version'] > before['state_version']
+    digest = after['notifications'][0]
+    assert digest['id'] == before['notifications'][0]['id']
+    assert digest['extra_data']['count'] == 2
+    assert digest['extra_data']['reservation_ids'] == [1, 3]
+    assert digest['message'] == models.digest_message('new_reservation', 2)
+
+
+def test_deleting_every_grouped_notification_removes_the_digest(login, seeded):
+    for reservation_id in (1, 2):
+        new_reservation(reservation_id)
+    models.delete_notifications_for_reservation(1)
+    models.delete_notifications_for_reservation(2)
+    owner = login(2, 'arrendador')
+    assert owner.get('/api/notifications').get_json()['notifications'] == []
+    # La siguiente de la ventana no se agrupa con notificaciones ya borradas
+    new_reservation(3)
+    notifications = owner.get('/api/notifications').get_json()['notifications']
+    assert [(n['type'], n['reservation_id']) for n in notifications] == [('new_reservation', 3)]
+
+
+def test_deleted_single_notification_does_not_open_a_digest(login, seeded):
+    new_reservation(1)
+    models.delete_notifications_for_reservation(1)
+    new_reservation(2)
+    new_reservation(3)
+    notifications = login(2, 'arrendador').get('/api/notifications').get_json()['notifications']
+    assert len(notifications) == 1
+    assert notifications[0]['extra_data']['count'] == 2
+    assert notifications[0]['extra_data']['reservation_ids'] == [2, 3]
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+import models
+from utils.outbox import (
+    ChannelAdapter,
+    OutboxDispatcher,
+    PermanentDeliveryError,
+    StubChannelAdapter,
+    retry_delay,
+)
+
+
+def outbox_rows():
+    conn = models.get_connection()
+    rows = conn.execute('SELECT channel, status, attempts, next_attempt_at, last_error '
+                        'FROM notification_outbox ORDER BY id').fetchall()
+    conn.close()
+    return [dict(zip(('channel', 'status', 'attempts', 'next_attempt_at', 'last_error'), r)) for r in rows]
+
+
+def make_due():
+    conn = models.get_connection()
+    conn.execute('UPDATE notification_outbox SET next_attempt_at = 0')
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def eta_expired(seeded):
+    """Notificación con canales externos: una entrega por email y otra por SMS."""
+    models.add_notification(1, 'No has llegado al parqueadero', 'eta_expired', reservation_id=1,
+                            extra_data={'parking_id': 1, 'eta_minutes': 10})
+
+
+def test_retry_delay_doubles_with_jitter_and_cap(monkeypatch):
+    monkeypatch.setattr('utils.outbox.random.uniform', lambda low, high: high)
+    assert [retry_delay(n, base=5, cap=60) for n in (1, 2, 3, 4, 5)] == [5, 10, 20, 40, 60]
+    monkeypatch.setattr('utils.outbox.random.uniform', lambda low, high: low)
+    assert retry_delay(3, base=5, cap=60) == 10
+
+
+def test_notification_writes_one_delivery_per_channel(eta_expired):
+    assert [(r['channel'], r['status']) for r in outbox_rows()] == [('email', 'pending'), ('sms', 'pending')]
+
+
+def test_failed_attempt_is_retried_after_backoff(eta_expired):
+    adapter = StubChannelAdapter(fail_first=1)
+    dispatcher = OutboxDispatcher(adapters={'email': adapter, 'sms': adapter}, base_backoff=5.0)
+    batch = models.claim_outbox_batch(10, 60)
+    assert [d['attempts'] for d in batch] == [1, 1]
+    before = time.time()
+    assert [dispatcher.deliver(d) for d in batch] == [False, False]
+    for row in outbox_rows():
+        assert row['status'] == 'pending'
+        assert row['last_error'].startswith('fallo simulado')
+        assert before + 2.5 <= row['next_attempt_at'] <= time.time() + 5.0
+    # Todavía no vencen
+    assert models.claim_outbox_batch(10, 60) == []
+    make_due()
+    batch = models.claim_outbox_batch(10, 60)
+    assert [dispatcher.deliver(d) for d in batch] == [True, True]
+    assert [r['status'] for r in outbox_rows()] == ['sent', 'sent']
+    assert len(adapter.sent) == 2
+    assert dispatcher.stats['retried'] == 2 and dispatcher.stats['sent'] == 2
+
+
+def test_gives_up_after_max_attempts(eta_expired):
+    dispatcher = OutboxDispatcher(adapters={'email': StubChannelAdapter(fail_first=10),
+                                            'sms': StubChannelAdapter(fail_first=10)}, max_attempts=2)
+    for _ in range(2):
+        for delivery in models.claim_outbox_batch(10, 60):
+            dispatcher.deliver(delivery)
+        make_due()
+    assert [(r['status'], r['attempts']) for r in outbox_rows()] == [('failed', 2), ('failed', 2)]
+    assert models.claim_outbox_batch(10, 60) == []
+
+
+def test_permanent_error_is_not_retried(eta_expired):
+    class NoEmail(ChannelAdapter):
+        def send(self, delivery):
+            raise PermanentDeliveryError('El usuario no tiene email')
+
+    dispatcher = OutboxDispatcher(adapters={'email': NoEmail()})  # sin adaptador de SMS
+    for delivery in models.claim_outbox_batch(10, 60):
+        dispatcher.deliver(delivery)
+    assert [(r['status'], r['attempts']) for r in outbox_rows()] == [('failed', 1), ('failed', 1)]
+    assert dispatcher.stats['failed'] == 2
+
+
+def test_claimed_delivery_is_retaken_when_its_lease_expires(eta_expired):
+    assert len(models.claim_outbox_batch(10, 60)) == 2
+    assert models.claim_outbox_batch(10, 60) == []
+    conn = models.get_connection()
+    conn.execute('UPDATE notification_outbox SET claimed_until = 0')
+    conn.commit()
+    conn.close()
+    assert [d['attempts'] for d in models.claim_outbox_batch(10, 60)] == [2, 2]
+
+
+def test_adapter_without_send_fails_at_construction():
+    class Incomplete(ChannelAdapter):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,50 @@
+from utils.pricing import PENALTY_AMOUNT, RATE_PER_MINUTE, price_reservation, timestamp_seconds
+
+OCCUPIED_SINCE = '2026-03-01 12:00:00'
+START = timestamp_seconds(OCCUPIED_SINCE)
+
+
+def test_timestamp_seconds_reads_naive_timestamps_as_utc():
+    assert timestamp_seconds('2026-03-01 12:00:00') == timestamp_seconds('2026-03-01T12:00:00+00:00')
+    assert timestamp_seconds(None) is None
+    assert timestamp_seconds('no es una fecha') is None
+
+
+def test_without_occupied_since_charges_the_planned_duration():
+    charge = price_reservation({'status': 'pending', 'duration_minutes': 30})
+    assert charge == {'elapsed_minutes': 30, 'subtotal': 30 * RATE_PER_MINUTE, 'penalty_amount': 0,
+                      'total': 30 * RATE_PER_MINUTE, 'rate_per_minute': RATE_PER_MINUTE}
+
+
+def test_every_started_minute_is_charged():
+    reservation = {'status': 'active', 'duration_minutes': 60, 'occupied_since': OCCUPIED_SINCE}
+    assert price_reservation(reservation, now=START)['elapsed_minutes'] == 0
+    assert price_reservation(reservation, now=START + 1)['elapsed_minutes'] == 1
+    assert price_reservation(reservation, now=START + 60)['elapsed_minutes'] == 1
+    charge = price_reservation(reservation, now=START + 5 * 60 + 30)
+    assert charge['elapsed_minutes'] == 6
+    assert charge['total'] == 6 * RATE_PER_MINUTE
+
+
+def test_penalty_per_completed_step_past_the_duration():
+    reservation = {'status': 'active', 'duration_minutes': 10, 'penalty_active': 1,
+                   'occupied_since': OCCUPIED_SINCE}
+    # 14 min: 4 de exceso, todavía sin un bloque completo
+    assert price_reservation(reservation, now=START + 14 * 60)['penalty_amount'] == 0
+    charge = price_reservation(reservation, now=START + 22 * 60)
+    assert charge['penalty_amount'] == 2 * PENALTY_AMOUNT
+    assert charge['total'] == 22 * RATE_PER_MINUTE + 2 * PENALTY_AMOUNT
+
+
+def test_no_penalty_unless_extra_time_was_rejected():
+    reservation = {'status': 'active', 'duration_minutes': 10, 'penalty_active': 0,
+                   'occupied_since': OCCUPIED_SINCE}
+    assert price_reservation(reservation, now=START + 60 * 60)['penalty_amount'] == 0
+
+
+def test_completed_reservation_keeps_the_stored_amounts():
+    reservation = {'status': 'completed', 'duration_minutes': 10, 'occupied_since': OCCUPIED_SINCE,
+                   'elapsed_minutes': 12, 'penalty_amount': 500, 'total_amount': 1700}
+    charge = price_reservation(reservation, now=START + 10 * 3600)
+    assert charge == {'elapsed_minutes': 12, 'subtotal': 1200, 'penalty_amount': 500, 'total': 1700,
+                      'rate_per_minute': RATE_PER_MINUTE}
@@ -0,0 +1,75 @@
+import pytest
+
+import models
+import scheduler
+
+
+@pytest.fixture
+def fences(seeded):
+    """(vieja, vigente): el lease del scheduler venció y lo tomó otro proceso."""
+    stale_token = models.acquire_lease(scheduler.LEASE_NAME, 'worker-a', 0)
+    current_token = models.acquire_lease(scheduler.LEASE_NAME, 'worker-b', 30)
+    assert current_token > stale_token
+    return (scheduler.LEASE_NAME, stale_token), (scheduler.LEASE_NAME, current_token)
+
+
+def count_notifications(type):
+    conn = models.get_connection()
+    count = conn.execute('SELECT COUNT(*) FROM notifications WHERE type = ?', (type,)).fetchone()[0]
+    conn.close()
+    return count
+
+
+def overdue_reservation(make_reservation):
+    reservation_id = make_reservation(1, 1, eta_minutes=5)
+    conn = models.get_connection()
+    conn.execute("UPDATE reservations SET created_at = datetime('now', '-6 minutes') WHERE id = ?",
+                 (reservation_id,))
+    conn.commit()
+    conn.close()
+    return reservation_id
+
+
+def test_lease_is_exclusive_while_held(seeded):
+    assert models.acquire_lease(scheduler.LEASE_NAME, 'worker-a', 30) is not None
+    assert models.acquire_lease(scheduler.LEASE_NAME, 'worker-b', 30) is None
+
+
+def test_duration_expiry_with_lost_lease_writes_nothing(fences, make_reservation):
+    stale, current = fences
+    reservation_id = make_reservation(1, 1, status='active')
+    models.add_notification(2, 'Tu parqueadero está ocupado', 'parking_occupied', reservation_id=reservation_id)
+    assert models.expire_reservation_duration(reservation_id, fence=stale) is False
+    assert count_notifications('parking_occupied') == 1
+    assert models.expire_reservation_duration(reservation_id, fence=current) is True
+    assert count_notifications('parking_occupied') == 0
+
+
+def test_eta_expiry_with_lost_lease_writes_nothing(fences, make_reservation):
+    stale, current = fences
+    reservation_id = overdue_reservation(make_reservation)
+    assert models.expire_reservation_eta(reservation_id, fence=stale) is False
+    assert count_notifications('eta_expired') == 0
+    assert models.expire_reservation_eta(reservation_id, fence=current) is True
+    assert count_notifications('eta_expired') == 1
+    # Una sola vez
+    assert models.expire_reservation_eta(reservation_id, fence=current) is False
+
+
+def test_sweep_with_lost_lease_is_fenced_out(fences, make_reservation):
+    stale, current = fences
+    overdue_reservation(make_reservation)
+    assert models.notify_expired_reservations(fence=stale) is None
+    assert count_notifications('eta_expired') == 0
+    result = models.notify_expired_reservations(fence=current)
+    assert result['eta']['acted'] == 1
+
+
+def test_scheduler_handlers_use_the_leader_fence(fences, make_reservation):
+    stale, _ = fences
+    reservation_id = make_reservation(1, 1, status='active')
+    models.add_notification(2, 'Tu parqueadero está ocupado', 'parking_occupied', reservation_id=reservation_id)
+    deadline_scheduler = scheduler.DeadlineScheduler()
+    deadline_scheduler.fence = stale
+    assert deadline_scheduler.handlers['duration'](reservation_id) is False
+    assert count_notifications('parking_occupied') == 1
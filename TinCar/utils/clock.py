@@ -0,0 +1,81 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+# Reloj del negocio: creación de reservas y notificaciones, occupied_since, vencimiento de
+# ETA y duración, cobros y plazos del scheduler. Lo que mide procesos (leases, reintentos
+# y latencias del outbox, métricas, caches) sigue con time.time()/time.monotonic().
+
+
+class SystemClock:
+    """Hora real."""
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """Hora simulada para pruebas y simulaciones: sólo avanza con advance()/sleep(), o
+    además `speed` segundos virtuales por cada segundo real si speed > 0."""
+
+    def __init__(self, start=None, speed=0.0):
+        self._lock = threading.Lock()
+        self._base = time.time() if start is None else float(start)
+        self._real_base = time.monotonic()
+        self.speed = speed
+
+    def time(self):
+        with self._lock:
+            return self._base + (time.monotonic() - self._real_base) * self.speed
+
+    def advance(self, seconds):
+        with self._lock:
+            self._base += seconds
+            return self._base + (time.monotonic() - self._real_base) * self.speed
+
+    def set(self, timestamp):
+        with self._lock:
+            self._base = float(timestamp)
+            self._real_base = time.monotonic()
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    return _clock
+
+
+def set_clock(clock):
+    """Instala el reloj del proceso (None vuelve a la hora real); devuelve el anterior."""
+    global _clock
+    previous, _clock = _clock, clock or SystemClock()
+    return previous
+
+
+def now():
+    """Segundos epoch según el reloj instalado."""
+    return _clock.time()
+
+
+def utcnow():
+    """datetime UTC con zona según el reloj instalado."""
+    return datetime.fromtimestamp(_clock.time(), timezone.utc)
+
+
+def db_timestamp(timestamp=None):
+    """Mismo formato que CURRENT_TIMESTAMP (UTC sin zona)."""
+    value = _clock.time() if timestamp is None else timestamp
+    return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def iso_timestamp(timestamp=None):
+    """ISO con zona UTC explícita (formato de occupied_since)."""
+    value = _clock.time() if timestamp is None else timestamp
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
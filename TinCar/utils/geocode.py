@@ -1,7 +1,13 @@
 import requests
 import sqlite3
 import os
-from models import get_connection
+import json
+import math
+import queue
+import threading
+import numpy as np
+from models import get_connection, get_parking, update_parking
+from utils.ranking import haversine_matrix, normalize_city
 
 
 def _ensure_cache_table(conn):
@@ -89,3 +95,218 @@ def geocode_location(department=None, city=None, address=None, country_hint=None
     except Exception:
         # No hacer fallar la operación si el servicio externo no está disponible
         return None, None
+
+
+# ============================================================
+# GEOCODIFICACIÓN INVERSA (coordenadas -> departamento/ciudad)
+# ============================================================
+
+# Tamaño de celda de la grilla del cache (~1.1 km en el ecuador). Puntos dentro de
+# la misma celda reutilizan una sola consulta.
+REVERSE_GRID_STEP_DEG = 0.01
+# Si la ciudad indicada por el arrendador queda a más de esta distancia de sus
+# coordenadas, se considera incorrecta y se reemplaza.
+REGION_MISMATCH_KM = 40.0
+
+_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'data')
+_centroids = None
+_reverse_memo = {}
+_reverse_queue = queue.Queue()
+_reverse_worker = None
+_reverse_worker_lock = threading.Lock()
+
+
+def _ensure_reverse_cache_table(conn):
+    c = conn.cursor()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reverse_geocode_cache (
+            cell TEXT PRIMARY KEY,
+            department TEXT,
+            city TEXT,
+            source TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def _grid_cell(lat, lon):
+    """Clave de la celda de la grilla que contiene (lat, lon)."""
+    return f"{int(math.floor(lat / REVERSE_GRID_STEP_DEG))}:{int(math.floor(lon / REVERSE_GRID_STEP_DEG))}"
+
+
+def _load_centroids():
+    """Carga (una vez) los centroides de las ciudades de colombia_locations.json.
+
+    colombia_locations.json define los pares departamento/ciudad válidos (los mismos
+    que muestran los formularios); colombia_city_centroids.json aporta las coordenadas.
+    Devuelve (departamentos, ciudades, lats, lons).
+    """
+    global _centroids
+    if _centroids is not None:
+        return _centroids
+    with open(os.path.join(_DATA_DIR, 'colombia_locations.json'), encoding='utf-8') as f:
+        locations = json.load(f)
+    with open(os.path.join(_DATA_DIR, 'colombia_city_centroids.json'), encoding='utf-8') as f:
+        coords = json.load(f)
+    departments, cities, lats, lons = [], [], [], []
+    seen = set()
+    for department, dep_cities in locations.items():
+        for city in dep_cities:
+            # Algunas ciudades aparecen en alias de departamento (p.ej. Guajira / La Guajira)
+            if city in seen or city not in coords:
+                continue
+            seen.add(city)
+            departments.append(department)
+            cities.append(city)
+            lats.append(coords[city][0])
+            lons.append(coords[city][1])
+    _centroids = (departments, cities, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+    return _centroids
+
+
+def nearest_city(lat, lon):
+    """Fallback offline: ciudad conocida cuyo centroide está más cerca de (lat, lon).
+
+    Devuelve (department, city, distancia_km).
+    """
+    departments, cities, c_lat, c_lon = _load_centroids()
+    dist = haversine_matrix([lat], [lon], c_lat, c_lon)[0]
+    i = int(np.argmin(dist))
+    return departments[i], cities[i], float(dist[i]) / 1000.0
+
+
+def _canonical_region(city):
+    """Busca la ciudad (sin distinguir tildes/mayúsculas) en colombia_locations.json."""
+    departments, cities, _, _ = _load_centroids()
+    key = normalize_city(city)
+    for department, known in zip(departments, cities):
+        if normalize_city(known) == key:
+            return department, known
+    return None
+
+
+def _nominatim_reverse(lat, lon, timeout=5):
+    """Consulta Nominatim /reverse y devuelve (department, city) o None."""
+    url = 'https://nominatim.openstreetmap.org/reverse'
+    params = {'lat': lat, 'lon': lon, 'format': 'json', 'zoom': 10, 'addressdetails': 1}
+    headers = {'User-Agent': 'TinCar/1.0 (contact: support@tincar.local)'}
+    resp = requests.get(url, params=params, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+    address = (resp.json() or {}).get('address') or {}
+    city = address.get('city') or address.get('town') or address.get('municipality') or address.get('village')
+    department = address.get('state')
+    if not city:
+        return None
+    canonical = _canonical_region(city)
+    if canonical:
+        return canonical
+    return department, city
+
+
+def reverse_geocode(lat, lon, timeout=5, use_network=True):
+    """
+    Obtiene (department, city) para unas coordenadas con un cache por celdas de grilla.
+
+    Orden: memoria del proceso -> tabla `reverse_geocode_cache` -> Nominatim ->
+    centroide más cercano de colombia_locations.json (offline). Siempre devuelve un
+    par (department, city); el resultado offline también se cachea.
+    """
+    lat = float(lat)
+    lon = float(lon)
+    cell = _grid_cell(lat, lon)
+    hit = _reverse_memo.get(cell)
+    if hit:
+        return hit
+
+    conn = None
+    try:
+        conn = get_connection()
+        _ensure_reverse_cache_table(conn)
+        cur = conn.cursor()
+        cur.execute('SELECT department, city FROM reverse_geocode_cache WHERE cell = ?', (cell,))
+        row = cur.fetchone()
+        if row and row[1]:
+            _reverse_memo[cell] = (row[0], row[1])
+            conn.close()
+            return row[0], row[1]
+    except Exception:
+        # No bloquear en caso de problemas con la DB cache
+        pass
+
+    # Geocodificar el centro de la celda para que el resultado valga para toda la celda
+    center_lat = (math.floor(lat / REVERSE_GRID_STEP_DEG) + 0.5) * REVERSE_GRID_STEP_DEG
+    center_lon = (math.floor(lon / REVERSE_GRID_STEP_DEG) + 0.5) * REVERSE_GRID_STEP_DEG
+    result, source = None, 'offline'
+    if use_network:
+        try:
+            result = _nominatim_reverse(center_lat, center_lon, timeout=timeout)
+            source = 'nominatim'
+        except Exception:
+            result = None
+    if not result:
+        department, city, _ = nearest_city(center_lat, center_lon)
+        result, source = (department, city), 'offline'
+
+    _reverse_memo[cell] = result
+    try:
+        conn = conn if conn is not None else get_connection()
+        _ensure_reverse_cache_table(conn)
+        conn.execute('INSERT OR REPLACE INTO reverse_geocode_cache (cell, department, city, source) VALUES (?, ?, ?, ?)',
+                     (cell, result[0], result[1], source))
+        conn.commit()
+    except Exception:
+        pass
+    finally:
+        if conn is not None:
+            conn.close()
+    return result
+
+
+def _region_needs_fill(lat, lon, department, city):
+    """True si department/city están vacíos, el departamento no es el de la ciudad o la
+    ciudad no corresponde a las coordenadas."""
+    if not department or not str(department).strip() or not city or not str(city).strip():
+        return True
+    canonical = _canonical_region(city)
+    if not canonical:
+        return False  # ciudad desconocida: respetar lo que escribió el arrendador
+    if normalize_city(department) != normalize_city(canonical[0]):
+        return True  # p.ej. "Medellín / Cundinamarca"
+    departments, cities, c_lat, c_lon = _load_centroids()
+    i = cities.index(canonical[1])
+    dist_km = haversine_matrix([lat], [lon], c_lat[i:i + 1], c_lon[i:i + 1])[0, 0] / 1000.0
+    return dist_km > REGION_MISMATCH_KM
+
+
+def fill_parking_region(parking_id):
+    """Completa department/city de un parqueadero a partir de sus coordenadas si hace falta."""
+    parking = get_parking(parking_id)
+    if not parking or parking.get('latitude') is None or parking.get('longitude') is None:
+        return False
+    lat, lon = float(parking['latitude']), float(parking['longitude'])
+    if not _region_needs_fill(lat, lon, parking.get('department'), parking.get('city')):
+        return False
+    department, city = reverse_geocode(lat, lon)
+    return update_parking(parking_id, department=department, city=city)
+
+
+def _reverse_worker_loop():
+    while True:
+        parking_id = _reverse_queue.get()
+        try:
+            fill_parking_region(parking_id)
+        except Exception as e:
+            print(f"[geocode] error completando región del parqueadero {parking_id}: {e}")
+        finally:
+            _reverse_queue.task_done()
+
+
+def fill_parking_region_async(parking_id):
+    """Encola el parqueadero para completar su región en segundo plano (no bloquea la petición)."""
+    global _reverse_worker
+    with _reverse_worker_lock:
+        if _reverse_worker is None or not _reverse_worker.is_alive():
+            _reverse_worker = threading.Thread(target=_reverse_worker_loop, daemon=True)
+            _reverse_worker.start()
+    _reverse_queue.put(parking_id)
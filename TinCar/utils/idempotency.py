@@ -0,0 +1,97 @@
+import hashlib
+import threading
+import time
+
+from models import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    abort_idempotency_key,
+)
+
+# Horas que se guarda la respuesta de cada Idempotency-Key.
+TTL_SECONDS = 24 * 3600
+# Lock de una petición en curso: si su worker muere, otra la toma pasado este tiempo.
+LOCK_SECONDS = 30.0
+# Espera máxima de un duplicado concurrente antes de responder 409.
+WAIT_TIMEOUT = 10.0
+# Sondeo de la DB mientras se espera a una petición de otro worker (no despierta a este).
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(method, path, body):
+    """Huella de la petición (16 bytes): la misma clave con otra petición es un error del cliente."""
+    digest = hashlib.sha256(method.encode() + b' ' + path.encode() + b'\n' + (body or b''))
+    return digest.digest()[:16]
+
+
+class IdempotencyStore:
+    """Ejecuta cada (usuario, Idempotency-Key) una sola vez y guarda su respuesta.
+
+    begin() reserva la clave o devuelve la respuesta ya guardada; un duplicado que llega
+    mientras la original está en curso espera a que termine (con un threading.Event si es
+    del mismo worker, sondeando la DB si es de otro) y recibe la misma respuesta.
+    """
+
+    def __init__(self, ttl=TTL_SECONDS, lock_seconds=LOCK_SECONDS, wait_timeout=WAIT_TIMEOUT):
+        self.ttl = ttl
+        self.lock_seconds = lock_seconds
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._events = {}  # (user_id, key) -> (claim_token, Event) de la petición en curso en este worker
+        self.stats = {'executed': 0, 'replayed': 0, 'waited': 0, 'conflicts': 0, 'timeouts': 0}
+
+    def begin(self, user_id, key, fingerprint):
+        """Devuelve ('acquired', claim_token), ('done', (status_code, body)), ('mismatch', None)
+        o ('in_flight', None) si la original no terminó en wait_timeout segundos. claim_token
+        se pasa a complete()/abort()."""
+        deadline = time.monotonic() + self.wait_timeout
+        interval = POLL_INTERVAL
+        waited = False
+        while True:
+            # Registrar el evento antes de consultar: un finish() posterior no se pierde
+            with self._lock:
+                event = self._events.get((user_id, key), (None, None))[1]
+            state, stored = claim_idempotency_key(user_id, key, fingerprint, self.lock_seconds)
+            if state == 'acquired':
+                with self._lock:
+                    self._events[(user_id, key)] = (stored, threading.Event())
+                self.stats['executed'] += 1
+                return state, stored
+            if state != 'in_flight':
+                self.stats['replayed' if state == 'done' else 'conflicts'] += 1
+                if waited:
+                    self.stats['waited'] += 1
+                return state, stored
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats['timeouts'] += 1
+                return state, None
+            waited = True
+            if event is not None:
+                event.wait(remaining)
+            else:
+                time.sleep(min(interval, remaining))
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def complete(self, user_id, key, claim_token, status_code, body):
+        complete_idempotency_key(user_id, key, claim_token, status_code, body, self.ttl)
+        self._wake(user_id, key, claim_token)
+
+    def abort(self, user_id, key, claim_token):
+        abort_idempotency_key(user_id, key, claim_token)
+        self._wake(user_id, key, claim_token)
+
+    def _wake(self, user_id, key, claim_token):
+        with self._lock:
+            current = self._events.get((user_id, key))
+            # Si el lock venció y otra petición tomó la clave, su evento no es nuestro
+            if current is None or current[0] != claim_token:
+                return
+            del self._events[(user_id, key)]
+        current[1].set()
+
+
+# Instancia del proceso (la usa el decorador idempotent de app.py)
+idempotency_store = IdempotencyStore()
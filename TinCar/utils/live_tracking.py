@@ -0,0 +1,239 @@
+import math
+import threading
+import time
+from collections import deque
+
+from models import get_reservation_statuses, get_tracking_target
+from utils.ranking import ROUTE_DETOUR_FACTOR, speed_for_city
+from utils.tracking import _distance_m
+
+# Máximo de posiciones por segundo enviadas por conductor (las intermedias se coalescen).
+MAX_UPDATES_PER_SECOND = 2
+# Tamaño de la cola de cada cliente; si el cliente es lento se descartan las más viejas.
+CLIENT_QUEUE_SIZE = 4
+# Segundos sin ack tras los cuales se da por perdido el mensaje en vuelo.
+ACK_TIMEOUT = 5.0
+# Cada cuántos segundos se verifica en la DB que las reservas seguidas sigan 'pending'.
+STATUS_CHECK_INTERVAL = 5.0
+# Máximo de reservas que puede seguir una misma conexión.
+MAX_SUBSCRIPTIONS_PER_CLIENT = 50
+
+
+class _Client:
+    """Estado acotado de una conexión: su cola drop-oldest y el mensaje en vuelo."""
+
+    __slots__ = ('queue', 'inflight_since', 'reservations', 'dropped')
+
+    def __init__(self, queue_size):
+        self.queue = deque(maxlen=queue_size)
+        self.inflight_since = None
+        self.reservations = set()
+        self.dropped = 0
+
+
+class TrackingHub:
+    """Reenvía la posición del conductor que se dirige a un parqueadero a las
+    conexiones SocketIO del arrendador.
+
+    - Coalescencia: por conductor sólo se guarda la última posición y se despacha
+      como máximo `max_rate` veces por segundo.
+    - Backpressure: cada cliente tiene una cola acotada (se descarta la más vieja)
+      y sólo un mensaje en vuelo; el siguiente sale cuando el cliente confirma (ack).
+    - Fin automático: cuando la reserva deja de estar 'pending' se envía
+      'tracking_ended' y se eliminan las suscripciones.
+    """
+
+    def __init__(self, emit, start_background_task, sleep=time.sleep, latest_position=None,
+                 max_rate=MAX_UPDATES_PER_SECOND, queue_size=CLIENT_QUEUE_SIZE):
+        self._emit = emit
+        self._latest_position = latest_position
+        self._start_background_task = start_background_task
+        self._sleep = sleep
+        self.interval = 1.0 / max_rate
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._clients = {}        # sid -> _Client
+        self._reservations = {}   # reservation_id -> {'driver_id', 'target', 'sids': set()}
+        self._by_driver = {}      # driver_id -> set(reservation_id)
+        self._pending = {}        # driver_id -> último fix aún no despachado
+        self._dispatcher = None
+        self._last_status_check = 0.0
+        self.stats = {'positions_in': 0, 'positions_coalesced': 0, 'messages_sent': 0, 'messages_dropped': 0}
+
+    # ---- suscripciones ----
+
+    def subscribe(self, sid, reservation_id, owner_id):
+        """Suscribe la conexión `sid` a la reserva si pertenece al arrendador y está 'pending'.
+        Si ya se conoce una posición del conductor se encola de inmediato. Devuelve (ok, error)."""
+        target = get_tracking_target(reservation_id, owner_id)
+        if not target:
+            return False, 'Reserva no encontrada o ya no está pendiente'
+        latest = self._latest_position(target['driver_id']) if self._latest_position else None
+        with self._lock:
+            client = self._clients.setdefault(sid, _Client(self.queue_size))
+            if reservation_id not in client.reservations and len(client.reservations) >= MAX_SUBSCRIPTIONS_PER_CLIENT:
+                return False, 'Demasiadas suscripciones'
+            entry = self._reservations.setdefault(reservation_id, {
+                'driver_id': target['driver_id'], 'target': target, 'sids': set()})
+            entry['sids'].add(sid)
+            client.reservations.add(reservation_id)
+            self._by_driver.setdefault(target['driver_id'], set()).add(reservation_id)
+            if latest is not None:
+                client.queue.append(('driver_position', self._position_payload(reservation_id, entry, latest)))
+        self._ensure_dispatcher()
+        return True, None
+
+    def unsubscribe(self, sid, reservation_id):
+        with self._lock:
+            self._remove_subscription(sid, reservation_id)
+
+    def disconnect(self, sid):
+        with self._lock:
+            client = self._clients.get(sid)
+            if not client:
+                return
+            for reservation_id in list(client.reservations):
+                self._remove_subscription(sid, reservation_id)
+            self._clients.pop(sid, None)
+
+    def _remove_subscription(self, sid, reservation_id):
+        client = self._clients.get(sid)
+        if client:
+            client.reservations.discard(reservation_id)
+        entry = self._reservations.get(reservation_id)
+        if not entry:
+            return
+        entry['sids'].discard(sid)
+        if not entry['sids']:
+            self._drop_reservation(reservation_id)
+
+    def _drop_reservation(self, reservation_id):
+        entry = self._reservations.pop(reservation_id, None)
+        if not entry:
+            return
+        driver_res = self._by_driver.get(entry['driver_id'])
+        if driver_res is not None:
+            driver_res.discard(reservation_id)
+            if not driver_res:
+                self._by_driver.pop(entry['driver_id'], None)
+                self._pending.pop(entry['driver_id'], None)
+
+    def end_reservation(self, reservation_id, status=None):
+        """Termina el seguimiento (la reserva salió de 'pending') y avisa a los suscriptores."""
+        with self._lock:
+            entry = self._reservations.get(reservation_id)
+            if not entry:
+                return
+            for sid in entry['sids']:
+                client = self._clients.get(sid)
+                if client:
+                    client.reservations.discard(reservation_id)
+                    self._enqueue(client, ('tracking_ended', {'reservation_id': reservation_id, 'status': status}))
+            self._drop_reservation(reservation_id)
+
+    # ---- entrada de posiciones ----
+
+    def on_location(self, driver_id, fix):
+        """Listener de LocationStore: guarda la última posición del conductor si alguien la sigue."""
+        with self._lock:
+            if driver_id not in self._by_driver:
+                return
+            self.stats['positions_in'] += 1
+            if driver_id in self._pending:
+                self.stats['positions_coalesced'] += 1
+            self._pending[driver_id] = fix
+
+    # ---- despacho ----
+
+    def _position_payload(self, reservation_id, entry, fix):
+        lat, lon, ts, accuracy = fix
+        target = entry['target']
+        distance = _distance_m(lat, lon, target['latitude'], target['longitude'])
+        speed_m_min = speed_for_city(target.get('city')) * 1000.0 / 60.0
+        return {
+            'reservation_id': reservation_id,
+            'lat': lat,
+            'lon': lon,
+            'ts': ts,
+            'accuracy': accuracy,
+            'distance_m': int(round(distance)),
+            'eta_minutes': int(math.ceil(distance * ROUTE_DETOUR_FACTOR / speed_m_min)),
+        }
+
+    def _enqueue(self, client, message):
+        if len(client.queue) == client.queue.maxlen:
+            client.dropped += 1
+            self.stats['messages_dropped'] += 1
+        client.queue.append(message)
+
+    def _ack(self, sid):
+        with self._lock:
+            client = self._clients.get(sid)
+            if client:
+                client.inflight_since = None
+        self._pump(sid)
+
+    def _pump(self, sid):
+        """Envía el siguiente mensaje de la cola del cliente si no tiene uno en vuelo."""
+        now = time.monotonic()
+        with self._lock:
+            client = self._clients.get(sid)
+            if not client or not client.queue:
+                return
+            if client.inflight_since is not None and now - client.inflight_since < ACK_TIMEOUT:
+                return
+            event, payload = client.queue.popleft()
+            client.inflight_since = now
+            self.stats['messages_sent'] += 1
+        self._emit(event, payload, to=sid, callback=lambda *args: self._ack(sid))
+        if event == 'tracking_ended':
+            with self._lock:
+                client = self._clients.get(sid)
+                if client and not client.reservations and not client.queue:
+                    self._clients.pop(sid, None)
+
+    def dispatch_once(self):
+        """Un ciclo del despachador: reparte las posiciones coalescidas y vacía colas."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            for driver_id, fix in pending.items():
+                for reservation_id in self._by_driver.get(driver_id, ()):
+                    entry = self._reservations[reservation_id]
+                    payload = self._position_payload(reservation_id, entry, fix)
+                    for sid in entry['sids']:
+                        client = self._clients.get(sid)
+                        if client:
+                            self._enqueue(client, ('driver_position', payload))
+            sids = [sid for sid, c in self._clients.items() if c.queue]
+        for sid in sids:
+            self._pump(sid)
+
+    def check_statuses(self):
+        """Termina las suscripciones cuyas reservas ya no están 'pending' (p.ej. expiradas
+        o canceladas por otro camino)."""
+        with self._lock:
+            ids = list(self._reservations)
+        if not ids:
+            return
+        statuses = get_reservation_statuses(ids)
+        for reservation_id in ids:
+            status = statuses.get(reservation_id)
+            if status != 'pending':
+                self.end_reservation(reservation_id, status)
+
+    def _run(self):
+        while True:
+            self._sleep(self.interval)
+            try:
+                self.dispatch_once()
+                now = time.monotonic()
+                if now - self._last_status_check >= STATUS_CHECK_INTERVAL:
+                    self._last_status_check = now
+                    self.check_statuses()
+            except Exception as e:
+                print(f"[live_tracking] error en el despachador: {e}")
+
+    def _ensure_dispatcher(self):
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = self._start_background_task(self._run)
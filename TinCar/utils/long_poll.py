@@ -0,0 +1,80 @@
+import threading
+import time
+
+# Máximo de peticiones de long-poll esperando a la vez en un worker.
+MAX_WAITERS = 1000
+# Tiempo máximo (s) que el cliente puede pedir esperar; muy por debajo del timeout de
+# los workers de gunicorn (gunicorn.conf.py).
+MAX_TIMEOUT = 20.0
+# Cada cuántos segundos se vuelve a consultar la DB mientras se espera (cubre
+# notificaciones creadas por otro worker, que no despiertan a este proceso).
+RECHECK_INTERVAL = 5.0
+
+
+class NotificationWaiters:
+    """Peticiones de long-poll estacionadas por usuario.
+
+    Cada usuario con peticiones esperando tiene un threading.Event; notify(user_id)
+    lo activa y lo reemplaza. Con un worker cooperativo (gevent/eventlet con
+    monkey-patching) cada espera es una green thread, así que miles de peticiones
+    esperando cuestan poco; `max_waiters` limita cuántas se aceptan a la vez.
+    """
+
+    def __init__(self, max_waiters=MAX_WAITERS, recheck_interval=RECHECK_INTERVAL):
+        self.max_waiters = max_waiters
+        self.recheck_interval = recheck_interval
+        self._lock = threading.Lock()
+        self._events = {}    # user_id -> Event de la espera actual
+        self._waiting = {}   # user_id -> peticiones esperando
+        self._active = 0
+        self.stats = {'waits': 0, 'rejected': 0, 'woken': 0, 'timeouts': 0}
+
+    def notify(self, user_id):
+        """Despierta a las peticiones que esperan notificaciones de user_id."""
+        with self._lock:
+            event = self._events.pop(user_id, None)
+        if event is not None:
+            event.set()
+
+    def wait(self, user_id, timeout, fetch):
+        """Espera hasta `timeout` segundos a que fetch() devuelva algo no vacío.
+
+        fetch se llama al empezar, al ser despertado y cada recheck_interval. Devuelve
+        su último resultado (vacío si se agotó el tiempo) o None si ya hay demasiadas
+        peticiones esperando.
+        """
+        with self._lock:
+            if self._active >= self.max_waiters:
+                self.stats['rejected'] += 1
+                return None
+            self._active += 1
+            self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+            self.stats['waits'] += 1
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                # Registrar el evento antes de consultar: un notify posterior no se pierde
+                with self._lock:
+                    event = self._events.setdefault(user_id, threading.Event())
+                result = fetch()
+                if result:
+                    return result
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                    return result
+                if event.wait(min(remaining, self.recheck_interval)):
+                    with self._lock:
+                        self.stats['woken'] += 1
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._waiting[user_id] -= 1
+                if not self._waiting[user_id]:
+                    del self._waiting[user_id]
+                    self._events.pop(user_id, None)
+
+
+# Instancia del proceso (cada worker de gunicorn tiene la suya)
+notification_waiters = NotificationWaiters()
@@ -0,0 +1,64 @@
+import json
+import os
+
+# Gracia tras vencer el ETA antes de cancelar una reserva pendiente y liberar el
+# parqueadero: GRACE_MINUTES fijos más ETA_RATIO del ETA (los trayectos largos se atrasan
+# más), como mucho MAX_GRACE_MINUTES.
+GRACE_MINUTES = 10
+ETA_RATIO = 0.5
+MAX_GRACE_MINUTES = 30
+# Espera máxima que el arrendador agrega en cada prórroga (/api/reservations/<id>/hold).
+MAX_HOLD_MINUTES = 60
+
+
+class GracePolicy:
+    """Cuándo se libera una reserva pendiente cuyo conductor no llegó.
+
+    TINCAR_NO_SHOW_POLICY (JSON {grace_minutes, eta_ratio, max_grace_minutes}) sobrescribe
+    los valores por defecto; grace_minutes null desactiva la liberación automática. Una
+    prórroga del arrendador (hold_until de la reserva) reemplaza el plazo calculado.
+    """
+
+    def __init__(self, grace_minutes=GRACE_MINUTES, eta_ratio=ETA_RATIO, max_grace_minutes=MAX_GRACE_MINUTES):
+        self.grace_minutes = grace_minutes
+        self.eta_ratio = eta_ratio
+        self.max_grace_minutes = max_grace_minutes
+
+    @classmethod
+    def from_env(cls):
+        policy = cls()
+        overrides = os.environ.get('TINCAR_NO_SHOW_POLICY')
+        if overrides:
+            try:
+                for key, value in json.loads(overrides).items():
+                    if key in ('grace_minutes', 'eta_ratio', 'max_grace_minutes'):
+                        setattr(policy, key, value)
+            except (ValueError, AttributeError) as e:
+                print(f"[no_show] TINCAR_NO_SHOW_POLICY inválido, se ignora: {e}")
+        return policy
+
+    @property
+    def enabled(self):
+        return self.grace_minutes is not None
+
+    def grace_for(self, eta_minutes):
+        """Minutos de gracia para una reserva con ese ETA."""
+        return min(self.max_grace_minutes, self.grace_minutes + self.eta_ratio * (eta_minutes or 0))
+
+    def release_at(self, created, eta_minutes, hold_until=None):
+        """Instante (epoch) en que se libera la reserva, o None si la política está
+        desactivada. created y hold_until en segundos epoch."""
+        if not self.enabled or created is None or eta_minutes is None:
+            return None
+        if hold_until is not None:
+            return hold_until
+        return created + (int(eta_minutes) + self.grace_for(int(eta_minutes))) * 60
+
+    def release_sql(self, created_sql, eta_sql, hold_sql):
+        """Mismo plazo que release_at como expresión SQL (epoch) y sus parámetros."""
+        return (f'COALESCE({hold_sql}, {created_sql} + ({eta_sql} + MIN(?, ? + ? * {eta_sql})) * 60)',
+                [self.max_grace_minutes, self.grace_minutes, self.eta_ratio])
+
+
+# Política del proceso (la usan models y el scheduler)
+no_show_policy = GracePolicy.from_env()
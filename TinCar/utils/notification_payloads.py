@@ -0,0 +1,142 @@
+import json
+
+_INT = (int,)
+_NUM = (int, float)
+_STR = (str,)
+_LIST = (list,)
+
+# Campos permitidos en extra_data según el tipo de notificación. Todos son opcionales
+# (pueden faltar o ser None); los tipos que no aparecen aquí no llevan extra_data.
+PAYLOAD_SCHEMAS = {
+    'new_reservation': {'driver_id': _INT, 'driver_name': _STR, 'parking_name': _STR},
+    'active_reservation': {'parking_name': _STR, 'duration': _INT},
+    'reservation_cancelled': {'cancelled_by': _STR, 'driver_id': _INT, 'parking_name': _STR},
+    'reservation_completed': {'completed_by': _STR, 'driver_id': _INT, 'parking_name': _STR,
+                              'elapsed_minutes': _NUM, 'amount': _NUM},
+    'driver_arrived': {'driver_id': _INT, 'driver_name': _STR, 'duration_minutes': _INT,
+                       'occupied_since': _STR},
+    'vehicle_parked': {'parking_name': _STR, 'duration_minutes': _INT, 'occupied_since': _STR},
+    'eta_expired': {'parking_name': _STR, 'parking_id': _INT, 'eta_minutes': _INT},
+    'reservation_expired': {'driver_id': _INT, 'driver_name': _STR, 'parking_name': _STR},
+    'extra_time_request': {'extra_minutes': _INT, 'driver_id': _INT},
+    'extra_time_approved': {'extra_minutes': _INT, 'owner_name': _STR},
+    'extra_time_rejected': {'owner_name': _STR},
+    'at_vehicle': {'driver_id': _INT},
+    # Agrupa varias notificaciones de digest_type (ver DIGEST_WINDOW_SECONDS); replaces son
+    # los ids que esta entrada reemplaza en el buzón del cliente
+    'digest': {'digest_type': _STR, 'count': _INT, 'reservation_ids': _LIST, 'replaces': _LIST,
+               'window_start': _STR},
+}
+
+# Tipos que se agrupan por usuario: desde la segunda notificación del mismo tipo dentro de
+# la ventana (segundos desde la primera) el buzón muestra una sola entrada 'digest'.
+DIGEST_WINDOW_SECONDS = {
+    'new_reservation': 15 * 60,
+    'driver_arrived': 15 * 60,
+    'reservation_completed': 15 * 60,
+}
+
+_DIGEST_MESSAGES = {
+    'new_reservation': '{count} nuevas reservas en tus parqueaderos.',
+    'driver_arrived': '{count} vehículos guardados en tus parqueaderos.',
+    'reservation_completed': '{count} reservas finalizadas.',
+}
+
+# Codificación compacta usada para los fragmentos guardados y la respuesta.
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+
+_INVALID = object()
+
+
+def _coerce(value, allowed):
+    """Valor ajustado al tipo permitido o _INVALID. Los float enteros (10.0) pasan como int."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return _INVALID
+    if isinstance(value, allowed):
+        return value
+    if allowed is _INT and isinstance(value, float) and value.is_integer():
+        return int(value)
+    return _INVALID
+
+
+def _check_payload(type, extra_data, strict):
+    if extra_data is None or extra_data == '' or extra_data == {}:
+        return None
+    if isinstance(extra_data, str):
+        extra_data = json.loads(extra_data)
+    if not isinstance(extra_data, dict):
+        raise ValueError(f'extra_data de {type} debe ser un objeto')
+    schema = PAYLOAD_SCHEMAS.get(type)
+    if schema is None:
+        raise ValueError(f'Las notificaciones {type} no llevan extra_data')
+    clean = {}
+    for key, value in extra_data.items():
+        allowed = schema.get(key)
+        if allowed is None:
+            error = f'Campo {key!r} no permitido en extra_data de {type}'
+        else:
+            value = _coerce(value, allowed)
+            if value is not _INVALID:
+                clean[key] = value
+                continue
+            error = f'Campo {key!r} de {type} debe ser {"/".join(t.__name__ for t in allowed)}'
+        if strict:
+            raise ValueError(error)
+        print(f"[notifications] descartado: {error}")
+    return clean or None
+
+
+def validate_payload(type, extra_data):
+    """Valida extra_data contra el esquema de `type` y lo devuelve como dict (o None).
+    Acepta un dict o un string JSON (llamadores antiguos). Lanza ValueError si hay
+    campos desconocidos o de tipo incorrecto."""
+    return _check_payload(type, extra_data, strict=True)
+
+
+def sanitize_payload(type, extra_data):
+    """Como validate_payload, pero para el camino de escritura: cuando se llama, el cambio
+    de negocio ya está guardado, así que los campos desconocidos o de tipo incorrecto se
+    registran y se descartan en lugar de lanzar (la notificación se entrega igual)."""
+    try:
+        return _check_payload(type, extra_data, strict=False)
+    except ValueError as e:
+        print(f"[notifications] extra_data descartado: {e}")
+        return None
+
+
+def digest_message(digest_type, count):
+    return _DIGEST_MESSAGES.get(digest_type, '{count} notificaciones nuevas.').format(count=count)
+
+
+def encode_payload(extra_data):
+    """Serialización de extra_data guardada en la columna extra_data."""
+    return None if extra_data is None else _encode(extra_data)
+
+
+def render_fragment(message, type, created_at, reservation_id, owner_id, eta, extra_data):
+    """Campos inmutables de una notificación ya codificados como miembros de un objeto JSON
+    (sin llaves): '"message":...,"extra_data":{...}'. id y status se agregan al leer."""
+    return _encode({
+        'message': message,
+        'type': type,
+        'created_at': created_at,
+        'reservation_id': reservation_id,
+        'owner_id': owner_id,
+        'eta': eta,
+        'extra_data': extra_data,
+    })[1:-1]
+
+
+def notification_json(notification_id, status, fragment):
+    """Objeto JSON completo de una notificación a partir de su fragmento guardado."""
+    return f'{{"id":{int(notification_id)},"status":{_encode(status)},{fragment}}}'
+
+
+def splice_json(list_key, items_json, **fields):
+    """Respuesta JSON con `list_key` armado a partir de objetos ya codificados y el resto
+    de campos serializados normalmente."""
+    rest = _encode(fields)
+    return f'{{"{list_key}":[{",".join(items_json)}]' + (',' + rest[1:] if fields else '}')
@@ -0,0 +1,122 @@
+import json
+import os
+import threading
+import time
+
+from models import (
+    purge_cleared_notifications,
+    delete_superseded_notifications,
+    delete_expired_notifications,
+    delete_overflow_notifications,
+)
+
+# Días que se conserva cada tipo de notificación. Los avisos transitorios del ciclo de
+# vida de la reserva duran poco; los cierres quedan como historial. Las notificaciones de
+# reservas aún en curso no vencen ni cuentan para el recorte (ver models).
+DEFAULT_TTL_DAYS = {
+    'at_vehicle': 1,
+    'driver_arrived': 1,
+    'active_reservation': 1,
+    'eta_expired': 2,
+    'extra_time_request': 2,
+    'new_reservation': 7,
+    'vehicle_parked': 7,
+    'extra_time_approved': 7,
+    'extra_time_rejected': 7,
+    'reservation_expired': 30,
+    'reservation_cancelled': 30,
+    'reservation_completed': 30,
+    'digest': 7,
+    'verification_approved': 90,
+    'verification_rejected': 90,
+}
+# TTL de los tipos no listados.
+FALLBACK_TTL_DAYS = 14
+# Máximo de notificaciones que se conservan por usuario (las más nuevas).
+MAX_PER_USER = 200
+# Tamaño de cada lote de borrado y lotes máximos por pasada (acota el lock de escritura).
+BATCH_SIZE = 500
+MAX_BATCHES_PER_RUN = 40
+
+
+class RetentionPolicy:
+    """TTL por tipo y tope por usuario. TINCAR_NOTIFICATION_TTLS (JSON {tipo: días o null})
+    sobrescribe los TTL por defecto; null conserva el tipo indefinidamente."""
+
+    def __init__(self, ttl_days=None, fallback_ttl_days=FALLBACK_TTL_DAYS, max_per_user=MAX_PER_USER):
+        self.ttl_days = dict(DEFAULT_TTL_DAYS if ttl_days is None else ttl_days)
+        self.fallback_ttl_days = fallback_ttl_days
+        self.max_per_user = max_per_user
+
+    @classmethod
+    def from_env(cls):
+        policy = cls()
+        overrides = os.environ.get('TINCAR_NOTIFICATION_TTLS')
+        if overrides:
+            try:
+                policy.ttl_days.update(json.loads(overrides))
+            except ValueError as e:
+                print(f"[retention] TINCAR_NOTIFICATION_TTLS inválido, se ignora: {e}")
+        return policy
+
+
+class RetentionEngine:
+    """Aplica la política en pasadas acotadas: primero lo ya ocultado por el usuario, luego
+    lo reemplazado por una notificación más nueva de la misma reserva, lo vencido por TTL y
+    por último el exceso por usuario. Cada pasada usa como mucho max_batches lotes en total;
+    si queda trabajo pendiente la siguiente pasada continúa."""
+
+    PHASES = ('cleared', 'superseded', 'expired', 'overflow')
+
+    def __init__(self, policy=None, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES_PER_RUN):
+        self.policy = policy or RetentionPolicy.from_env()
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self._lock = threading.Lock()
+        self.stats = {'runs': 0, 'batches': 0, 'pending_runs': 0, 'last_run': None}
+        self.stats.update({phase: 0 for phase in self.PHASES})
+
+    def _phase(self, name, budget):
+        policy = self.policy
+        if name == 'cleared':
+            # purge_cleared_notifications no informa lotes; se estiman por filas
+            deleted = purge_cleared_notifications(self.batch_size, budget)
+            batches = -(-deleted // self.batch_size)
+            return deleted, batches, set(), batches >= budget
+        if name == 'superseded':
+            return delete_superseded_notifications(self.batch_size, budget)
+        if name == 'expired':
+            return delete_expired_notifications(policy.ttl_days, policy.fallback_ttl_days,
+                                                self.batch_size, budget)
+        if policy.max_per_user is None:
+            return 0, 0, set(), False
+        return delete_overflow_notifications(policy.max_per_user, self.batch_size, budget)
+
+    def run_once(self):
+        """Ejecuta una pasada y devuelve sus métricas."""
+        with self._lock:
+            started = time.monotonic()
+            progress = {'deleted': {}, 'batches': 0, 'users': 0, 'pending': False}
+            users = set()
+            for name in self.PHASES:
+                budget = self.max_batches - progress['batches']
+                if budget <= 0:
+                    progress['pending'] = True
+                    break
+                deleted, batches, affected, pending = self._phase(name, budget)
+                progress['deleted'][name] = deleted
+                progress['batches'] += batches
+                progress['pending'] = progress['pending'] or pending
+                users |= affected
+                self.stats[name] += deleted
+            progress['users'] = len(users)
+            progress['duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+            self.stats['runs'] += 1
+            self.stats['batches'] += progress['batches']
+            self.stats['pending_runs'] += int(progress['pending'])
+            self.stats['last_run'] = progress
+            return progress
+
+
+# Instancia del proceso (la usa el worker periódico de app.py)
+notification_retention = RetentionEngine()
@@ -0,0 +1,228 @@
+import json
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from email.message import EmailMessage
+
+from models import (
+    BASE_DIR,
+    claim_outbox_batch,
+    complete_outbox_delivery,
+    fail_outbox_delivery,
+)
+
+# Hilos que envían en paralelo y entregas que se reservan por consulta.
+WORKERS = 4
+BATCH_SIZE = 20
+# Segundos que una entrega reservada queda bloqueada para otros procesos mientras se envía.
+LEASE_SECONDS = 60
+# Espera entre consultas cuando no hay trabajo (wake() la interrumpe).
+POLL_INTERVAL = 5.0
+# Reintentos: backoff exponencial desde BASE_BACKOFF con jitter, hasta MAX_ATTEMPTS intentos.
+MAX_ATTEMPTS = 6
+BASE_BACKOFF = 5.0
+MAX_BACKOFF = 3600.0
+
+
+class PermanentDeliveryError(Exception):
+    """Error que no se arregla reintentando (p.ej. el usuario no tiene email)."""
+
+
+class ChannelAdapter(ABC):
+    """Envía una entrega por un canal. send() lanza una excepción si falla;
+    PermanentDeliveryError marca la entrega como fallida sin reintentos. Un adaptador
+    sin send() falla al construirse (TypeError), no en la primera entrega."""
+
+    @abstractmethod
+    def send(self, delivery):
+        ...
+
+
+class FileChannelAdapter(ChannelAdapter):
+    """Escribe cada entrega como una línea JSON en un archivo (desarrollo y pruebas)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, delivery):
+        line = json.dumps({
+            'channel': delivery['channel'],
+            'to': delivery['recipient'],
+            'notification_id': delivery['notification_id'],
+            'payload': delivery['payload'],
+            'sent_at': time.time(),
+        }, ensure_ascii=False)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as fh:
+            fh.write(line + '\n')
+
+
+class StubChannelAdapter(ChannelAdapter):
+    """Guarda las entregas en memoria; `fail_first` hace fallar los primeros intentos
+    de cada entrega y `delay` simula la latencia del proveedor."""
+
+    def __init__(self, fail_first=0, delay=0.0):
+        self.fail_first = fail_first
+        self.delay = delay
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, delivery):
+        if self.delay:
+            time.sleep(self.delay)
+        if delivery['attempts'] <= self.fail_first:
+            raise RuntimeError(f"fallo simulado (intento {delivery['attempts']})")
+        with self._lock:
+            self.sent.append(delivery)
+
+
+class SmtpEmailAdapter(ChannelAdapter):
+    """Email por SMTP (TINCAR_SMTP_HOST, TINCAR_SMTP_PORT, TINCAR_SMTP_USER,
+    TINCAR_SMTP_PASSWORD, TINCAR_SMTP_FROM)."""
+
+    def __init__(self, host, port=587, user=None, password=None, sender='no-reply@tincar.co'):
+        self.host, self.port, self.user, self.password, self.sender = host, port, user, password, sender
+
+    def send(self, delivery):
+        address = delivery['recipient'].get('email')
+        if not address:
+            raise PermanentDeliveryError('El usuario no tiene email')
+        msg = EmailMessage()
+        msg['From'] = self.sender
+        msg['To'] = address
+        msg['Subject'] = 'TinCar'
+        msg.set_content(delivery['payload']['message'])
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.starttls()
+            if self.user:
+                smtp.login(self.user, self.password)
+            smtp.send_message(msg)
+
+
+def default_adapters():
+    """Email por SMTP si está configurado; el resto de canales (y email sin SMTP) se
+    escriben en database/outbox-<canal>.log."""
+    directory = os.path.join(BASE_DIR, 'database')
+    adapters = {channel: FileChannelAdapter(os.path.join(directory, f'outbox-{channel}.log'))
+                for channel in ('email', 'sms', 'push')}
+    host = os.environ.get('TINCAR_SMTP_HOST')
+    if host:
+        adapters['email'] = SmtpEmailAdapter(
+            host, int(os.environ.get('TINCAR_SMTP_PORT', 587)), os.environ.get('TINCAR_SMTP_USER'),
+            os.environ.get('TINCAR_SMTP_PASSWORD'), os.environ.get('TINCAR_SMTP_FROM', 'no-reply@tincar.co'))
+    return adapters
+
+
+def retry_delay(attempts, base=BASE_BACKOFF, cap=MAX_BACKOFF):
+    """Segundos hasta el próximo intento tras `attempts` intentos fallidos (con jitter)."""
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxDispatcher:
+    """Consume notification_outbox fuera de las peticiones: un hilo reserva lotes de
+    entregas vencidas y un pool de workers las envía por el adaptador de su canal.
+
+    Latencias registradas por entrega: 'delivery' (desde que se escribió la notificación
+    hasta que el canal aceptó el envío) y 'send' (sólo la llamada al adaptador).
+    """
+
+    def __init__(self, adapters=None, workers=WORKERS, batch_size=BATCH_SIZE, lease_seconds=LEASE_SECONDS,
+                 poll_interval=POLL_INTERVAL, max_attempts=MAX_ATTEMPTS, base_backoff=BASE_BACKOFF):
+        self.adapters = adapters if adapters is not None else default_adapters()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self._queue = queue.Queue(maxsize=workers * 2)
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self.latencies = {'delivery': deque(maxlen=1000), 'send': deque(maxlen=1000)}
+        self.stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._claim_loop, daemon=True).start()
+        for _ in range(self.workers):
+            threading.Thread(target=self._work_loop, daemon=True).start()
+
+    def wake(self):
+        """Hay entregas nuevas: no esperar al siguiente poll."""
+        self._wake.set()
+
+    def _claim_loop(self):
+        while True:
+            try:
+                batch = claim_outbox_batch(self.batch_size, self.lease_seconds)
+            except Exception as e:
+                print(f"[outbox] error reservando entregas: {e}")
+                batch = []
+            for delivery in batch:
+                self._queue.put(delivery)  # bloquea si los workers van atrasados
+            with self._lock:
+                self.stats['claimed'] += len(batch)
+            if len(batch) < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _work_loop(self):
+        while True:
+            self.deliver(self._queue.get())
+
+    def deliver(self, delivery):
+        """Envía una entrega ya reservada y registra el resultado."""
+        adapter = self.adapters.get(delivery['channel'])
+        started = time.time()
+        try:
+            if adapter is None:
+                raise PermanentDeliveryError(f"Canal sin adaptador: {delivery['channel']}")
+            adapter.send(delivery)
+        except Exception as e:
+            permanent = isinstance(e, PermanentDeliveryError) or delivery['attempts'] >= self.max_attempts
+            retry_at = None if permanent else time.time() + retry_delay(delivery['attempts'], self.base_backoff)
+            try:
+                fail_outbox_delivery(delivery['id'], e, retry_at)
+            except Exception as db_error:
+                # El lease vence y otra pasada la reintenta
+                print(f"[outbox] error registrando fallo de {delivery['id']}: {db_error}")
+            with self._lock:
+                self.stats['failed' if permanent else 'retried'] += 1
+            return False
+        finished = time.time()
+        delivery_ms = (finished - delivery['created_at']) * 1000
+        try:
+            complete_outbox_delivery(delivery['id'], round(delivery_ms, 1))
+        except Exception as db_error:
+            print(f"[outbox] error registrando envío de {delivery['id']}: {db_error}")
+        with self._lock:
+            self.stats['sent'] += 1
+            self.latencies['delivery'].append(delivery_ms)
+            self.latencies['send'].append((finished - started) * 1000)
+        return True
+
+    def latency_summary(self):
+        """p50/p95/máx (ms) de las últimas entregas exitosas."""
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self.latencies.items()}
+        summary = {}
+        for name, values in samples.items():
+            if values:
+                summary[name] = {'p50': round(values[len(values) // 2], 1),
+                                 'p95': round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+                                 'max': round(values[-1], 1), 'n': len(values)}
+        return summary
+
+
+# Instancia del proceso (se arranca junto con los workers de fondo de app.py)
+outbox_dispatcher = OutboxDispatcher()
@@ -0,0 +1,206 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+import models
+from models import get_parking_snapshot_rows
+from utils.ranking import EARTH_RADIUS_M, haversine_matrix
+from utils.spatial import GRID_CELL_DEG, GridIndex, cell_keys
+
+# Cada escritura de un parqueadero (publish_change('parking_updated'), ver app.py y
+# scheduler.main) lo republica en segundo plano. Esta edad es sólo el respaldo para
+# cambios hechos por otros caminos: pasados estos segundos, un worker que lee el snapshot
+# pide republicarlo y mientras tanto sigue sirviendo la versión anterior.
+SNAPSHOT_MAX_AGE = 60.0
+# Bits de la columna flags
+FLAG_ACTIVE = 1
+
+_MAGIC = b'TCPS'
+_FORMAT_VERSION = 1
+# magic, formato, versión de datos, filas, tamaño de celda, publicado (epoch)
+_HEADER = struct.Struct('<4sIQQdd')
+_HEADER_SIZE = 64
+
+
+def snapshot_path():
+    """Ruta del archivo de snapshot, junto a la base de datos."""
+    return os.path.join(os.path.dirname(models.DB_PATH), 'parkings.snapshot')
+
+
+class ParkingSnapshot:
+    """Vista de sólo lectura, mapeada en memoria, de las coordenadas de los parqueaderos.
+
+    Columnas (ordenadas por celda de grilla): ids, keys, lats, lons, flags. Todos los
+    workers que mapean el mismo archivo comparten las páginas del page cache, así que
+    la memoria no crece con el número de workers.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        magic, fmt, self.version, n, self.cell_deg, self.published_at = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or fmt != _FORMAT_VERSION:
+            raise ValueError('Snapshot de parqueaderos con formato desconocido')
+        offset = _HEADER_SIZE
+        columns = []
+        for dtype in (np.int64, np.int64, np.float64, np.float64, np.uint8):
+            columns.append(np.frombuffer(self._mm, dtype=dtype, count=n, offset=offset))
+            offset += n * np.dtype(dtype).itemsize
+        self.ids, self.keys, self.lats, self.lons, self.flags = columns
+        # flags sólo usa el bit FLAG_ACTIVE (0/1), así que se puede ver como bool sin copiar
+        self.active = self.flags.view(np.bool_)
+        self.index = GridIndex.from_sorted(self.ids, self.lats, self.lons, self.keys, self.cell_deg, self.active)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, active_only=True):
+        """Posiciones de los parqueaderos dentro del bbox."""
+        pos = self.index.query_bbox(min_lat, min_lon, max_lat, max_lon)
+        lat, lon = self.lats[pos], self.lons[pos]
+        mask = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        if active_only:
+            mask &= self.active[pos]
+        return pos[mask]
+
+    def nearby(self, lat, lon, radius_m, active_only=True):
+        """(posiciones, distancia_m) de los parqueaderos a menos de radius_m en línea recta,
+        ordenados por distancia."""
+        # Bbox exacto del casquete esférico con el mismo radio que haversine_matrix
+        angle = radius_m / EARTH_RADIUS_M
+        pad_lat = np.degrees(angle)
+        cos_lat = np.cos(np.radians(lat))
+        pad_lon = 180.0 if cos_lat <= np.sin(angle) else np.degrees(np.arcsin(np.sin(angle) / cos_lat))
+        pos = self.bbox(lat - pad_lat, lon - pad_lon, lat + pad_lat, lon + pad_lon, active_only)
+        if not len(pos):
+            return pos, np.empty(0)
+        dist = haversine_matrix(np.array([lat]), np.array([lon]), self.lats[pos], self.lons[pos])[0]
+        keep = dist <= radius_m
+        pos, dist = pos[keep], dist[keep]
+        order = np.argsort(dist, kind='stable')
+        return pos[order], dist[order]
+
+
+class _FileLock:
+    """Bloqueo exclusivo entre procesos sobre un archivo .lock (no-op sin fcntl)."""
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        self._f = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        self._f = open(self.path, 'a')
+        try:
+            fcntl.flock(self._f, fcntl.LOCK_EX | (0 if self.blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            self._f.close()  # libera el flock
+            self._f = None
+
+
+def _current_version(path):
+    try:
+        with open(path, 'rb') as f:
+            magic, fmt, version = _HEADER.unpack(f.read(_HEADER.size))[:3]
+        return version if magic == _MAGIC else 0
+    except (OSError, struct.error):
+        return 0
+
+
+def publish_parking_snapshot(blocking=True):
+    """Lee los parqueaderos con coordenadas de la DB y publica una nueva versión del snapshot.
+
+    Se escribe a un archivo temporal y se renombra con os.replace, así que los lectores
+    ven la versión anterior completa o la nueva completa; los mapeos abiertos de la
+    versión anterior siguen siendo válidos. Devuelve la versión publicada, o None si
+    otro proceso estaba publicando (con blocking=False).
+    """
+    path = snapshot_path()
+    with _FileLock(path + '.lock', blocking) as acquired:
+        if not acquired:
+            return None
+        rows = get_parking_snapshot_rows()
+        ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        lats = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+        lons = np.fromiter((r[2] for r in rows), dtype=np.float64, count=len(rows))
+        flags = np.fromiter((FLAG_ACTIVE if r[3] else 0 for r in rows), dtype=np.uint8, count=len(rows))
+        keys = cell_keys(lats, lons, GRID_CELL_DEG)
+        order = np.argsort(keys, kind='stable')
+
+        version = _current_version(path) + 1
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, version, len(rows), GRID_CELL_DEG, time.time())
+            f.write(header.ljust(_HEADER_SIZE, b'\0'))
+            for column in (ids, keys, lats, lons, flags):
+                f.write(np.ascontiguousarray(column[order]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return version
+
+
+_lock = threading.Lock()
+_current = {'snapshot': None}
+
+
+def get_parking_snapshot(max_age=SNAPSHOT_MAX_AGE):
+    """Snapshot vigente para este proceso. Cambia atómicamente de versión cuando el
+    archivo fue reemplazado; si tiene más de max_age segundos pide republicarlo al hilo de
+    fondo y devuelve el actual (sólo se publica en la petición si aún no existe)."""
+    path = snapshot_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        publish_parking_snapshot()
+        stat = os.stat(path)
+    if time.time() - stat.st_mtime > max_age:
+        publish_parking_snapshot_async()
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        snapshot = _current['snapshot']
+        if snapshot is None or snapshot.stamp != stamp:
+            snapshot = ParkingSnapshot(path)
+            _current['snapshot'] = snapshot
+        return snapshot
+
+
+_publish_event = threading.Event()
+_publisher = {'thread': None}
+
+
+def _publish_loop():
+    while True:
+        _publish_event.wait()
+        _publish_event.clear()
+        try:
+            publish_parking_snapshot()
+        except Exception as e:
+            print(f"[parking_snapshot] error publicando snapshot: {e}")
+
+
+def publish_parking_snapshot_async():
+    """Pide republicar el snapshot en segundo plano (varias peticiones seguidas se agrupan)."""
+    with _lock:
+        if _publisher['thread'] is None or not _publisher['thread'].is_alive():
+            _publisher['thread'] = threading.Thread(target=_publish_loop, daemon=True)
+            _publisher['thread'].start()
+    _publish_event.set()
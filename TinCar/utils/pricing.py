@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+from utils import clock
+
+# Tarifa por minuto ocupado (se cobra cada minuto empezado).
+RATE_PER_MINUTE = 100
+# Multa tras rechazar tiempo extra: PENALTY_AMOUNT por cada PENALTY_STEP_MINUTES completos
+# pasados de duration_minutes.
+PENALTY_STEP_MINUTES = 5
+PENALTY_AMOUNT = 500
+# El cobro a la fecha cambia como mucho una vez por minuto: las respuestas que lo incluyen
+# se revalidan con este intervalo (versioned_by(refresh_every=...) en app.py).
+CHARGE_REFRESH_SECONDS = 60
+
+
+def timestamp_seconds(value):
+    """Timestamp de la DB (CURRENT_TIMESTAMP sin zona = UTC, o ISO con zona) en segundos epoch, o None."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def elapsed_minutes(occupied_since, now=None):
+    """Minutos ocupados desde occupied_since (cada minuto empezado cuenta), o None."""
+    start = timestamp_seconds(occupied_since)
+    if start is None:
+        return None
+    secs = (clock.now() if now is None else now) - start
+    return int((secs + 59) // 60) if secs > 0 else 0
+
+
+def penalty_amount(occupied_since, duration_minutes, penalty_active, now=None):
+    """Multa a la fecha: 0 sin multa activa o mientras no se exceda duration_minutes."""
+    start = timestamp_seconds(occupied_since)
+    if not penalty_active or start is None or not duration_minutes:
+        return 0
+    overtime = int(((clock.now() if now is None else now) - start) // 60) - int(duration_minutes)
+    return (overtime // PENALTY_STEP_MINUTES) * PENALTY_AMOUNT if overtime > 0 else 0
+
+
+def price_reservation(reservation, now=None):
+    """Cobro de una reserva calculado al momento de leerla.
+
+    `reservation` es un dict con status, duration_minutes, penalty_active, occupied_since
+    (del parqueadero) y, para las ya finalizadas, elapsed_minutes, penalty_amount y
+    total_amount guardados al finalizar. Devuelve elapsed_minutes, subtotal,
+    penalty_amount y total; sin occupied_since se cobra la duración planificada.
+    """
+    if reservation.get('status') == 'completed' and reservation.get('total_amount') is not None:
+        penalty = reservation.get('penalty_amount') or 0
+        total = reservation['total_amount']
+        return {'elapsed_minutes': reservation.get('elapsed_minutes'), 'subtotal': total - penalty,
+                'penalty_amount': penalty, 'total': total, 'rate_per_minute': RATE_PER_MINUTE}
+    minutes = elapsed_minutes(reservation.get('occupied_since'), now)
+    if minutes is None:
+        minutes = int(reservation.get('duration_minutes') or 0)
+    penalty = penalty_amount(reservation.get('occupied_since'), reservation.get('duration_minutes'),
+                             reservation.get('penalty_active'), now)
+    subtotal = minutes * RATE_PER_MINUTE
+    return {'elapsed_minutes': minutes, 'subtotal': subtotal, 'penalty_amount': penalty,
+            'total': subtotal + penalty, 'rate_per_minute': RATE_PER_MINUTE}
@@ -0,0 +1,217 @@
+import json
+import os
+import queue
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from socketio import PubSubManager
+
+# Tamaño máximo de un mensaje en el bus Unix (un datagrama).
+MAX_DATAGRAM = 64 * 1024
+# Cada cuántos segundos se vuelve a listar el directorio de procesos del bus Unix.
+PEER_REFRESH_INTERVAL = 1.0
+# Prefijo de los canales en Redis.
+REDIS_PREFIX = 'tincar:'
+
+
+class LocalBus:
+    """Bus de publicación/suscripción dentro del proceso (un solo worker, o pruebas).
+
+    Los mensajes deben ser serializables a JSON. Los manejadores se llaman en el
+    hilo que publica (o en el hilo lector en los buses entre procesos).
+    """
+
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        self._lock = threading.Lock()
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    def subscribe(self, channel, handler):
+        with self._lock:
+            self._handlers[channel].append(handler)
+
+    def publish(self, channel, message):
+        self.stats['published'] += 1
+        self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for handler in handlers:
+            try:
+                handler(message)
+                self.stats['delivered'] += 1
+            except Exception as e:
+                print(f"[pubsub] error en manejador de '{channel}': {e}")
+
+    def close(self):
+        pass
+
+
+class UnixSocketBus(LocalBus):
+    """Bus entre procesos del mismo host sin broker: cada proceso enlaza un socket Unix
+    de datagramas en `directory` y publicar es entregar localmente y enviar el mensaje
+    a los sockets de los demás procesos. Si un proceso está saturado su copia se
+    descarta (el emisor nunca se bloquea); los sockets de procesos muertos se borran.
+    """
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = directory or os.path.join(tempfile.gettempdir(), 'tincar-bus')
+        self._pid = None
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        self.path = os.path.join(self.directory, f'{self._pid}-{uuid.uuid4().hex[:8]}.sock')
+        self._in = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._in.bind(self.path)
+        self._out = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._out.setblocking(False)
+        self._peers = []
+        self._peers_at = 0.0
+        threading.Thread(target=self._read_loop, args=(self._in,), daemon=True).start()
+
+    def _ensure_process(self):
+        # Tras un fork (p.ej. gunicorn --preload) cada worker necesita su propio socket
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._open()
+
+    def _read_loop(self, sock):
+        while True:
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except OSError:
+                return  # socket cerrado
+            try:
+                envelope = json.loads(data)
+            except ValueError:
+                continue
+            self._deliver(envelope['c'], envelope['m'])
+
+    def _current_peers(self):
+        now = time.monotonic()
+        if now - self._peers_at > PEER_REFRESH_INTERVAL:
+            try:
+                names = os.listdir(self.directory)
+            except OSError:
+                names = []
+            self._peers = [os.path.join(self.directory, n) for n in names
+                           if n.endswith('.sock') and os.path.join(self.directory, n) != self.path]
+            self._peers_at = now
+        return self._peers
+
+    def subscribe(self, channel, handler):
+        self._ensure_process()
+        super().subscribe(channel, handler)
+
+    def publish(self, channel, message):
+        self._ensure_process()
+        data = json.dumps({'c': channel, 'm': message}, separators=(',', ':')).encode()
+        if len(data) > MAX_DATAGRAM:
+            raise ValueError(f'Mensaje de {len(data)} bytes excede MAX_DATAGRAM')
+        super().publish(channel, message)
+        for peer in self._current_peers():
+            try:
+                self._out.sendto(data, peer)
+            except BlockingIOError:
+                self.stats['dropped'] += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Proceso terminado: borrar su socket y olvidarlo
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+                self._peers_at = 0.0
+
+    def close(self):
+        for sock in (self._in, self._out):
+            sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class RedisBus(LocalBus):
+    """Bus sobre pub/sub de Redis (varios hosts). `client` permite inyectar un cliente
+    compatible (publish() y pubsub() con psubscribe/get_message), p.ej. un fake en pruebas."""
+
+    def __init__(self, url=None, client=None):
+        super().__init__()
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('El bus Redis requiere el paquete redis (pip install redis)')
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        # Un solo patrón para todos los canales: no se modifica la suscripción desde otros hilos
+        self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.psubscribe(REDIS_PREFIX + '*')
+        self._closed = False
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _read_loop(self):
+        while not self._closed:
+            try:
+                msg = self._pubsub.get_message(timeout=1.0)
+            except Exception as e:
+                print(f"[pubsub] error leyendo de Redis: {e}")
+                time.sleep(1.0)
+                continue
+            if not msg or msg.get('type') != 'pmessage':
+                continue
+            channel = msg['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            self._deliver(channel[len(REDIS_PREFIX):], json.loads(msg['data']))
+
+    def publish(self, channel, message):
+        # Redis también entrega al propio proceso (está suscrito al patrón)
+        self.stats['published'] += 1
+        self._redis.publish(REDIS_PREFIX + channel, json.dumps(message, separators=(',', ':')))
+
+    def close(self):
+        self._closed = True
+
+
+def create_bus(spec=None):
+    """Crea el bus según `spec` o la variable de entorno TINCAR_BUS:
+    'local' (por defecto), 'unix' o 'unix:/ruta/directorio', o una URL redis:// / rediss://."""
+    spec = spec or os.environ.get('TINCAR_BUS', 'local')
+    if spec == 'local':
+        return LocalBus()
+    if spec == 'unix' or spec.startswith('unix:'):
+        return UnixSocketBus(spec.split(':', 1)[1] if ':' in spec else None)
+    if spec.startswith(('redis://', 'rediss://')):
+        return RedisBus(url=spec)
+    raise ValueError(f'TINCAR_BUS desconocido: {spec}')
+
+
+class BusClientManager(PubSubManager):
+    """Client manager de python-socketio que usa el bus como message queue, para que
+    socketio.emit llegue a clientes conectados a otros workers."""
+
+    name = 'tincar-bus'
+
+    def __init__(self, bus, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.bus = bus
+        self._queue = queue.Queue()
+        if not write_only:
+            bus.subscribe(channel, self._queue.put)
+
+    def _publish(self, data):
+        self.bus.publish(self.channel, data)
+
+    def _listen(self):
+        while True:
+            yield self._queue.get()
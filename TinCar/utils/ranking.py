@@ -0,0 +1,149 @@
+import math
+import unicodedata
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+# Velocidad promedio (km/h) en vía urbana por ciudad. Es una aproximación
+# conservadora del tráfico en hora pico; las ciudades no listadas usan DEFAULT_SPEED_KMH.
+CITY_SPEED_KMH = {
+    'bogota': 17.0,
+    'soacha': 20.0,
+    'medellin': 21.0,
+    'bello': 23.0,
+    'envigado': 23.0,
+    'itagui': 22.0,
+    'cali': 24.0,
+    'barranquilla': 25.0,
+    'soledad': 25.0,
+    'cartagena': 22.0,
+    'bucaramanga': 24.0,
+    'cucuta': 27.0,
+    'pereira': 27.0,
+    'manizales': 25.0,
+    'ibague': 28.0,
+    'villavicencio': 28.0,
+}
+DEFAULT_SPEED_KMH = 30.0
+
+# La distancia en línea recta subestima el recorrido real por calles.
+ROUTE_DETOUR_FACTOR = 1.3
+
+# Número de conductores procesados por bloque. Acota la memoria de las matrices
+# intermedias (bloque x parqueaderos) sin perder la vectorización.
+DRIVER_BLOCK_SIZE = 256
+
+
+def normalize_city(city):
+    """Normaliza el nombre de la ciudad (sin tildes, minúsculas) para buscar su perfil."""
+    if not city:
+        return ''
+    text = unicodedata.normalize('NFKD', str(city))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return text.strip().lower()
+
+
+def speed_for_city(city):
+    """Velocidad promedio en km/h para la ciudad dada."""
+    return CITY_SPEED_KMH.get(normalize_city(city), DEFAULT_SPEED_KMH)
+
+
+def haversine_matrix(d_lat, d_lon, p_lat, p_lon):
+    """Distancias haversine en metros entre cada conductor (filas) y cada parqueadero (columnas).
+
+    Recibe arreglos 1-D en grados y devuelve una matriz (len(d_lat), len(p_lat)).
+    """
+    d_lat = np.radians(np.asarray(d_lat, dtype=np.float64))[:, None]
+    d_lon = np.radians(np.asarray(d_lon, dtype=np.float64))[:, None]
+    p_lat = np.radians(np.asarray(p_lat, dtype=np.float64))[None, :]
+    p_lon = np.radians(np.asarray(p_lon, dtype=np.float64))[None, :]
+    a = np.sin((p_lat - d_lat) * 0.5) ** 2
+    a += np.cos(d_lat) * np.cos(p_lat) * np.sin((p_lon - d_lon) * 0.5) ** 2
+    np.clip(a, 0.0, 1.0, out=a)
+    return 2.0 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _parking_columns(parkings):
+    """Extrae ids, coordenadas y velocidad (m/min) de los parqueaderos con coordenadas válidas."""
+    ids, lats, lons, speeds = [], [], [], []
+    for p in parkings:
+        try:
+            lat = float(p.get('latitude'))
+            lon = float(p.get('longitude'))
+        except (TypeError, ValueError):
+            continue
+        ids.append(p.get('id'))
+        lats.append(lat)
+        lons.append(lon)
+        speeds.append(speed_for_city(p.get('city')) * 1000.0 / 60.0)
+    return (np.asarray(ids, dtype=np.int64), np.asarray(lats, dtype=np.float64),
+            np.asarray(lons, dtype=np.float64), np.asarray(speeds, dtype=np.float64))
+
+
+def rank_parkings(drivers, parkings, k=5, max_distance_m=None):
+    """Calcula la matriz distancia/ETA entre conductores y parqueaderos y devuelve
+    los k parqueaderos con menor ETA para cada conductor.
+
+    - drivers: lista de dicts con 'lat' y 'lon' (y opcionalmente 'id').
+    - parkings: lista de dicts con 'id', 'latitude', 'longitude' y 'city'.
+    - max_distance_m: si se pasa, descarta parqueaderos más lejanos que esa distancia.
+
+    Devuelve una lista (en el mismo orden de `drivers`) de dicts
+    {'driver_id', 'parkings': [{'id', 'distance_m', 'eta_minutes'}, ...]}, donde
+    distance_m es la distancia estimada por calles (haversine * ROUTE_DETOUR_FACTOR).
+    """
+    p_ids, p_lat, p_lon, p_speed = _parking_columns(parkings)
+    d_lat = np.asarray([float(d['lat']) for d in drivers], dtype=np.float64)
+    d_lon = np.asarray([float(d['lon']) for d in drivers], dtype=np.float64)
+    results = []
+    if len(drivers) == 0:
+        return results
+    k = max(1, int(k))
+    n_parkings = len(p_ids)
+    kk = min(k, n_parkings)
+
+    for start in range(0, len(drivers), DRIVER_BLOCK_SIZE):
+        stop = min(start + DRIVER_BLOCK_SIZE, len(drivers))
+        if n_parkings == 0:
+            for i in range(start, stop):
+                results.append({'driver_id': drivers[i].get('id'), 'parkings': []})
+            continue
+        dist = haversine_matrix(d_lat[start:stop], d_lon[start:stop], p_lat, p_lon)
+        dist *= ROUTE_DETOUR_FACTOR
+        eta = dist / p_speed[None, :]
+        if max_distance_m is not None:
+            eta[dist > float(max_distance_m) * ROUTE_DETOUR_FACTOR] = np.inf
+
+        # top-k por fila: argpartition O(n) y luego ordenar sólo los k candidatos
+        if kk < n_parkings:
+            cand = np.argpartition(eta, kk - 1, axis=1)[:, :kk]
+        else:
+            cand = np.broadcast_to(np.arange(n_parkings), (stop - start, n_parkings))
+        rows = np.arange(stop - start)[:, None]
+        order = np.argsort(eta[rows, cand], axis=1, kind='stable')
+        top = cand[rows, order]
+        top_eta = eta[rows, top]
+        top_dist = dist[rows, top]
+
+        for row in range(stop - start):
+            items = []
+            for col in range(kk):
+                e = top_eta[row, col]
+                if not np.isfinite(e):
+                    break
+                items.append({
+                    'id': int(p_ids[top[row, col]]),
+                    'distance_m': int(round(top_dist[row, col])),
+                    'eta_minutes': int(math.ceil(e)),
+                })
+            results.append({'driver_id': drivers[start + row].get('id'), 'parkings': items})
+    return results
+
+
+def estimate_eta_minutes(lat, lon, parking):
+    """ETA en minutos (redondeado hacia arriba) desde (lat, lon) hasta un parqueadero.
+    Devuelve None si el parqueadero no tiene coordenadas."""
+    ranked = rank_parkings([{'lat': lat, 'lon': lon}], [parking], k=1)
+    items = ranked[0]['parkings'] if ranked else []
+    return items[0]['eta_minutes'] if items else None
@@ -0,0 +1,109 @@
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+# Muestras de lag por tipo de plazo usadas para los percentiles.
+LAG_WINDOW = 1000
+# Umbrales (ms) del histograma acumulado de lag: base para los SLO de expiración.
+LAG_BUCKETS_MS = (1000, 5000, 30000, 60000)
+
+
+def log_event(component, event, **fields):
+    """Log estructurado: una línea JSON por evento en stdout."""
+    record = {'ts': round(time.time(), 3), 'component': component, 'event': event}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str), file=sys.stdout, flush=True)
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(len(values) * q))], 1)
+
+    return {'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': round(values[-1], 1),
+            'n': len(values)}
+
+
+class SchedulerMetrics:
+    """Contadores del trabajo de fondo, seguros entre hilos.
+
+    - corridas ('sweep', 'load', 'retention'...): cantidad, duración última/máxima/total,
+      filas examinadas y procesadas;
+    - plazos por tipo ('eta', 'duration'): disparados, procesados, errores, lag (desde el
+      vencimiento hasta que se procesó) en percentiles e histograma acumulado;
+    - errores: total y el último traceback.
+    """
+
+    def __init__(self, window=LAG_WINDOW):
+        self._lock = threading.Lock()
+        self.window = window
+        self.started_at = time.time()
+        self.runs = {}
+        self.jobs = {}
+        self.errors = 0
+        self.last_error = None
+
+    def record_run(self, name, duration_ms, examined=None, acted=None, **extra):
+        with self._lock:
+            run = self.runs.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                                              'examined': 0, 'acted': 0})
+            run['count'] += 1
+            run['total_ms'] = round(run['total_ms'] + duration_ms, 1)
+            run['max_ms'] = max(run['max_ms'], round(duration_ms, 1))
+            run['last_ms'] = round(duration_ms, 1)
+            run['last_at'] = round(time.time(), 3)
+            run['examined'] += examined or 0
+            run['acted'] += acted or 0
+            run['last'] = dict(extra, examined=examined, acted=acted)
+
+    def _job(self, kind):
+        job = self.jobs.get(kind)
+        if job is None:
+            job = self.jobs[kind] = {'fired': 0, 'acted': 0, 'errors': 0, 'lags': deque(maxlen=self.window),
+                                     'buckets': {f'le_{ms}': 0 for ms in LAG_BUCKETS_MS}}
+            job['buckets']['inf'] = 0
+        return job
+
+    def record_job(self, kind, lag_ms, acted, duration_ms):
+        with self._lock:
+            job = self._job(kind)
+            job['fired'] += 1
+            job['acted'] += int(bool(acted))
+            job['lags'].append(lag_ms)
+            job['last_lag_ms'] = round(lag_ms, 1)
+            job['last_duration_ms'] = round(duration_ms, 1)
+            for ms in LAG_BUCKETS_MS:
+                if lag_ms <= ms:
+                    job['buckets'][f'le_{ms}'] += 1
+            job['buckets']['inf'] += 1
+
+    def record_error(self, where, kind=None):
+        """Llamar desde un except: guarda el traceback en curso."""
+        with self._lock:
+            self.errors += 1
+            if kind is not None:
+                self._job(kind)['errors'] += 1
+            self.last_error = {'at': round(time.time(), 3), 'where': where,
+                               'traceback': traceback.format_exc(limit=20)}
+
+    def snapshot(self):
+        """Estado serializable a JSON."""
+        with self._lock:
+            jobs = {}
+            for kind, job in self.jobs.items():
+                jobs[kind] = {key: value for key, value in job.items() if key != 'lags'}
+                jobs[kind]['buckets'] = dict(job['buckets'])
+                jobs[kind]['lag_ms'] = _percentiles(job['lags'])
+            return {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'runs': {name: dict(run) for name, run in self.runs.items()},
+                'jobs': jobs,
+                'errors': self.errors,
+                'last_error': dict(self.last_error) if self.last_error else None,
+            }
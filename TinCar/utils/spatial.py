@@ -0,0 +1,156 @@
+import numpy as np
+
+from utils.ranking import EARTH_RADIUS_M
+
+# Tamaño de celda del índice espacial en grados (~1.1 km de lado en latitud).
+GRID_CELL_DEG = 0.01
+
+_DEG_TO_M = EARTH_RADIUS_M * np.pi / 180.0
+
+
+def decode_polyline(encoded, precision=5):
+    """Decodifica una polilínea codificada (formato de Google/OSRM) a una lista de (lat, lon)."""
+    points = []
+    index = lat = lon = 0
+    factor = 10 ** precision
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                if index >= length:
+                    raise ValueError('Polilínea truncada')
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def _cell_key(ilat, ilon):
+    return (ilat + 20000) * 100000 + (ilon + 20000)
+
+
+def cell_keys(lats, lons, cell_deg=GRID_CELL_DEG):
+    """Clave de celda de cada punto; ordenar por ella agrupa cada celda (y cada fila
+    de celdas de igual latitud) en un rango contiguo."""
+    return _cell_key(np.floor(np.asarray(lats) / cell_deg).astype(np.int64),
+                     np.floor(np.asarray(lons) / cell_deg).astype(np.int64))
+
+
+class GridIndex:
+    """Índice espacial de grilla uniforme sobre arreglos de coordenadas.
+
+    Los puntos se ordenan por celda para que cada celda sea un slice contiguo
+    de los arreglos `ids`, `lats` y `lons`. `active` (opcional) es una máscara
+    booleana que corridor_search usa para descartar puntos inactivos.
+    """
+
+    def __init__(self, ids, lats, lons, cell_deg=GRID_CELL_DEG, active=None):
+        ids = np.asarray(ids, dtype=np.int64)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        keys = cell_keys(lats, lons, cell_deg)
+        order = np.argsort(keys, kind='stable')
+        self._set(ids[order], lats[order], lons[order], keys[order], cell_deg,
+                  None if active is None else np.asarray(active, dtype=bool)[order])
+
+    @classmethod
+    def from_sorted(cls, ids, lats, lons, keys, cell_deg=GRID_CELL_DEG, active=None):
+        """Envuelve arreglos ya ordenados por `keys` sin copiarlos (p.ej. un snapshot mapeado en memoria)."""
+        index = cls.__new__(cls)
+        index._set(ids, lats, lons, keys, cell_deg, active)
+        return index
+
+    def _set(self, ids, lats, lons, keys, cell_deg, active):
+        self.ids, self.lats, self.lons, self.keys = ids, lats, lons, keys
+        self.cell_deg = cell_deg
+        self.active = active
+
+    def __len__(self):
+        return len(self.ids)
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Posiciones (en los arreglos del índice) de los puntos de las celdas que tocan el bbox.
+
+        Es un prefiltro: puede incluir puntos cercanos al borde pero fuera del bbox.
+        """
+        d = self.cell_deg
+        ilon_min, ilon_max = int(np.floor(min_lon / d)), int(np.floor(max_lon / d))
+        rows = np.arange(int(np.floor(min_lat / d)), int(np.floor(max_lat / d)) + 1)
+        # Cada fila de celdas es un rango contiguo de claves: dos búsquedas binarias por fila
+        starts = np.searchsorted(self.keys, _cell_key(rows, ilon_min), side='left')
+        stops = np.searchsorted(self.keys, _cell_key(rows, ilon_max), side='right')
+        slices = [np.arange(a, b) for a, b in zip(starts, stops) if b > a]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(slices)
+
+
+def corridor_search(index, route, width_m):
+    """Busca los puntos del índice a menos de `width_m` metros de algún segmento de la ruta.
+
+    - route: lista de (lat, lon) con al menos un punto.
+
+    Devuelve (posiciones, distancia_m, avance_m) ordenados por avance sobre la ruta,
+    donde avance_m es la distancia recorrida desde el inicio de la ruta hasta la
+    proyección del punto sobre su segmento más cercano.
+    """
+    route = np.asarray(route, dtype=np.float64).reshape(-1, 2)
+    if len(route) == 1:
+        route = np.vstack([route, route])
+    a_lat, a_lon = route[:-1, 0], route[:-1, 1]
+    b_lat, b_lon = route[1:, 0], route[1:, 1]
+    kx = _DEG_TO_M * np.cos(np.radians((a_lat + b_lat) * 0.5))
+    seg_len = np.hypot((b_lon - a_lon) * kx, (b_lat - a_lat) * _DEG_TO_M)
+    seg_start = np.concatenate([[0.0], np.cumsum(seg_len)[:-1]])
+
+    # 1. Prefiltro: bbox de cada segmento ampliado en width_m contra el índice
+    pad_lat = width_m / _DEG_TO_M
+    cand, seg = [], []
+    for s in range(len(a_lat)):
+        pad_lon = width_m / max(kx[s], 1e-9)
+        found = index.query_bbox(min(a_lat[s], b_lat[s]) - pad_lat, min(a_lon[s], b_lon[s]) - pad_lon,
+                                 max(a_lat[s], b_lat[s]) + pad_lat, max(a_lon[s], b_lon[s]) + pad_lon)
+        if len(found):
+            cand.append(found)
+            seg.append(np.full(len(found), s, dtype=np.int64))
+    if not cand:
+        empty = np.empty(0)
+        return np.empty(0, dtype=np.int64), empty, empty
+    cand = np.concatenate(cand)
+    seg = np.concatenate(seg)
+
+    # 2. Distancia punto-segmento vectorizada en proyección local (metros)
+    k = kx[seg]
+    px = (index.lons[cand] - a_lon[seg]) * k
+    py = (index.lats[cand] - a_lat[seg]) * _DEG_TO_M
+    dx = (b_lon[seg] - a_lon[seg]) * k
+    dy = (b_lat[seg] - a_lat[seg]) * _DEG_TO_M
+    len2 = dx * dx + dy * dy
+    t = np.where(len2 > 0, (px * dx + py * dy) / np.where(len2 > 0, len2, 1.0), 0.0)
+    np.clip(t, 0.0, 1.0, out=t)
+    dist = np.hypot(px - t * dx, py - t * dy)
+    along = seg_start[seg] + t * seg_len[seg]
+
+    keep = dist <= width_m
+    if index.active is not None:
+        keep &= index.active[cand]
+    cand, dist, along = cand[keep], dist[keep], along[keep]
+
+    # 3. Un resultado por punto: el segmento más cercano (desempate por avance)
+    order = np.lexsort((along, dist, cand))
+    cand, dist, along = cand[order], dist[order], along[order]
+    first = np.ones(len(cand), dtype=bool)
+    first[1:] = cand[1:] != cand[:-1]
+    cand, dist, along = cand[first], dist[first], along[first]
+
+    order = np.argsort(along, kind='stable')
+    return cand[order], dist[order], along[order]
@@ -0,0 +1,184 @@
+import math
+import threading
+import time
+
+from models import (
+    get_pending_reservation_target,
+    mark_driver_arrived,
+    upsert_driver_locations,
+)
+from utils.ranking import EARTH_RADIUS_M
+
+# Radio (m) alrededor del parqueadero reservado dentro del cual se considera que el conductor llegó.
+GEOFENCE_RADIUS_M = 60.0
+# Fixes consecutivos dentro de la geocerca requeridos para marcar la llegada (evita saltos del GPS).
+ARRIVAL_MIN_FIXES = 2
+# Fixes con precisión peor que esto (m) no cuentan para la geocerca.
+MAX_FIX_ACCURACY_M = 100.0
+# Segundos que se reutiliza la reserva/geocerca consultada para un conductor.
+TARGET_CACHE_TTL = 15.0
+# Cada cuántos segundos se vuelcan a SQLite las posiciones modificadas.
+FLUSH_INTERVAL = 2.0
+# Máximo de fixes aceptados por petición.
+MAX_FIXES_PER_BATCH = 500
+
+
+def _distance_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) * 0.5) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) * 0.5) ** 2
+    return 2.0 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def parse_fixes(payload):
+    """Normaliza el payload ({fixes: [...]} o un único fix) a una lista de
+    tuplas (lat, lon, ts, accuracy). Lanza ValueError si es inválido."""
+    raw = payload.get('fixes') if isinstance(payload, dict) and 'fixes' in payload else [payload]
+    if not isinstance(raw, list) or not raw:
+        raise ValueError('Se requiere al menos un fix')
+    if len(raw) > MAX_FIXES_PER_BATCH:
+        raise ValueError(f'Máximo {MAX_FIXES_PER_BATCH} fixes por petición')
+    now = time.time()
+    fixes = []
+    for f in raw:
+        lat = float(f.get('lat', f.get('latitude')))
+        lon = float(f.get('lon', f.get('longitude')))
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            raise ValueError('Coordenadas fuera de rango')
+        ts = f.get('ts')
+        ts = float(ts) if ts is not None else now
+        if ts > 1e12:  # milisegundos (Date.now() en JS)
+            ts /= 1000.0
+        accuracy = f.get('accuracy')
+        fixes.append((lat, lon, min(ts, now), float(accuracy) if accuracy is not None else None))
+    fixes.sort(key=lambda x: x[2])
+    return fixes
+
+
+class LocationStore:
+    """Posición más reciente de cada conductor en memoria, con detección de llegada
+    por geocerca y escritura diferida (coalescida) a SQLite."""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, geofence_radius_m=GEOFENCE_RADIUS_M):
+        self.flush_interval = flush_interval
+        self.geofence_radius_m = geofence_radius_m
+        self._lock = threading.Lock()
+        self._latest = {}      # driver_id -> (lat, lon, ts, accuracy)
+        self._dirty = set()    # conductores con posición pendiente de guardar
+        self._targets = {}     # driver_id -> (expira, target o None)
+        self._inside = {}      # driver_id -> fixes consecutivos dentro de la geocerca
+        self._flusher = None
+        self._listeners = []
+        self.stats = {'fixes': 0, 'batches': 0, 'flushes': 0, 'rows_flushed': 0, 'arrivals': 0}
+
+    def add_listener(self, fn):
+        """Registra fn(driver_id, fix) que se llama con cada nueva posición aceptada."""
+        self._listeners.append(fn)
+
+    def latest(self, driver_id):
+        with self._lock:
+            return self._latest.get(driver_id)
+
+    def _target_for(self, driver_id, now):
+        """Reserva pendiente (geocerca) del conductor, cacheada TARGET_CACHE_TTL segundos.
+        La consulta a la DB se hace fuera del lock."""
+        with self._lock:
+            cached = self._targets.get(driver_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        target = get_pending_reservation_target(driver_id)
+        with self._lock:
+            self._targets[driver_id] = (now + TARGET_CACHE_TTL, target)
+        return target
+
+    def forget_target(self, driver_id):
+        """Invalida la geocerca cacheada del conductor (p.ej. tras crear o cancelar una reserva)."""
+        with self._lock:
+            self._targets.pop(driver_id, None)
+            self._inside.pop(driver_id, None)
+
+    def ingest(self, driver_id, fixes):
+        """Registra un lote de fixes ordenados por ts. Devuelve el id de la reserva
+        marcada como llegada, o None."""
+        now = time.monotonic()
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['fixes'] += len(fixes)
+            current = self._latest.get(driver_id)
+            newest = fixes[-1]
+            accepted = current is None or newest[2] >= current[2]
+            if accepted:
+                self._latest[driver_id] = newest
+                self._dirty.add(driver_id)
+        self._ensure_flusher()
+        if accepted:
+            for listener in self._listeners:
+                try:
+                    listener(driver_id, newest)
+                except Exception as e:
+                    print(f"[tracking] error en listener: {e}")
+
+        target = self._target_for(driver_id, now)
+        if target is None:
+            return None
+        arrived_reservation = None
+        with self._lock:
+            inside = self._inside.get(driver_id, 0)
+            for lat, lon, _ts, accuracy in fixes:
+                if accuracy is not None and accuracy > MAX_FIX_ACCURACY_M:
+                    continue
+                d = _distance_m(lat, lon, target['latitude'], target['longitude'])
+                inside = inside + 1 if d <= self.geofence_radius_m else 0
+                if inside >= ARRIVAL_MIN_FIXES:
+                    arrived_reservation = target['reservation_id']
+                    break
+            if arrived_reservation is None:
+                self._inside[driver_id] = inside
+            else:
+                # La reserva deja de estar 'pending': no volver a evaluarla
+                self._targets[driver_id] = (now + TARGET_CACHE_TTL, None)
+                self._inside.pop(driver_id, None)
+        if arrived_reservation is None or not mark_driver_arrived(arrived_reservation):
+            return None
+        with self._lock:
+            self.stats['arrivals'] += 1
+        return arrived_reservation
+
+    def flush(self):
+        """Guarda en SQLite las posiciones modificadas desde el último volcado."""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            rows = []
+            for d in self._dirty:
+                lat, lon, ts, accuracy = self._latest[d]
+                rows.append((d, lat, lon, accuracy, ts))
+            self._dirty = set()
+        try:
+            upsert_driver_locations(rows)
+        except Exception as e:
+            print(f"[tracking] error guardando posiciones: {e}")
+            with self._lock:
+                # Reintentar en el próximo volcado (se guardará la posición más reciente)
+                self._dirty.update(r[0] for r in rows)
+            return 0
+        with self._lock:
+            self.stats['flushes'] += 1
+            self.stats['rows_flushed'] += len(rows)
+        return len(rows)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+
+# Instancia compartida por el proceso (cada worker de gunicorn tiene la suya)
+location_store = LocationStore()
@@ -0,0 +1,48 @@
+"""Benchmark de la búsqueda de parqueaderos a lo largo de una ruta (utils/spatial.py).
+
+Construye un índice de grilla con 100.000 parqueaderos aleatorios en Bogotá y mide
+el tiempo de consultar un corredor de 300 m alrededor de una ruta de 200 puntos.
+
+Ejecutar con: python3 scripts/bench_corridor.py [parqueaderos] [puntos_ruta] [ancho_m]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+from utils.spatial import GridIndex, corridor_search, decode_polyline  # noqa: E402
+
+n_parkings = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+n_points = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+width_m = float(sys.argv[3]) if len(sys.argv) > 3 else 300.0
+
+rng = np.random.default_rng(7)
+lats = rng.uniform(4.45, 4.85, size=n_parkings)
+lons = rng.uniform(-74.25, -73.98, size=n_parkings)
+
+t0 = time.perf_counter()
+index = GridIndex(np.arange(n_parkings), lats, lons)
+build = time.perf_counter() - t0
+
+# Ruta de sur a norte con algo de zigzag (~40 km)
+route_lat = np.linspace(4.50, 4.80, n_points)
+route_lon = -74.10 + 0.02 * np.sin(np.linspace(0, 6 * np.pi, n_points))
+route = list(zip(route_lat, route_lon))
+
+corridor_search(index, route, width_m)  # calentamiento
+runs = []
+for _ in range(10):
+    t0 = time.perf_counter()
+    positions, dist, along = corridor_search(index, route, width_m)
+    runs.append(time.perf_counter() - t0)
+
+print(f'Parqueaderos: {n_parkings}  Puntos de ruta: {n_points}  Ancho: {width_m:.0f} m')
+print(f'Construcción del índice: {build * 1000:.1f} ms')
+print(f'Consulta: mejor {min(runs) * 1000:.2f} ms  mediana {sorted(runs)[len(runs) // 2] * 1000:.2f} ms')
+print(f'Resultados: {len(positions)}  (máx. distancia {dist.max() if len(dist) else 0:.0f} m)')
+
+# Verificar la decodificación de polilíneas con el ejemplo de la documentación de Google
+assert decode_polyline('_p~iF~ps|U_ulLnnqC_mqNvxq`@') == [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
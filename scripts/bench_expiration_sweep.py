@@ -0,0 +1,123 @@
+"""Benchmark del barrido de plazos vencidos (models.notify_expired_reservations).
+
+Crea N reservas abiertas (40% pendientes, 10% de ellas con el ETA vencido; 60% activas
+con el vehículo guardado, la mitad pasadas de tiempo y 20% con multa) y compara sobre
+copias de la misma DB:
+- por fila: el barrido anterior, que recorre cada reserva en Python con una consulta por
+  fila, add_notification por cada aviso y un UPDATE + commit por multa,
+- por conjunto: notify_expired_reservations (pocas sentencias en una transacción; las
+  multas ya no se escriben, se calculan al leer con utils/pricing.py). Sin liberación de
+  reservas sin llegada (utils/no_show.py), que el barrido anterior no hacía.
+
+Se mide la primera pasada (crea las notificaciones) y una pasada estable (sin avisos
+nuevos, sólo multas).
+
+Ejecutar con: python3 scripts/bench_expiration_sweep.py [reservas ...]   (por defecto 10000 100000)
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+import models  # noqa: E402
+from utils.pricing import timestamp_seconds, penalty_amount  # noqa: E402
+from utils.no_show import GracePolicy  # noqa: E402
+
+sizes = [int(a) for a in sys.argv[1:]] or [10000, 100000]
+workdir = tempfile.mkdtemp()
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def build(n):
+    """DB con n reservas abiertas; devuelve su ruta."""
+    models.DB_PATH = os.path.join(workdir, f'base_{n}.db')
+    for fn in ('create_users_table', 'create_parkings_table', 'create_reservations_table',
+               'create_notifications_table', 'create_resource_versions_table'):
+        getattr(models, fn)()
+    random.seed(n)
+    now = time.time()
+    conn = models.get_connection()
+    conn.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, 'x', ?)",
+                     [(f'Usuario {i}', f'u{i}@bench', 'arrendador' if i < 100 else 'conductor')
+                      for i in range(1100)])
+    parkings, reservations = [], []
+    for i in range(1, n + 1):
+        driver = random.randint(101, 1100)
+        if random.random() < 0.4:
+            # Margen amplio entre vencidas y no vencidas: las corridas a 100k tardan minutos
+            late = random.random() < 0.1
+            created = now - (random.randint(11, 60) if late else random.randint(0, 9)) * 60
+            parkings.append((random.randint(1, 100), f'Parqueadero {i}', None))
+            reservations.append((driver, i, 'pending', 10 if late else 45, 30,
+                                 datetime.fromtimestamp(created, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), 0))
+        else:
+            elapsed = random.randint(31, 90) if random.random() < 0.5 else random.randint(0, 9)
+            parkings.append((random.randint(1, 100), f'Parqueadero {i}', iso(now - elapsed * 60)))
+            reservations.append((driver, i, 'active', 10, 30, iso(now - (elapsed + 10) * 60),
+                                 int(random.random() < 0.2)))
+    conn.executemany('INSERT INTO parkings (owner_id, name, occupied_since, active) VALUES (?, ?, ?, 0)', parkings)
+    conn.executemany('''
+        INSERT INTO reservations (driver_id, parking_id, status, eta_minutes, duration_minutes, created_at,
+                                  penalty_active)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', reservations)
+    conn.commit()
+    conn.close()
+    return models.DB_PATH
+
+
+def per_row_sweep():
+    """Barrido anterior: una pasada en Python por cada reserva abierta."""
+    now = time.time()
+    conn = models.get_connection()
+    pending = [r[0] for r in conn.execute("SELECT id FROM reservations WHERE status = 'pending'")]
+    active = conn.execute('''
+        SELECT r.id, r.duration_minutes, r.penalty_active, p.occupied_since FROM reservations r
+        LEFT JOIN parkings p ON r.parking_id = p.id
+        WHERE r.status = 'active' AND p.occupied_since IS NOT NULL
+    ''').fetchall()
+    conn.close()
+    for reservation_id in pending:
+        models.expire_reservation_eta(reservation_id)
+    for r in active:
+        if timestamp_seconds(r['occupied_since']) + r['duration_minutes'] * 60 <= now:
+            models.expire_reservation_duration(r['id'])
+    for r in active:
+        if r['penalty_active']:
+            conn = models.get_connection()
+            conn.execute('UPDATE reservations SET penalty_amount = ? WHERE id = ?',
+                         (penalty_amount(r['occupied_since'], r['duration_minutes'], 1, now), r['id']))
+            conn.commit()
+            conn.close()
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+print(f"{'reservas':>9} {'camino':<14} {'1ª pasada (ms)':>15} {'estable (ms)':>13} {'notificaciones':>15}")
+for n in sizes:
+    base = build(n)
+    set_based_sweep = lambda: models.notify_expired_reservations(policy=GracePolicy(grace_minutes=None))  # noqa: E731
+    for name, sweep in (('por fila', per_row_sweep), ('por conjunto', set_based_sweep)):
+        models.DB_PATH = os.path.join(workdir, f'{name.replace(" ", "_")}_{n}.db')
+        shutil.copy(base, models.DB_PATH)
+        first = timed(sweep)
+        steady = timed(sweep)
+        conn = models.get_connection()
+        created = conn.execute('SELECT COUNT(*) FROM notifications').fetchone()[0]
+        conn.close()
+        print(f'{n:>9} {name:<14} {first:>15.1f} {steady:>13.1f} {created:>15}')
+
+shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,105 @@
+"""Prueba de carga de la ingesta de ubicación de conductores (utils/tracking.py).
+
+Usa una base de datos temporal con N conductores, cada uno con una reserva
+pendiente, y envía lotes de fixes GPS:
+- directamente a LocationStore.ingest (costo del almacenamiento en memoria), y
+- a través de POST /api/drivers/location con el cliente de pruebas de Flask
+  (costo por petición de un worker, sin red).
+
+Al final cada conductor entra a la geocerca de su parqueadero y se verifica que
+todas las reservas pasaron a 'active' automáticamente.
+
+Ejecutar con: python3 scripts/bench_location_ingest.py [conductores] [lotes] [fixes_por_lote]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+import models  # noqa: E402
+
+models.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_tracking.db')
+
+from app import app  # noqa: E402
+from utils.tracking import location_store  # noqa: E402
+
+n_drivers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+n_batches = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+per_batch = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+models.create_users_table()
+models.create_parkings_table()
+models.create_reservations_table()
+models.create_notifications_table()
+models.create_driver_locations_table()
+
+random.seed(3)
+conn = models.get_connection()
+cur = conn.cursor()
+cur.execute("INSERT INTO users (name, email, password, role) VALUES ('Dueño', 'owner@bench', 'x', 'arrendador')")
+owner_id = cur.lastrowid
+targets = {}
+for i in range(n_drivers):
+    cur.execute("INSERT INTO users (name, email, password, role) VALUES (?, ?, 'x', 'conductor')", (f'C{i}', f'c{i}@bench'))
+    driver_id = cur.lastrowid
+    lat, lon = 4.6 + random.uniform(-0.1, 0.1), -74.08 + random.uniform(-0.1, 0.1)
+    cur.execute('INSERT INTO parkings (owner_id, name, latitude, longitude, active) VALUES (?, ?, ?, ?, 0)',
+                (owner_id, f'P{i}', lat, lon))
+    cur.execute("INSERT INTO reservations (driver_id, parking_id, status, eta_minutes) VALUES (?, ?, 'pending', 10)",
+                (driver_id, cur.lastrowid))
+    targets[driver_id] = (lat, lon)
+conn.commit()
+conn.close()
+drivers = list(targets)
+
+
+def far_batch(driver_id, t):
+    lat, lon = targets[driver_id]
+    return [(lat + 0.02, lon + 0.02 + j * 1e-5, t + j, 10.0) for j in range(per_batch)]
+
+
+# 1. Almacenamiento en memoria
+t0 = time.perf_counter()
+for b in range(n_batches):
+    for d in drivers:
+        location_store.ingest(d, far_batch(d, b * per_batch))
+elapsed = time.perf_counter() - t0
+total = n_batches * n_drivers * per_batch
+print(f'LocationStore.ingest: {total} fixes en {elapsed:.2f}s -> {total / elapsed:,.0f} fixes/s, '
+      f'{n_batches * n_drivers / elapsed:,.0f} lotes/s')
+
+# 2. Endpoint HTTP (un worker, sin red)
+clients = {}
+for d in drivers[:100]:
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s['user_id'] = d
+    clients[d] = c
+requests_sent = 0
+t0 = time.perf_counter()
+for b in range(n_batches):
+    for d, c in clients.items():
+        fixes = [{'lat': f[0], 'lon': f[1], 'ts': 1e9 + f[2], 'accuracy': f[3]} for f in far_batch(d, b)]
+        r = c.post('/api/drivers/location', json={'fixes': fixes})
+        assert r.status_code == 200, r.data
+        requests_sent += 1
+elapsed = time.perf_counter() - t0
+print(f'POST /api/drivers/location: {requests_sent} peticiones en {elapsed:.2f}s -> '
+      f'{requests_sent / elapsed:,.0f} req/s, {requests_sent * per_batch / elapsed:,.0f} fixes/s')
+
+# 3. Escrituras coalescidas y llegada automática
+location_store.flush()
+print('Estadísticas:', location_store.stats)
+for d in drivers:
+    lat, lon = targets[d]
+    location_store.ingest(d, [(lat, lon, 1e10, 5.0), (lat + 1e-5, lon, 1e10 + 1, 5.0)])
+conn = models.get_connection()
+active = conn.execute("SELECT COUNT(*) FROM reservations WHERE status = 'active'").fetchone()[0]
+rows = conn.execute('SELECT COUNT(*) FROM driver_locations').fetchone()[0]
+conn.close()
+print(f'Reservas marcadas como llegada automáticamente: {active}/{n_drivers}')
+print(f'Filas en driver_locations: {rows} (una por conductor)')
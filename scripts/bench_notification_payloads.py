@@ -0,0 +1,75 @@
+"""Benchmark de serialización de /api/notifications (utils/notification_payloads.py).
+
+Crea N notificaciones con extra_data tipado para un usuario y mide, por cada 1000
+notificaciones:
+- serialización: armar dicts por fila + json.dumps (como jsonify) frente a concatenar
+  los fragmentos guardados al escribir,
+- extremo a extremo: consulta a la DB + serialización con cada camino.
+
+Ejecutar con: python3 scripts/bench_notification_payloads.py [notificaciones] [repeticiones]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+import models  # noqa: E402
+
+models.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_payloads.db')
+
+from utils.notification_payloads import splice_json  # noqa: E402
+
+n_notifications = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+models.create_users_table()
+models.create_notifications_table()
+models.create_resource_versions_table()
+conn = models.get_connection()
+conn.execute("INSERT INTO users (name, email, password, role) VALUES ('Conductor', 'driver@bench', 'x', 'conductor')")
+conn.commit()
+conn.close()
+
+random.seed(5)
+samples = [
+    ('vehicle_parked', lambda i: {'parking_name': f'Parqueadero {i}', 'duration_minutes': 30,
+                                  'occupied_since': '2026-01-01T10:00:00+00:00'}),
+    ('reservation_completed', lambda i: {'completed_by': 'self', 'parking_name': f'Parqueadero {i}',
+                                         'elapsed_minutes': 42, 'amount': 4200}),
+    ('extra_time_approved', lambda i: {'extra_minutes': 15, 'owner_name': 'Dueño'}),
+    ('at_vehicle', lambda i: {'driver_id': 1}),
+]
+for i in range(n_notifications):
+    type, extra = random.choice(samples)
+    models.add_notification(1, f'Notificación {i} de prueba con acentos: reservación', type,
+                            reservation_id=i, owner_id=2, eta=5, extra_data=extra(i))
+
+
+def per_1k(fn):
+    fn()  # calentar
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1000 / n_notifications * 1000
+
+
+dicts = models.get_notifications_by_user(1)
+# Camino anterior: extra_data como string JSON dentro del JSON de la respuesta
+legacy = [dict(d, extra_data=json.dumps(d['extra_data'])) for d in dicts]
+fragments = models.get_notifications_json_by_user(1)
+fields = {'success': True, 'cursor': n_notifications, 'has_more': False, 'state_version': 0}
+
+print(f'{n_notifications} notificaciones, {repeats} repeticiones (ms por 1000 notificaciones)')
+print(f"{'serialización dicts (string anidado)':<42} {per_1k(lambda: json.dumps(dict(fields, notifications=legacy), sort_keys=True)):8.3f}")
+print(f"{'serialización dicts (objeto)':<42} {per_1k(lambda: json.dumps(dict(fields, notifications=dicts), sort_keys=True)):8.3f}")
+print(f"{'fragmentos pre-serializados':<42} {per_1k(lambda: splice_json('notifications', [f[1] for f in fragments], **fields)):8.3f}")
+print(f"{'DB + dicts + json.dumps':<42} {per_1k(lambda: json.dumps(dict(fields, notifications=models.get_notifications_by_user(1)), sort_keys=True)):8.3f}")
+print(f"{'DB + fragmentos':<42} {per_1k(lambda: splice_json('notifications', [f[1] for f in models.get_notifications_json_by_user(1)], **fields)):8.3f}")
+
+# Las dos representaciones deben decodificar igual
+assert json.loads(splice_json('notifications', [f[1] for f in fragments], **fields)) == dict(fields, notifications=dicts)
@@ -0,0 +1,109 @@
+"""Benchmark del snapshot compartido de parqueaderos (utils/parking_snapshot.py).
+
+Publica un snapshot con N parqueaderos aleatorios en Bogotá y mide:
+- el tiempo de publicación (lectura de la DB + escritura atómica),
+- consultas bbox y nearby sobre los arreglos mapeados,
+- la memoria privada (USS) de varios procesos "worker" que mapean el mismo
+  archivo: debe mantenerse constante aunque crezca el número de workers,
+- el cambio de versión visto por un worker tras republicar.
+
+Ejecutar con: python3 scripts/bench_parking_snapshot.py [parqueaderos] [workers]
+"""
+
+import multiprocessing as mp
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+import models  # noqa: E402
+
+models.DB_PATH = os.path.join(tempfile.mkdtemp(), 'bench_snapshot.db')
+
+from utils.parking_snapshot import (  # noqa: E402
+    ParkingSnapshot, get_parking_snapshot, publish_parking_snapshot, snapshot_path,
+)
+
+n_parkings = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+models.create_users_table()
+models.create_parkings_table()
+random.seed(11)
+conn = models.get_connection()
+conn.execute("INSERT INTO users (name, email, password, role) VALUES ('Dueño', 'owner@bench', 'x', 'arrendador')")
+conn.executemany('INSERT INTO parkings (owner_id, name, latitude, longitude, active) VALUES (1, ?, ?, ?, ?)',
+                 [(f'P{i}', random.uniform(4.45, 4.85), random.uniform(-74.25, -73.98), int(random.random() < 0.8))
+                  for i in range(n_parkings)])
+conn.commit()
+conn.close()
+
+t0 = time.perf_counter()
+publish_parking_snapshot()
+print(f'Publicación de {n_parkings} parqueaderos: {(time.perf_counter() - t0) * 1000:.1f} ms '
+      f'({os.path.getsize(os.path.join(os.path.dirname(models.DB_PATH), "parkings.snapshot")) / 1e6:.1f} MB)')
+
+snapshot = get_parking_snapshot()
+assert not snapshot.ids.flags.owndata and not snapshot.active.flags.owndata  # vistas sin copia
+
+
+def timed(fn, runs=200):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    return (time.perf_counter() - t0) / runs * 1000, result
+
+
+ms, pos = timed(lambda: snapshot.bbox(4.60, -74.10, 4.62, -74.08))
+print(f'bbox ~2x2 km: {ms:.3f} ms ({len(pos)} resultados)')
+ms, (pos, dist) = timed(lambda: snapshot.nearby(4.65, -74.06, 1000))
+print(f'nearby 1 km: {ms:.3f} ms ({len(pos)} resultados)')
+
+
+def _uss_kb():
+    """Memoria privada del proceso (Private_Clean + Private_Dirty de /proc/self/smaps_rollup)."""
+    total = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean', 'Private_Dirty')):
+                total += int(line.split()[1])
+    return total
+
+
+def worker(queue):
+    before = _uss_kb()
+    s = get_parking_snapshot()
+    for _ in range(50):
+        s.nearby(4.65, -74.06, 2000)
+        s.bbox(4.5, -74.2, 4.8, -74.0)
+    queue.put((os.getpid(), s.version, _uss_kb() - before))
+
+
+if os.path.exists('/proc/self/smaps_rollup'):
+    ctx = mp.get_context('fork')
+    for workers in (1, n_workers):
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(queue,)) for _ in range(workers)]
+        for p in procs:
+            p.start()
+        results = [queue.get() for _ in procs]
+        for p in procs:
+            p.join()
+        growth = [r[2] for r in results]
+        print(f'{workers} worker(s): memoria privada adicional por worker '
+              f'{min(growth)}-{max(growth)} KB (snapshot v{results[0][1]})')
+
+# Cambio de versión atómico visto por un lector existente
+old_version = snapshot.version
+publish_parking_snapshot()
+new = get_parking_snapshot()
+fresh = ParkingSnapshot(snapshot_path())
+assert new.version == old_version + 1
+assert np.array_equal(snapshot.ids, fresh.ids) and np.array_equal(snapshot.lats, fresh.lats)
+print(f'Versión {old_version} -> {new.version}; el mapeo anterior sigue siendo legible')
@@ -0,0 +1,156 @@
+"""Benchmark del bus de eventos entre workers (utils/pubsub.py).
+
+Arranca W procesos "worker" suscritos a un canal y mide, desde un proceso
+publicador, la latencia de entrega de un mensaje a todos los workers
+(CLOCK_MONOTONIC es común a todos los procesos del host):
+- bus Unix (sockets de datagramas, sin broker),
+- bus Redis contra un fake en memoria con la misma interfaz que redis-py
+  (mide el coste del bus en sí, sin red; con un Redis real usar TINCAR_BUS).
+
+Ejecutar con: python3 scripts/bench_pubsub.py [mensajes] [workers]
+"""
+
+import multiprocessing as mp
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+from utils.pubsub import UnixSocketBus, RedisBus  # noqa: E402
+
+n_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+n_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6  # noqa: E731
+    print(f'{name:<28} n={len(latencies):>6}  media={statistics.mean(latencies) * 1e6:7.1f} us  '
+          f'p50={p(0.50):7.1f} us  p99={p(0.99):7.1f} us  max={latencies[-1] * 1e6:8.1f} us')
+
+
+# ---- bus Unix: procesos reales ----
+
+def unix_worker(directory, ready, results):
+    bus = UnixSocketBus(directory)
+    latencies = []
+    done = threading.Event()
+
+    def on_ping(message):
+        if message.get('end'):
+            done.set()
+        else:
+            latencies.append(time.monotonic() - message['t'])
+
+    bus.subscribe('ping', on_ping)
+    ready.put(1)
+    done.wait(60)
+    results.put((latencies, bus.stats['dropped']))
+    bus.close()
+
+
+def bench_unix():
+    directory = tempfile.mkdtemp(prefix='tincar-bus-')
+    ctx = mp.get_context('fork')
+    ready, results = ctx.Queue(), ctx.Queue()
+    workers = [ctx.Process(target=unix_worker, args=(directory, ready, results)) for _ in range(n_workers)]
+    for w in workers:
+        w.start()
+    for _ in workers:
+        ready.get()
+    bus = UnixSocketBus(directory)
+    time.sleep(0.1)
+    for i in range(n_messages):
+        bus.publish('ping', {'t': time.monotonic(), 'i': i})
+        # Ritmo realista (no saturar los buffers de los sockets)
+        time.sleep(0.0002)
+    time.sleep(0.2)
+    bus.publish('ping', {'end': True})
+    latencies, dropped = [], 0
+    for _ in workers:
+        lat, drop = results.get()
+        latencies.extend(lat)
+        dropped += drop
+    for w in workers:
+        w.join()
+    bus.close()
+    report(f'unix ({n_workers} workers)', latencies)
+    lost = n_messages * n_workers - len(latencies)
+    print(f'{"":<28} entregados={len(latencies)}/{n_messages * n_workers}  perdidos={lost}')
+
+
+# ---- bus Redis contra un fake en memoria ----
+
+class FakeRedis:
+    """Servidor pub/sub mínimo con la interfaz de redis-py usada por RedisBus."""
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def publish(self, channel, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.push(channel, data)
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    def __init__(self, server):
+        self._server = server
+        self._queue = queue.Queue()
+        self._prefix = None
+
+    def psubscribe(self, pattern):
+        self._prefix = pattern.rstrip('*')
+        with self._server._lock:
+            self._server._subscribers.append(self)
+
+    def push(self, channel, data):
+        if channel.startswith(self._prefix):
+            self._queue.put({'type': 'pmessage', 'pattern': self._prefix + '*',
+                             'channel': channel.encode(), 'data': data.encode()})
+
+    def get_message(self, timeout=0.0):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def bench_redis_fake():
+    server = FakeRedis()
+    buses = [RedisBus(client=server) for _ in range(n_workers)]
+    latencies = []
+    lock = threading.Lock()
+    received = threading.Semaphore(0)
+
+    def on_ping(message):
+        with lock:
+            latencies.append(time.monotonic() - message['t'])
+        received.release()
+
+    for bus in buses:
+        bus.subscribe('ping', on_ping)
+    publisher = RedisBus(client=server)
+    for i in range(n_messages):
+        publisher.publish('ping', {'t': time.monotonic(), 'i': i})
+        for _ in buses:
+            received.acquire()
+    for bus in buses + [publisher]:
+        bus.close()
+    report(f'redis fake ({n_workers} buses)', latencies)
+
+
+if __name__ == '__main__':
+    print(f'{n_messages} mensajes, {n_workers} workers')
+    bench_unix()
+    bench_redis_fake()
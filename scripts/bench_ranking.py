@@ -0,0 +1,60 @@
+"""Benchmark del ranking vectorizado de parqueaderos (utils/ranking.py).
+
+Genera 1.000 conductores y 10.000 parqueaderos aleatorios alrededor de varias
+ciudades de Colombia y mide el tiempo de calcular la matriz distancia/ETA y el
+top-k por conductor.
+
+Ejecutar con: python3 scripts/bench_ranking.py [conductores] [parqueaderos] [k]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+from utils.ranking import rank_parkings  # noqa: E402
+
+CITIES = [
+    ('Bogotá', 4.6097, -74.0817),
+    ('Medellín', 6.2442, -75.5812),
+    ('Cali', 3.4516, -76.5320),
+    ('Barranquilla', 10.9685, -74.7813),
+    ('Bucaramanga', 7.1193, -73.1227),
+]
+
+n_drivers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+n_parkings = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+rng = np.random.default_rng(42)
+
+
+def _points(n):
+    idx = rng.integers(0, len(CITIES), size=n)
+    lat = np.array([CITIES[i][1] for i in idx]) + rng.normal(0, 0.05, size=n)
+    lon = np.array([CITIES[i][2] for i in idx]) + rng.normal(0, 0.05, size=n)
+    return idx, lat, lon
+
+
+_, d_lat, d_lon = _points(n_drivers)
+p_idx, p_lat, p_lon = _points(n_parkings)
+drivers = [{'id': i, 'lat': d_lat[i], 'lon': d_lon[i]} for i in range(n_drivers)]
+parkings = [{'id': i, 'latitude': p_lat[i], 'longitude': p_lon[i], 'city': CITIES[p_idx[i]][0]}
+            for i in range(n_parkings)]
+
+print(f'Conductores: {n_drivers}  Parqueaderos: {n_parkings}  k={k}')
+rank_parkings(drivers[:10], parkings, k=k)  # calentamiento
+
+runs = []
+for _ in range(5):
+    t0 = time.perf_counter()
+    result = rank_parkings(drivers, parkings, k=k)
+    runs.append(time.perf_counter() - t0)
+
+pairs = n_drivers * n_parkings
+best = min(runs)
+print(f'Mejor: {best * 1000:.1f} ms  Mediana: {sorted(runs)[len(runs) // 2] * 1000:.1f} ms')
+print(f'Pares conductor-parqueadero por segundo: {pairs / best:,.0f}')
+print('Ejemplo conductor 0:', result[0]['parkings'][:3])
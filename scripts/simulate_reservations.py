@@ -0,0 +1,249 @@
+"""Simulador de tráfico de reservas en tiempo virtual (utils/clock.py).
+
+Conductores y arrendadores sintéticos recorren reserva → llegada → tiempo extra →
+finalización contra las rutas de app.py (cliente de pruebas de Flask) sobre una DB
+temporal. Un VirtualClock salta de evento en evento, así que un día de tráfico corre en
+lo que tardan las peticiones (unos segundos por cada cien conductores); los plazos (ETA
+vencido, fin del tiempo) los dispara scheduler.DeadlineScheduler con run_pending() en su
+instante exacto.
+
+Cada conductor hace un viaje en el día (70% en las horas pico de las 8 y las 18):
+- 15% no llega: vence el ETA y la mitad cancela unos minutos después; las demás las
+  libera el scheduler al pasar la gracia (utils/no_show.py),
+- el resto llega antes del ETA y reserva 30, 60 o 120 minutos; 30% pide tiempo extra y el
+  arrendador lo aprueba (70%) o lo rechaza,
+- el arrendador finaliza entre 5 minutos antes y 15 después del final (si se pasa, vence
+  la duración).
+
+Informa, por etapa, operaciones, errores, throughput (operaciones por segundo real de esa
+etapa) y latencia real p50/p95/p99/max.
+
+Ejecutar con: python3 scripts/simulate_reservations.py [conductores] [horas]   (por defecto 2000 24)
+"""
+
+import contextlib
+import heapq
+import io
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'TinCar'))
+import models  # noqa: E402
+from utils import clock  # noqa: E402
+
+n_drivers = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+hours = float(sys.argv[2]) if len(sys.argv) > 2 else 24.0
+n_owners = max(1, n_drivers // 10)
+PARKINGS_PER_OWNER = 3
+
+workdir = tempfile.mkdtemp()
+models.DB_PATH = os.path.join(workdir, 'sim.db')
+# Día simulado desde la medianoche UTC de hoy
+start = time.time() // 86400 * 86400
+virtual = clock.VirtualClock(start=start)
+clock.set_clock(virtual)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as appmod  # noqa: E402
+    from scheduler import deadline_scheduler  # noqa: E402
+    for fn in [n for n in dir(models) if n.startswith('create_') and n.endswith('_table')]:
+        getattr(models, fn)()
+
+random.seed(n_drivers)
+conn = models.get_connection()
+conn.executemany("INSERT INTO users (name, email, password, role) VALUES (?, ?, 'x', ?)",
+                 [(f'Arrendador {i}', f'a{i}@sim', 'arrendador') for i in range(n_owners)] +
+                 [(f'Conductor {i}', f'c{i}@sim', 'conductor') for i in range(n_drivers)])
+owners = list(range(1, n_owners + 1))
+drivers = list(range(n_owners + 1, n_owners + n_drivers + 1))
+conn.executemany('INSERT INTO parkings (owner_id, name, latitude, longitude, active) VALUES (?, ?, ?, ?, 1)',
+                 [(owner, f'Parqueadero {owner}-{k}', 6.2 + random.random() / 10, -75.6 + random.random() / 10)
+                  for owner in owners for k in range(PARKINGS_PER_OWNER)])
+conn.commit()
+parking_owner = {row[0]: row[1] for row in conn.execute('SELECT id, owner_id FROM parkings')}
+conn.close()
+free_parkings = set(parking_owner)
+
+_clients = {}
+
+
+def client(user_id, role):
+    c = _clients.get(user_id)
+    if c is None:
+        c = _clients[user_id] = appmod.app.test_client()
+        with c.session_transaction() as s:
+            s['user_id'] = user_id
+            s['role'] = role
+    return c
+
+
+latencies = {}
+errors = {}
+
+
+def call(stage, user_id, role, url, payload=None):
+    started = time.perf_counter()
+    response = client(user_id, role).post(url, json=payload or {})
+    latencies.setdefault(stage, []).append((time.perf_counter() - started) * 1000)
+    body = response.get_json(silent=True) or {}
+    if response.status_code != 200 or not body.get('success'):
+        errors[stage] = errors.get(stage, 0) + 1
+        return None
+    return body
+
+
+trips = {}
+
+
+def timed_handler(kind, handler):
+    def run(reservation_id):
+        started = time.perf_counter()
+        try:
+            acted = handler(reservation_id)
+        finally:
+            latencies.setdefault(f'plazo {kind}', []).append((time.perf_counter() - started) * 1000)
+        if kind == 'release' and acted:
+            free_parkings.add(trips[reservation_id]['parking_id'])
+        return acted
+    return run
+
+
+# --- eventos -----------------------------------------------------------------------------
+
+events = []
+_seq = itertools.count()
+
+
+def at(ts, action, *args):
+    heapq.heappush(events, (ts, next(_seq), action, args))
+
+
+def reserve(driver):
+    if not free_parkings:
+        errors['sin cupo'] = errors.get('sin cupo', 0) + 1
+        return
+    parking_id = random.choice(tuple(free_parkings))
+    eta = random.randint(5, 20)
+    body = call('reserva', driver, 'conductor', '/api/reservations',
+                {'parking_id': parking_id, 'eta_minutes': eta, 'duration_minutes': random.choice((30, 60, 120))})
+    if body is None:
+        return
+    free_parkings.discard(parking_id)
+    trip = {'id': body['reservation']['id'], 'driver': driver, 'parking_id': parking_id,
+            'owner': parking_owner[parking_id], 'duration': body['reservation']['duration_minutes']}
+    trips[trip['id']] = trip
+    now = clock.now()
+    no_show = random.random()
+    if no_show < 0.075:
+        at(now + (eta + random.randint(2, 10)) * 60, cancel, trip)
+    elif no_show >= 0.15:
+        at(now + eta * random.uniform(0.5, 1.0) * 60, arrive, trip)
+
+
+def arrive(trip):
+    if call('llegada', trip['driver'], 'conductor', f"/api/reservations/{trip['id']}/arrived") is None:
+        return
+    now = clock.now()
+    end = now + trip['duration'] * 60
+    if random.random() < 0.3:
+        extra = random.choice((10, 20, 30))
+        at(now + trip['duration'] * random.uniform(0.5, 0.9) * 60, request_extra_time, trip, extra, end)
+    else:
+        at(end + random.uniform(-5, 15) * 60, finish, trip)
+
+
+def request_extra_time(trip, extra, end):
+    if call('pedir tiempo extra', trip['driver'], 'conductor', f"/api/reservations/{trip['id']}/request-extra-time",
+            {'extra_minutes': extra}) is None:
+        return
+    approved = random.random() < 0.7
+    at(clock.now() + random.uniform(1, 3) * 60, answer_extra_time, trip, extra, approved, end)
+
+
+def answer_extra_time(trip, extra, approved, end):
+    action = 'approve' if approved else 'reject'
+    call('aprobar tiempo extra' if approved else 'rechazar tiempo extra', trip['owner'], 'arrendador',
+         f"/api/reservations/{trip['id']}/{action}-extra-time", {'extra_minutes': extra})
+    at((end + extra * 60 if approved else end) + random.uniform(-5, 15) * 60, finish, trip)
+
+
+def finish(trip):
+    if call('finalizar', trip['owner'], 'arrendador', f"/api/reservations/{trip['id']}/finish") is not None:
+        free_parkings.add(trip['parking_id'])
+
+
+def cancel(trip):
+    if call('cancelar', trip['driver'], 'conductor', f"/api/reservations/{trip['id']}/cancel") is not None:
+        free_parkings.add(trip['parking_id'])
+
+
+def trip_start():
+    """Hora del viaje: 70% alrededor de las horas pico, el resto uniforme."""
+    if random.random() < 0.7:
+        hour = random.gauss(random.choice((8, 18)), 1.5)
+    else:
+        hour = random.uniform(0, 24)
+    return start + (hour % 24) * 3600
+
+
+for driver in drivers:
+    ts = trip_start()
+    if ts < start + hours * 3600:
+        at(ts, reserve, driver)
+
+# --- ejecución ---------------------------------------------------------------------------
+
+for kind, handler in list(deadline_scheduler.handlers.items()):
+    deadline_scheduler.handlers[kind] = timed_handler(kind, handler)
+
+wall_started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    deadline_scheduler.start(background=False)
+    while events:
+        ts, _, action, args = heapq.heappop(events)
+        # Disparar en su instante los plazos que vencen antes del próximo evento
+        while True:
+            deadline_scheduler.run_pending()
+            upcoming = deadline_scheduler.next_deadline()
+            if upcoming is None or upcoming[0] > ts:
+                break
+            virtual.set(max(upcoming[0], clock.now()))
+        virtual.set(max(ts, clock.now()))
+        action(*args)
+    deadline_scheduler.run_pending()
+    deadline_scheduler.stop()
+wall_ms = (time.perf_counter() - wall_started) * 1000
+virtual_s = clock.now() - start
+clock.set_clock(None)
+
+
+def pct(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+print(f'{n_drivers} conductores, {n_owners} arrendadores, {len(parking_owner)} parqueaderos')
+print(f'{virtual_s / 3600:.1f} h virtuales en {wall_ms / 1000:.1f} s reales '
+      f'({virtual_s / (wall_ms / 1000):,.0f}x)')
+print()
+print(f"{'etapa':<22} {'ops':>6} {'errores':>8} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+total = 0
+for stage, values in latencies.items():
+    values = sorted(values)
+    total += len(values)
+    print(f'{stage:<22} {len(values):>6} {errors.get(stage, 0):>8} {len(values) / (sum(values) / 1000):>8.0f} '
+          f'{pct(values, 0.5):>8.2f} {pct(values, 0.95):>8.2f} {pct(values, 0.99):>8.2f} {values[-1]:>8.2f}')
+if errors.get('sin cupo'):
+    print(f"{'sin cupo':<22} {errors['sin cupo']:>6}")
+print()
+print(f'{total} operaciones, {total / (wall_ms / 1000):.0f} op/s en total')
+snapshot = deadline_scheduler.metrics.snapshot()
+for kind, job in snapshot['jobs'].items():
+    print(f"plazos {kind}: {job['fired']} disparados, {job['acted']} procesados, lag {job['lag_ms']}")
+
+shutil.rmtree(workdir, ignore_errors=True)